@@ -0,0 +1,221 @@
+"""
+This module provides CompactTopology, an array-backed representation of
+the densified road topology used by GlobalRoutePlanner
+"""
+
+import math
+import numpy as np
+
+import carla
+
+
+class CompactTopology(object):
+    """
+    Struct-of-arrays topology. The sampled points of every road segment
+    (entry waypoint, intermediate path, exit waypoint) are stored back to
+    back in one contiguous buffer of NumPy arrays; segment i owns the
+    points offsets[i] up to offsets[i+1] (exclusive).
+
+    Point attributes:
+        points_xyz      -   (n_points, 3) locations in world map, x, y and z
+                            are views of its columns
+        yaw, pitch      -   orientation in degrees
+        s               -   OpenDRIVE distance along the road reference line
+        road_id, section_id, lane_id -   OpenDRIVE ids
+        lane_change     -   lane changes allowed by the lane markings, the
+                            carla.LaneChange.Right bit of the right marking
+                            and the carla.LaneChange.Left bit of the left one
+    Segment attributes:
+        entry_xyz       -   rounded (x,y,z) of entry point, used as graph node key
+        exit_xyz        -   rounded (x,y,z) of exit point, used as graph node key
+        is_junction     -   whether the entry point lies in a junction
+
+    It holds no carla objects, so it can be pickled or shared between
+    processes. carla.Waypoint objects are only created on demand by
+    waypoint().
+    """
+
+    POINT_FIELDS = (
+        ('yaw', np.float32), ('pitch', np.float32), ('s', np.float64),
+        ('road_id', np.int32), ('section_id', np.int32), ('lane_id', np.int16), ('lane_change', np.uint8))
+
+    def __init__(self, points_xyz, points, offsets, entry_xyz, exit_xyz, is_junction):
+        """
+        Constructor method.
+
+            :param points_xyz: (n_points, 3) array of point locations
+            :param points: dictionary with one array per name in POINT_FIELDS
+            :param offsets: array of n_segments + 1 buffer offsets
+            :param entry_xyz: (n_segments, 3) array of rounded entry locations
+            :param exit_xyz: (n_segments, 3) array of rounded exit locations
+            :param is_junction: boolean array of n_segments
+        """
+        self.points_xyz = np.ascontiguousarray(points_xyz, dtype=np.float64).reshape(-1, 3)
+        for name, dtype in self.POINT_FIELDS:
+            setattr(self, name, np.ascontiguousarray(points[name], dtype=dtype))
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.entry_xyz = np.asarray(entry_xyz, dtype=np.float64).reshape(-1, 3)
+        self.exit_xyz = np.asarray(exit_xyz, dtype=np.float64).reshape(-1, 3)
+        self.is_junction = np.asarray(is_junction, dtype=bool)
+
+    @classmethod
+    def from_segments(cls, segments):
+        """
+        Builds the topology from a list of segments, each one a tuple
+        (entry_xyz, exit_xyz, is_junction, waypoints) where waypoints is the
+        list of carla.Waypoint from entry to exit, both included.
+        """
+        builder = _Builder()
+        for entry_xyz, exit_xyz, is_junction, waypoints in segments:
+            builder.add(entry_xyz, exit_xyz, is_junction, waypoints)
+        return builder.build()
+
+    def extend(self, segments):
+        """
+        Returns a new topology holding these segments followed by the
+        given ones, in the format accepted by from_segments.
+        """
+        builder = _Builder()
+        for entry_xyz, exit_xyz, is_junction, waypoints in segments:
+            builder.add(entry_xyz, exit_xyz, is_junction, waypoints)
+        if not builder.offsets[1:]:
+            return self
+        extra = builder.build()
+        points_xyz = np.concatenate((self.points_xyz, extra.points_xyz))
+        points = {name: np.concatenate((getattr(self, name), getattr(extra, name)))
+                  for name, _ in self.POINT_FIELDS}
+        offsets = np.concatenate((self.offsets, extra.offsets[1:] + self.offsets[-1]))
+        return CompactTopology(
+            points_xyz, points, offsets,
+            np.concatenate((self.entry_xyz, extra.entry_xyz)),
+            np.concatenate((self.exit_xyz, extra.exit_xyz)),
+            np.concatenate((self.is_junction, extra.is_junction)))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def num_points(self):
+        """ Number of points in the buffer """
+        return len(self.points_xyz)
+
+    @property
+    def x(self):
+        return self.points_xyz[:, 0]
+
+    @property
+    def y(self):
+        return self.points_xyz[:, 1]
+
+    @property
+    def z(self):
+        return self.points_xyz[:, 2]
+
+    @property
+    def nbytes(self):
+        """ Memory held by the arrays, in bytes """
+        arrays = [self.points_xyz] + [getattr(self, name) for name, _ in self.POINT_FIELDS]
+        arrays += [self.offsets, self.entry_xyz, self.exit_xyz, self.is_junction]
+        return sum(array.nbytes for array in arrays)
+
+    def entry_index(self, segment):
+        """ Buffer index of the entry point of a segment """
+        return int(self.offsets[segment])
+
+    def exit_index(self, segment):
+        """ Buffer index of the exit point of a segment """
+        return int(self.offsets[segment + 1]) - 1
+
+    def point_indices(self, segment):
+        """ Buffer indices of all points of a segment, entry and exit included """
+        return range(int(self.offsets[segment]), int(self.offsets[segment + 1]))
+
+    def path_indices(self, segment):
+        """ Buffer indices of the intermediate path of a segment """
+        return range(int(self.offsets[segment]) + 1, int(self.offsets[segment + 1]) - 1)
+
+    def entry_key(self, segment):
+        """ Rounded (x,y,z) of the entry point of a segment """
+        return tuple(float(value) for value in self.entry_xyz[segment])
+
+    def exit_key(self, segment):
+        """ Rounded (x,y,z) of the exit point of a segment """
+        return tuple(float(value) for value in self.exit_xyz[segment])
+
+    def lane_key(self, index):
+        """ (road_id, section_id, lane_id) of a point """
+        return int(self.road_id[index]), int(self.section_id[index]), int(self.lane_id[index])
+
+    def location(self, index):
+        """ carla.Location of a point """
+        x, y, z = self.points_xyz[index]
+        return carla.Location(x=float(x), y=float(y), z=float(z))
+
+    def xyz(self, indices):
+        """ (n, 3) array with the locations of the given points, a view for ranges """
+        if isinstance(indices, range):
+            indices = slice(indices.start, indices.stop)
+        return self.points_xyz[indices]
+
+    def forward_vector(self, index):
+        """ Unit vector along the tangent at a point, as carla.Rotation.get_forward_vector """
+        yaw, pitch = math.radians(self.yaw[index]), math.radians(self.pitch[index])
+        return np.array([math.cos(pitch) * math.cos(yaw), math.cos(pitch) * math.sin(yaw), math.sin(pitch)])
+
+    def waypoint(self, index, dao, t=0.0):
+        """
+        Creates the carla.Waypoint of a point from its OpenDRIVE coordinates.
+        Lane section borders are ambiguous in road s, so the neighbouring s
+        values are tried before falling back to the closest waypoint to the
+        stored location.
+
+            :param index: buffer index of the point
+            :param dao: GlobalRoutePlannerDAO used to query the map
+            :param t: fraction of the way towards point index+1, for locations
+                between two sampled points of the same segment
+        """
+        road_id, section_id, lane_id = self.lane_key(index)
+        s = float(self.s[index])
+        if t > 0.0:
+            s += t * (float(self.s[index + 1]) - s)
+        for candidate in (s, s + 1e-3, s - 1e-3):
+            waypoint = dao.get_waypoint_xodr(road_id, lane_id, candidate)
+            if waypoint is not None and waypoint.section_id == section_id:
+                return waypoint
+        x, y, z = self.points_xyz[index]
+        if t > 0.0:
+            x, y, z = self.points_xyz[index] + t * (self.points_xyz[index + 1] - self.points_xyz[index])
+        return dao.get_waypoint(carla.Location(x=float(x), y=float(y), z=float(z)))
+
+
+class _Builder(object):
+    """ Accumulates segments in Python lists before freezing them into arrays """
+
+    def __init__(self):
+        self.xyz = []
+        self.columns = {name: [] for name, _ in CompactTopology.POINT_FIELDS}
+        self.offsets = [0]
+        self.entry_xyz = []
+        self.exit_xyz = []
+        self.is_junction = []
+
+    def add(self, entry_xyz, exit_xyz, is_junction, waypoints):
+        columns = self.columns
+        for waypoint in waypoints:
+            transform = waypoint.transform
+            self.xyz.append((transform.location.x, transform.location.y, transform.location.z))
+            columns['yaw'].append(transform.rotation.yaw)
+            columns['pitch'].append(transform.rotation.pitch)
+            columns['s'].append(waypoint.s)
+            columns['road_id'].append(waypoint.road_id)
+            columns['section_id'].append(waypoint.section_id)
+            columns['lane_id'].append(waypoint.lane_id)
+            columns['lane_change'].append(int(waypoint.right_lane_marking.lane_change & carla.LaneChange.Right) |
+                                          int(waypoint.left_lane_marking.lane_change & carla.LaneChange.Left))
+        self.offsets.append(self.offsets[-1] + len(waypoints))
+        self.entry_xyz.append(entry_xyz)
+        self.exit_xyz.append(exit_xyz)
+        self.is_junction.append(is_junction)
+
+    def build(self):
+        return CompactTopology(self.xyz, self.columns, self.offsets, self.entry_xyz, self.exit_xyz, self.is_junction)
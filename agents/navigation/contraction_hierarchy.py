@@ -0,0 +1,414 @@
+"""
+This module provides ContractionHierarchy, a shortcut index over the
+CSRGraph of GlobalRoutePlanner for fast shortest path queries
+"""
+
+import heapq
+
+import numpy as np
+
+from agents.navigation.csr_graph import NoPathError
+
+
+class ContractionHierarchy(object):
+    """
+    Contraction hierarchy of a CSRGraph, lane change edges included.
+    Nodes are contracted one by one in order of their edge difference;
+    contracting a node adds a shortcut u -> w for every pair of its
+    neighbours whose only shortest path goes through it. A query is a
+    pair of Dijkstra searches from both ends that only climb towards higher
+    ranked nodes; the shortest path goes through the best node reached by
+    both, and its shortcuts are then unpacked into the original node path.
+    Those upward searches only depend on their own end, so by default they
+    are run for every node when the hierarchy is built and stored as its
+    search spaces: a query then only looks for the best node common to the
+    search spaces of its ends.
+
+    Attributes (all arrays, so the hierarchy pickles with the graph):
+        node_ids        -   graph node id of every internal node, as in the CSRGraph
+        rank            -   contraction order of every internal node
+        up_*            -   CSR arrays of the edges to higher ranked nodes
+        down_*          -   CSR arrays of the reversed edges from higher ranked nodes
+        *_middle        -   node contracted by a shortcut, -1 for original edges
+        forward_*       -   CSR arrays of the nodes settled by the upward search from
+                            every node: their internal id, distance and the position of
+                            their parent in the same search space (-1 for the node
+                            itself); empty if search spaces were not stored
+        backward_*      -   the same for the upward searches over the reversed edges
+    """
+
+    ARRAYS = ('node_ids', 'rank', 'up_indptr', 'up_targets', 'up_weights', 'up_middle',
+              'down_indptr', 'down_targets', 'down_weights', 'down_middle',
+              'forward_indptr', 'forward_nodes', 'forward_lengths', 'forward_parents',
+              'backward_indptr', 'backward_nodes', 'backward_lengths', 'backward_parents')
+
+    def __init__(self, **arrays):
+        """
+        Constructor method, takes one array per name in ARRAYS.
+        """
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+        self._prepare()
+
+    @classmethod
+    def build(cls, graph, witness_limit=64, lane_change_cost=1e-3, search_spaces=True):
+        """
+        Contracts every node of a CSRGraph.
+
+            :param graph: CSRGraph
+            :param witness_limit: nodes settled by each witness search; lower is
+                faster to build but may add unnecessary shortcuts
+            :param lane_change_cost: weight added to the zero length lane change
+                edges, so that among equally long paths the one with fewer lane
+                changes is chosen
+            :param search_spaces: whether to store the upward search spaces of
+                every node, which makes queries several times faster for a few
+                tens of entries per node
+        """
+        num_nodes = graph.num_nodes
+        indptr, targets = graph.indptr.tolist(), graph.targets.tolist()
+        lengths = (graph.length + lane_change_cost * (graph.segment < 0)).tolist()
+        edges = dict()      # Map with structure {(u, w): (weight, middle), ... }
+        out_edges = [dict() for _ in range(num_nodes)]
+        in_edges = [dict() for _ in range(num_nodes)]
+        for u in range(num_nodes):
+            for e in range(indptr[u], indptr[u+1]):
+                w = targets[e]
+                if w == u:
+                    continue
+                edges[u, w] = (lengths[e], -1)
+                out_edges[u][w] = lengths[e]
+                in_edges[w][u] = lengths[e]
+
+        contracted = [False] * num_nodes
+        deleted_neighbours = [0] * num_nodes
+        level = [0] * num_nodes
+
+        def shortcuts(v):
+            """ Shortcuts (u, w, weight) needed to contract v """
+            needed = []
+            for u, weight_in in in_edges[v].items():
+                if contracted[u]:
+                    continue
+                limit = max([weight_in + weight_out for w, weight_out in out_edges[v].items()
+                             if w != u and not contracted[w]] or [-1])
+                if limit < 0:
+                    continue
+                witness = _witness_search(out_edges, contracted, u, v, limit, witness_limit)
+                for w, weight_out in out_edges[v].items():
+                    if w == u or contracted[w]:
+                        continue
+                    if witness.get(w, float('inf')) > weight_in + weight_out:
+                        needed.append((u, w, weight_in + weight_out))
+            return needed
+
+        def priority(v):
+            degree = sum(1 for u in in_edges[v] if not contracted[u]) + \
+                sum(1 for w in out_edges[v] if not contracted[w])
+            return 2 * (len(shortcuts(v)) - degree) + deleted_neighbours[v] + level[v]
+
+        queue = [(priority(v), v) for v in range(num_nodes)]
+        heapq.heapify(queue)
+        rank = [0] * num_nodes
+        order = 0
+        while queue:
+            _, v = heapq.heappop(queue)
+            if contracted[v]:
+                continue
+            # Lazy update: contract v only if it is still the cheapest node
+            current = priority(v)
+            if queue and current > queue[0][0]:
+                heapq.heappush(queue, (current, v))
+                continue
+
+            for u, w, weight in shortcuts(v):
+                if weight < out_edges[u].get(w, float('inf')):
+                    out_edges[u][w] = weight
+                    in_edges[w][u] = weight
+                    edges[u, w] = (weight, v)
+            contracted[v] = True
+            rank[v] = order
+            order += 1
+            for neighbour in set(in_edges[v]) | set(out_edges[v]):
+                if not contracted[neighbour]:
+                    deleted_neighbours[neighbour] += 1
+                    level[neighbour] = max(level[neighbour], level[v] + 1)
+
+        up = [[] for _ in range(num_nodes)]
+        down = [[] for _ in range(num_nodes)]
+        for (u, w), (weight, middle) in edges.items():
+            if rank[w] > rank[u]:
+                up[u].append((w, weight, middle))
+            else:
+                down[w].append((u, weight, middle))
+
+        arrays = {'node_ids': np.array(graph.node_ids, dtype=np.int64), 'rank': np.array(rank, dtype=np.int64)}
+        for name, adjacency in (('up', up), ('down', down)):
+            arrays[name + '_indptr'] = np.cumsum([0] + [len(row) for row in adjacency], dtype=np.int64)
+            arrays[name + '_targets'] = np.array([item[0] for row in adjacency for item in row], dtype=np.int64)
+            arrays[name + '_weights'] = np.array([item[1] for row in adjacency for item in row], dtype=np.float64)
+            arrays[name + '_middle'] = np.array([item[2] for row in adjacency for item in row], dtype=np.int64)
+
+        up = [[(item[0], item[1]) for item in row] for row in up]
+        down = [[(item[0], item[1]) for item in row] for row in down]
+        for name, adjacency, stall_adjacency in (('forward', up, down), ('backward', down, up)):
+            spaces = [_upward_search(node, adjacency, stall_adjacency) if search_spaces else []
+                      for node in range(num_nodes)]
+            arrays[name + '_indptr'] = np.cumsum([0] + [len(space) for space in spaces], dtype=np.int64) \
+                if search_spaces else np.zeros(0, dtype=np.int64)
+            arrays[name + '_nodes'] = np.array([item[0] for space in spaces for item in space], dtype=np.int64)
+            arrays[name + '_lengths'] = np.array([item[1] for space in spaces for item in space], dtype=np.float64)
+            arrays[name + '_parents'] = np.array([item[2] for space in spaces for item in space], dtype=np.int64)
+        return cls(**arrays)
+
+    def _prepare(self):
+        """ Builds the Python lookup structures used by the queries """
+        node_ids = self.node_ids.tolist()
+        self._node_ids = node_ids
+        self._internal = {node: i for i, node in enumerate(node_ids)}
+        self._middle = dict()
+        for name in ('up', 'down'):
+            indptr = getattr(self, name + '_indptr').tolist()
+            targets = getattr(self, name + '_targets').tolist()
+            weights = getattr(self, name + '_weights').tolist()
+            middle = getattr(self, name + '_middle').tolist()
+            adjacency = [[(targets[e], weights[e]) for e in range(indptr[i], indptr[i+1])]
+                         for i in range(len(node_ids))]
+            setattr(self, '_' + name, adjacency)
+            for i in range(len(node_ids)):
+                for e in range(indptr[i], indptr[i+1]):
+                    # Down edges are stored reversed, at their end node
+                    key = (i, targets[e]) if name == 'up' else (targets[e], i)
+                    self._middle[key] = middle[e]
+        self._forward_indptr = self.forward_indptr.tolist()
+        self._backward_indptr = self.backward_indptr.tolist()
+        self._unpacked = dict()     # Map with structure {(u, w): [nodes after u up to w], ... }
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    def __setstate__(self, state):
+        for name in self.ARRAYS:
+            setattr(self, name, state[name])
+        self._prepare()
+
+    @property
+    def num_shortcuts(self):
+        """ Number of edges added by the contraction """
+        return int((self.up_middle >= 0).sum() + (self.down_middle >= 0).sum())
+
+    @property
+    def has_search_spaces(self):
+        """ Whether the upward search spaces of every node are stored """
+        return len(self._forward_indptr) > 0
+
+    @property
+    def nbytes(self):
+        """ Memory held by the arrays, in bytes """
+        return sum(getattr(self, name).nbytes for name in self.ARRAYS)
+
+    def shortest_path(self, source, target):
+        """
+        Shortest path between two graph nodes. When several paths are
+        equally short, the one returned may differ from A*'s.
+
+            :param source, target: graph node ids
+            :return: list of graph node ids from source to target
+        """
+        try:
+            s, t = self._internal[source], self._internal[target]
+        except KeyError:
+            raise NoPathError("Node %s or %s is not in the graph" % (source, target))
+        if s == t:
+            return [source]
+
+        if self.has_search_spaces:
+            path = self._meet(s, t)
+            if path is None:
+                raise NoPathError("Node %s not reachable from %s" % (target, source))
+            return [self._node_ids[node] for node in self._unpack(path)]
+
+        meeting, parents = _bidirectional_search(s, t, self._up, self._down)
+        if meeting is None:
+            raise NoPathError("Node %s not reachable from %s" % (target, source))
+        path = []
+        node = meeting
+        while node >= 0:
+            path.append(node)
+            node = parents[0][node]
+        path.reverse()
+        node = parents[1][meeting]
+        while node >= 0:
+            path.append(node)
+            node = parents[1][node]
+        return [self._node_ids[node] for node in self._unpack(path)]
+
+    def _meet(self, source, target):
+        """
+        Path of internal ids, shortcuts included, through the best node
+        common to the stored forward search space of source and backward
+        search space of target; None if they have no node in common
+        """
+        begin, end = self._forward_indptr[source], self._forward_indptr[source+1]
+        forward_nodes = self.forward_nodes[begin:end].tolist()
+        forward_lengths = self.forward_lengths[begin:end].tolist()
+        forward_parents = self.forward_parents[begin:end]
+        begin, end = self._backward_indptr[target], self._backward_indptr[target+1]
+        backward_nodes = self.backward_nodes[begin:end].tolist()
+        backward_lengths = self.backward_lengths[begin:end].tolist()
+        backward_parents = self.backward_parents[begin:end]
+
+        positions = dict(zip(forward_nodes, range(len(forward_nodes))))
+        best, meeting = float('inf'), None
+        for backward_position, node in enumerate(backward_nodes):
+            forward_position = positions.get(node)
+            if forward_position is not None:
+                length = forward_lengths[forward_position] + backward_lengths[backward_position]
+                if length < best:
+                    best, meeting = length, (forward_position, backward_position)
+        if meeting is None:
+            return None
+
+        path = []
+        position = meeting[0]
+        while position >= 0:
+            path.append(forward_nodes[position])
+            position = forward_parents[position]
+        path.reverse()
+        position = backward_parents[meeting[1]]
+        while position >= 0:
+            path.append(backward_nodes[position])
+            position = backward_parents[position]
+        return path
+
+    def _unpack(self, path):
+        """ Replaces the shortcuts of a path of internal ids by the nodes they skip """
+        unpacked = [path[0]]
+        for u, w in zip(path[:-1], path[1:]):
+            unpacked.extend(self._unpack_edge(u, w))
+        return unpacked
+
+    def _unpack_edge(self, u, w):
+        """
+        Nodes after u up to w of the original path of the edge u -> w. The
+        result is kept, so each shortcut is only unpacked once; concurrent
+        queries may both unpack it and store the same list.
+        """
+        nodes = self._unpacked.get((u, w))
+        if nodes is None:
+            middle = self._middle[u, w]
+            nodes = [w] if middle < 0 else self._unpack_edge(u, middle) + self._unpack_edge(middle, w)
+            self._unpacked[u, w] = nodes
+        return nodes
+
+
+def _bidirectional_search(source, target, up, down):
+    """
+    Pair of Dijkstra searches over the edges to higher ranked nodes, from
+    source over up and from target over the reversed down edges, settling
+    one node of each in turn. mu is the length of the best path found so
+    far, through a node reached by both; a search stops once the smallest
+    distance in its queue is at least mu, since no node it could still
+    settle leads to a shorter path. Nodes that a higher ranked node
+    reaches by a shorter path are stalled: they cannot be on a shortest
+    path, so their edges are not relaxed.
+    Returns the best meeting node, None if there is none, and the parents
+    of the nodes reached by each search (-1 for source and target).
+    """
+    inf = float('inf')
+    distances = ({source: 0.0}, {target: 0.0})
+    parents = ({source: -1}, {target: -1})
+    queues = ([(0.0, source)], [(0.0, target)])
+    adjacency = (up, down)
+    pop, push = heapq.heappop, heapq.heappush
+    mu, meeting = inf, None
+    side = 0
+    while True:
+        if not queues[side] or queues[side][0][0] >= mu:
+            side = 1 - side
+            if not queues[side] or queues[side][0][0] >= mu:
+                break
+        own, other = distances[side], distances[1 - side]
+        dist, node = pop(queues[side])
+        if dist <= own[node]:
+            if node in other and dist + other[node] < mu:
+                mu, meeting = dist + other[node], node
+            stalled = False
+            for higher, weight in adjacency[1 - side][node]:
+                if own.get(higher, inf) + weight < dist:
+                    stalled = True
+                    break
+            if not stalled:
+                queue, own_parents = queues[side], parents[side]
+                for neighbour, weight in adjacency[side][node]:
+                    ncost = dist + weight
+                    if ncost < own.get(neighbour, inf):
+                        own[neighbour] = ncost
+                        own_parents[neighbour] = node
+                        push(queue, (ncost, neighbour))
+                        if neighbour in other and ncost + other[neighbour] < mu:
+                            mu, meeting = ncost + other[neighbour], neighbour
+        side = 1 - side
+    return meeting, parents
+
+
+def _upward_search(source, adjacency, stall_adjacency):
+    """
+    Dijkstra from source over the edges to higher ranked nodes, with the
+    same stalling as _bidirectional_search. Returns the search space of
+    source: the (node, distance, position of the parent in the search
+    space) of every node settled without being stalled, the parent of
+    source being -1. Stalled nodes are left out, since no shortest path
+    goes through them.
+    """
+    inf = float('inf')
+    distances = {source: 0.0}
+    parents = {source: -1}
+    positions = {-1: -1}
+    queue = [(0.0, source)]
+    pop, push = heapq.heappop, heapq.heappush
+    space = []
+    while queue:
+        dist, node = pop(queue)
+        if dist > distances[node]:
+            continue
+        stalled = False
+        for higher, weight in stall_adjacency[node]:
+            if distances.get(higher, inf) + weight < dist:
+                stalled = True
+                break
+        if stalled:
+            continue
+        positions[node] = len(space)
+        space.append((node, dist, positions[parents[node]]))
+        for neighbour, weight in adjacency[node]:
+            ncost = dist + weight
+            if ncost < distances.get(neighbour, inf):
+                distances[neighbour] = ncost
+                parents[neighbour] = node
+                push(queue, (ncost, neighbour))
+    return space
+
+
+def _witness_search(out_edges, contracted, source, skipped, limit, settle_limit):
+    """
+    Bounded Dijkstra from source over the uncontracted nodes, skipping one
+    node. Returns the distances found, at most limit, after settling up to
+    settle_limit nodes.
+    """
+    distances = {source: 0.0}
+    queue = [(0.0, source)]
+    settled = 0
+    while queue and settled < settle_limit:
+        dist, node = heapq.heappop(queue)
+        if dist > distances[node]:
+            continue
+        settled += 1
+        for neighbour, weight in out_edges[node].items():
+            if neighbour == skipped or contracted[neighbour]:
+                continue
+            ncost = dist + weight
+            if ncost <= limit and ncost < distances.get(neighbour, float('inf')):
+                distances[neighbour] = ncost
+                heapq.heappush(queue, (ncost, neighbour))
+    return distances
@@ -0,0 +1,355 @@
+"""
+This module provides CSRGraph, the frozen compressed sparse row form of
+the road graph queried by GlobalRoutePlanner
+"""
+
+import heapq
+import math
+from itertools import count
+
+import numpy as np
+
+from agents.navigation.local_planner import RoadOption
+
+try:
+    from networkx import NetworkXNoPath as _NoPathBase
+except ImportError:
+    _NoPathBase = Exception
+
+
+class NoPathError(_NoPathBase):
+    """
+    Raised when the target of a search is not reachable from its source.
+    It is a networkx.NetworkXNoPath when networkx is installed.
+    """
+
+
+class CSRGraph(object):
+    """
+    Directed road graph stored as arrays. Nodes keep the ids of the
+    networkx graph they were built from (node_ids) and are numbered
+    0..n_nodes-1 internally; the successors of internal node i are the
+    edges indptr[i] up to indptr[i+1] (exclusive), in the insertion order
+    of the networkx graph, so searches break ties exactly like networkx.
+
+    Node attributes:
+        node_ids        -   graph node id of every internal node
+        vertex          -   (n_nodes, 3) location of every node
+    Edge attributes:
+        targets         -   internal id of the edge's end node
+        length          -   edge weight
+        edge_type       -   RoadOption value
+        intersection    -   whether the edge belongs to an intersection
+        segment         -   topology segment of the edge, -1 for lane changes
+        entry_index     -   topology index where a lane change starts, -1 otherwise
+        change_key      -   (road_id, section_id, lane_id) reached by a lane change
+        entry_vector, exit_vector, net_vector -   (n_edges, 3) unit vectors,
+                            NaN where the networkx edge had None or no value
+
+    The arrays are what gets pickled; the Python lists used by the searches
+    are rebuilt on load.
+    """
+
+    ARRAYS = ('node_ids', 'vertex', 'indptr', 'targets', 'length', 'edge_type', 'intersection',
+              'segment', 'entry_index', 'change_key', 'entry_vector', 'exit_vector', 'net_vector')
+
+    def __init__(self, **arrays):
+        """
+        Constructor method, takes one array per name in ARRAYS.
+        """
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+        self._prepare()
+
+    @classmethod
+    def from_networkx(cls, graph):
+        """
+        Freezes a networkx DiGraph built by GlobalRoutePlanner.
+        """
+        node_ids = list(graph.nodes)
+        internal = {node: i for i, node in enumerate(node_ids)}
+        vertex = np.array([graph.nodes[node]['vertex'] for node in node_ids], dtype=np.float64).reshape(-1, 3)
+
+        indptr = [0]
+        targets, attributes = [], []
+        for node in node_ids:
+            for neighbor, data in graph.succ[node].items():
+                targets.append(internal[neighbor])
+                attributes.append(data)
+            indptr.append(len(targets))
+
+        def vectors(name):
+            rows = [data.get(name) for data in attributes]
+            return np.array([row if row is not None else (np.nan, np.nan, np.nan) for row in rows],
+                            dtype=np.float64).reshape(-1, 3)
+
+        def optional(name, default):
+            return [data.get(name) if data.get(name) is not None else default for data in attributes]
+
+        return cls(
+            node_ids=np.array(node_ids, dtype=np.int64),
+            vertex=vertex,
+            indptr=np.array(indptr, dtype=np.int64),
+            targets=np.array(targets, dtype=np.int64),
+            length=np.array([data['length'] for data in attributes], dtype=np.float64),
+            edge_type=np.array([data['type'].value for data in attributes], dtype=np.int8),
+            intersection=np.array([bool(data['intersection']) for data in attributes], dtype=bool),
+            segment=np.array(optional('segment', -1), dtype=np.int64),
+            entry_index=np.array(optional('entry_index', -1), dtype=np.int64),
+            change_key=np.array(optional('change_key', (0, 0, 0)), dtype=np.int64).reshape(-1, 3),
+            entry_vector=vectors('entry_vector'),
+            exit_vector=vectors('exit_vector'),
+            net_vector=vectors('net_vector'))
+
+    def _prepare(self):
+        """ Builds the Python lookup structures used by the searches """
+        node_ids = self.node_ids.tolist()
+        self._internal = {node: i for i, node in enumerate(node_ids)}
+        self._node_ids = node_ids
+        self._vertex = [tuple(row) for row in self.vertex.tolist()]
+        indptr, targets, length = self.indptr.tolist(), self.targets.tolist(), self.length.tolist()
+        self._succ = [[(targets[e], length[e], e) for e in range(indptr[i], indptr[i+1])]
+                      for i in range(len(node_ids))]
+        self._edge_ids = {(node_ids[i], node_ids[target]): e
+                          for i, successors in enumerate(self._succ) for target, _, e in successors}
+        self._length = length
+        self._edge_nodes = [None] * len(targets)
+        for nodes, e in self._edge_ids.items():
+            self._edge_nodes[e] = nodes
+        self._types = [RoadOption(value) for value in self.edge_type.tolist()]
+        self._intersection = self.intersection.tolist()
+        self._segment = self.segment.tolist()
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    def __setstate__(self, state):
+        for name in self.ARRAYS:
+            setattr(self, name, state[name])
+        self._prepare()
+
+    def __contains__(self, node):
+        return node in self._internal
+
+    @property
+    def num_nodes(self):
+        return len(self._node_ids)
+
+    @property
+    def num_edges(self):
+        return len(self._types)
+
+    @property
+    def nbytes(self):
+        """ Memory held by the arrays, in bytes """
+        return sum(getattr(self, name).nbytes for name in self.ARRAYS)
+
+    def edge(self, n1, n2):
+        """ Edge id of the edge from node n1 to node n2, KeyError if there is none """
+        return self._edge_ids[n1, n2]
+
+    def has_edge(self, n1, n2):
+        """ Whether there is an edge from node n1 to node n2 """
+        return (n1, n2) in self._edge_ids
+
+    def edge_nodes(self, edge):
+        """ (n1, n2) nodes of an edge """
+        return self._edge_nodes[edge]
+
+    def edge_length(self, edge):
+        """ Length (weight) of an edge """
+        return self._length[edge]
+
+    def successors(self, node):
+        """ List of (neighbor node, edge id) of the edges leaving node """
+        return [(self._node_ids[target], e) for target, _, e in self._succ[self._internal[node]]]
+
+    def vertex_of(self, node):
+        """ (x,y,z) of a node """
+        return self._vertex[self._internal[node]]
+
+    def road_option(self, edge):
+        """ RoadOption of an edge """
+        return self._types[edge]
+
+    def is_intersection(self, edge):
+        """ Whether an edge belongs to an intersection """
+        return self._intersection[edge]
+
+    def edge_segment(self, edge):
+        """ Topology segment of an edge, None for lane changes """
+        segment = self._segment[edge]
+        return segment if segment >= 0 else None
+
+    def edge_change_key(self, edge):
+        """ (road_id, section_id, lane_id) reached by a lane change edge """
+        return tuple(int(value) for value in self.change_key[edge])
+
+    def _vector(self, vectors, edge):
+        row = vectors[edge]
+        return None if np.isnan(row[0]) else row
+
+    def edge_exit_vector(self, edge):
+        """ Unit vector along tangent at the exit point of an edge, or None """
+        return self._vector(self.exit_vector, edge)
+
+    def edge_net_vector(self, edge):
+        """ Unit vector of the chord of an edge, or None """
+        return self._vector(self.net_vector, edge)
+
+    def astar_path(self, source, target):
+        """
+        A* search with the euclidean distance between node vertices as
+        heuristic, weighted by edge length. It expands nodes in the same
+        order as networkx.astar_path, so it returns the same path.
+
+            :param source, target: graph node ids
+            :return: list of graph node ids from source to target
+        """
+        try:
+            source_i, target_i = self._internal[source], self._internal[target]
+        except KeyError:
+            raise NoPathError("Node %s or %s is not in the graph" % (source, target))
+        succ, vertex, sqrt = self._succ, self._vertex, math.sqrt
+        tx, ty, tz = vertex[target_i]
+        push, pop = heapq.heappush, heapq.heappop
+
+        c = count()
+        queue = [(0, next(c), source_i, 0, None)]
+        enqueued = {}
+        explored = {}
+
+        while queue:
+            _, __, current, dist, parent = pop(queue)
+
+            if current == target_i:
+                path = [current]
+                node = parent
+                while node is not None:
+                    path.append(node)
+                    node = explored[node]
+                path.reverse()
+                return [self._node_ids[node] for node in path]
+
+            if current in explored:
+                # Do not override the parent of the starting node
+                if explored[current] is None:
+                    continue
+                # Skip paths enqueued before a better one was found
+                if enqueued[current][0] < dist:
+                    continue
+
+            explored[current] = parent
+
+            for neighbor, weight, _ in succ[current]:
+                ncost = dist + weight
+                if neighbor in enqueued:
+                    qcost, h = enqueued[neighbor]
+                    if qcost <= ncost:
+                        continue
+                else:
+                    x, y, z = vertex[neighbor]
+                    h = sqrt((x - tx)**2 + (y - ty)**2 + (z - tz)**2)
+                enqueued[neighbor] = ncost, h
+                push(queue, (ncost + h, next(c), neighbor, ncost, current))
+
+        raise NoPathError("Node %s not reachable from %s" % (target, source))
+
+    def dijkstra(self, source, cutoff=None):
+        """
+        Shortest path lengths from source to every node within cutoff.
+
+            :param source: graph node id
+            :param cutoff: maximum path length, None for no bound
+            :return: (lengths, parents), dictionaries keyed by graph node id;
+                path_to() rebuilds a path from parents
+        """
+        succ = self._succ
+        source_i = self._internal[source]
+        lengths = {source_i: 0.0}
+        parents = {source_i: None}
+        done = set()
+        queue = [(0.0, source_i)]
+        while queue:
+            dist, current = heapq.heappop(queue)
+            if current in done:
+                continue
+            done.add(current)
+            for neighbor, weight, _ in succ[current]:
+                ncost = dist + weight
+                if cutoff is not None and ncost > cutoff:
+                    continue
+                if neighbor not in lengths or ncost < lengths[neighbor]:
+                    lengths[neighbor] = ncost
+                    parents[neighbor] = current
+                    heapq.heappush(queue, (ncost, neighbor))
+        node_ids = self._node_ids
+        return ({node_ids[node]: dist for node, dist in lengths.items()},
+                {node_ids[node]: None if parent is None else node_ids[parent] for node, parent in parents.items()})
+
+    def nearest(self, source, targets, cutoff=None):
+        """
+        Dijkstra search from source for the node of targets with the
+        smallest path length plus its cost. Of paths as short as each other
+        the one that first changes lanes the latest is kept, and so is, of
+        targets as good as each other, the one reached by it, then the first
+        one reached. The search stops as soon as no node left in the queue can
+        reach a target as good as the best one found.
+
+            :param source: graph node id
+            :param targets: dictionary of graph node id to cost, added to the
+                path length of the node
+            :param cutoff: maximum path length, None for no bound
+            :return: (path length plus cost, path as list of graph node ids),
+                None if no target is within cutoff
+        """
+        internal = self._internal
+        costs = {internal[node]: cost for node, cost in targets.items() if node in internal}
+        if not costs:
+            return None
+        succ, segment = self._succ, self._segment
+        floor = min(costs.values())
+        source_i = internal[source]
+        # Labels are (path length, minus the path length at the first lane
+        # change), with -inf while the path has not changed lanes
+        labels = {source_i: (0.0, -float('inf'))}
+        parents = {source_i: None}
+        done = set()
+        queue = [(0.0, -float('inf'), source_i)]
+        best, best_node = (float('inf'), 0.0), None
+        while queue:
+            dist, changed, current = heapq.heappop(queue)
+            if dist + floor > best[0]:
+                break
+            if current in done:
+                continue
+            done.add(current)
+            if current in costs and (dist + costs[current], changed) < best:
+                best, best_node = (dist + costs[current], changed), current
+            for neighbor, weight, e in succ[current]:
+                label = (dist + weight, -dist if segment[e] < 0 and changed == -float('inf') else changed)
+                if neighbor in done or cutoff is not None and label[0] > cutoff:
+                    continue
+                if neighbor not in labels or label < labels[neighbor]:
+                    labels[neighbor] = label
+                    parents[neighbor] = current
+                    heapq.heappush(queue, label + (neighbor,))
+        if best_node is None:
+            return None
+        path = []
+        node = best_node
+        while node is not None:
+            path.append(self._node_ids[node])
+            node = parents[node]
+        path.reverse()
+        return best[0], path
+
+    @staticmethod
+    def path_to(parents, node):
+        """ Path from the dijkstra source to node, as list of graph node ids """
+        path = []
+        while node is not None:
+            path.append(node)
+            node = parents[node]
+        path.reverse()
+        return path
@@ -9,42 +9,150 @@ This module provides GlobalRoutePlanner implementation.
 """
 
 import math
+import multiprocessing
+import os
+from collections import namedtuple
+from itertools import chain, islice
+
 import numpy as np
-import networkx as nx
 
 import carla
+from agents.navigation.contraction_hierarchy import ContractionHierarchy
+from agents.navigation.csr_graph import CSRGraph, NoPathError
+from agents.navigation.global_route_planner_cache import GlobalRoutePlannerCache
 from agents.navigation.local_planner import RoadOption
+from agents.navigation.route_cache import RouteCache
+from agents.navigation.spatial_index import SpatialIndex
+from agents.tools.instrumentation import NULL_PROFILER
 from agents.tools.misc import vector
 
+try:
+    # Only needed to build the graph, not to load it from the cache or to query it
+    import networkx as nx
+except ImportError:
+    nx = None
+
+# Route returned by GlobalRoutePlanner.trace_routes:
+#   indices         -   topology buffer index of every waypoint, -1 for the origin itself
+#   road_options    -   RoadOption value of every waypoint
+#   locations       -   (n, 3) array with the location of every waypoint
+CompactRoute = namedtuple('CompactRoute', ['indices', 'road_options', 'locations'])
+
+# Planner of a worker process of trace_routes, set by _init_worker
+_worker_planner = None
+
+
+def _init_worker(planner):
+    # The pool runs this in every worker it forks, the ones replacing dead
+    # workers included, so each gets the planner from the pool itself
+    global _worker_planner
+    # A lock held by another thread at fork time would stay locked in the worker
+    planner._route_cache = RouteCache(planner._route_cache.maxsize)
+    _worker_planner = planner
+
+
+def _trace_compact_worker(pair):
+    return _worker_planner._trace_compact(*pair)
+
 
 class GlobalRoutePlanner(object):
     """
     This class provides a very high level route plan.
     Instantiate the class by passing a reference to
     A GlobalRoutePlannerDAO object.
+    Queries keep no state in the instance, so once setup() has returned
+    one planner can be shared by many agents and queried from several
+    threads at once.
     """
 
-    def __init__(self, dao):
+    def __init__(self, dao, cache_dir=None, route_cache_size=128, contraction_hierarchy=False, profiler=None):
         """
         Constructor
+
+            :param dao: GlobalRoutePlannerDAO object
+            :param cache_dir: directory of the on-disk graph cache, None disables it
+            :param route_cache_size: number of routes kept in the LRU route cache, 0 disables it
+            :param contraction_hierarchy: whether setup() also builds (or loads) a
+                contraction hierarchy, used by path searches instead of A*
+            :param profiler: StageProfiler timing the phases of setup() and the
+                route queries, None disables it
         """
         self._dao = dao
+        self.profiler = profiler if profiler is not None else NULL_PROFILER
+        self._use_hierarchy = contraction_hierarchy
+        self._hierarchy = None
+        self._turn_table = dict()
+        self._cache = GlobalRoutePlannerCache(cache_dir) if cache_dir is not None else None
+        self._route_cache = RouteCache(route_cache_size)
         self._topology = None
         self._graph = None
         self._id_map = None
         self._road_id_to_edge = None
-        self._intersection_end_node = -1
-        self._previous_decision = RoadOption.VOID
+        self._index = None
 
     def setup(self):
         """
         Performs initial server data lookup for detailed topology
         and builds graph representation of the world map.
+        The graph is built with networkx and then frozen into a CSRGraph,
+        which is what route queries use.
+        If a cache directory was given and it holds a graph for the same
+        map, OpenDRIVE content and resolution, the graph is loaded from
+        disk instead and the server is not queried.
+        With contraction_hierarchy set, the hierarchy is built after the
+        graph and cached along with it.
+        Last, the turn decision of every way into an intersection is
+        computed into the turn table used by route queries.
         """
-        self._topology = self._dao.get_topology()
-        self._graph, self._id_map, self._road_id_to_edge = self._build_graph()
-        self._find_loose_ends()
-        self._lane_change_link()
+        with self.profiler.stage('planner.setup'):
+            self._setup()
+
+    def _setup(self):
+        profiler = self.profiler
+        self._route_cache.clear()
+        with profiler.stage('planner.cache_load'):
+            cached = self._cache.load(self._dao) if self._cache is not None else None
+        if cached is not None:
+            self._topology = cached['topology']
+            self._graph = cached['graph']
+            self._id_map = cached['id_map']
+            self._road_id_to_edge = cached['road_id_to_edge']
+            self._hierarchy = cached.get('hierarchy')
+            with profiler.stage('planner.spatial_index'):
+                self._index = SpatialIndex(self._topology)
+        else:
+            with profiler.stage('planner.get_topology'):
+                self._topology = self._dao.get_topology()
+            with profiler.stage('planner.build_graph'):
+                self._graph, self._id_map, self._road_id_to_edge = self._build_graph()
+            with profiler.stage('planner.find_loose_ends'):
+                self._find_loose_ends()
+            with profiler.stage('planner.spatial_index'):
+                self._index = SpatialIndex(self._topology)
+            with profiler.stage('planner.lane_change_link'):
+                self._lane_change_link()
+            with profiler.stage('planner.freeze_graph'):
+                self._graph = CSRGraph.from_networkx(self._graph)
+            self._hierarchy = None
+
+        save = cached is None
+        if not self._use_hierarchy:
+            self._hierarchy = None
+        elif self._hierarchy is None:
+            with profiler.stage('planner.contraction_hierarchy'):
+                self._hierarchy = ContractionHierarchy.build(self._graph)
+            save = True
+
+        with profiler.stage('planner.turn_table'):
+            self._turn_table = self._build_turn_table()
+
+        if self._cache is not None and save:
+            try:
+                with profiler.stage('planner.cache_save'):
+                    self._cache.save(self._dao, self._topology, self._graph, self._id_map, self._road_id_to_edge,
+                                     self._hierarchy)
+            except OSError as error:
+                print("Failed to write the route planner cache : ", error)
 
     def _build_graph(self):
         """
@@ -53,6 +161,8 @@ class GlobalRoutePlanner(object):
         graph node properties:
             vertex   -   (x,y,z) position in world map
         graph edge properties:
+            segment         -   index of the segment in self._topology
+                                holding the sampled points of the edge
             entry_vector    -   unit vector along tangent at entry point
             exit_vector     -   unit vector along tangent at exit point
             net_vector      -   unit vector of the chord from entry to exit
@@ -62,17 +172,19 @@ class GlobalRoutePlanner(object):
                         id_map-> mapping from (x,y,z) to node id
                         road_id_to_edge-> map from road id to edge in the graph
         """
+        if nx is None:
+            raise ImportError("networkx is required to build the route planner graph")
         graph = nx.DiGraph()
         id_map = dict()  # Map with structure {(x,y,z): id, ... }
         road_id_to_edge = dict()  # Map with structure {road_id: {lane_id: edge, ... }, ... }
+        topology = self._topology
 
-        for segment in self._topology:
+        for segment in range(len(topology)):
 
-            entry_xyz, exit_xyz = segment['entryxyz'], segment['exitxyz']
-            path = segment['path']
-            entry_wp, exit_wp = segment['entry'], segment['exit']
-            intersection = entry_wp.is_junction
-            road_id, section_id, lane_id = entry_wp.road_id, entry_wp.section_id, entry_wp.lane_id
+            entry_xyz, exit_xyz = topology.entry_key(segment), topology.exit_key(segment)
+            entry_index, exit_index = topology.entry_index(segment), topology.exit_index(segment)
+            intersection = bool(topology.is_junction[segment])
+            road_id, section_id, lane_id = topology.lane_key(entry_index)
 
             for vertex in entry_xyz, exit_xyz:
                 # Adding unique nodes and populating id_map
@@ -88,19 +200,13 @@ class GlobalRoutePlanner(object):
                 road_id_to_edge[road_id][section_id] = dict()
             road_id_to_edge[road_id][section_id][lane_id] = (n1, n2)
 
-            entry_carla_vector = entry_wp.transform.rotation.get_forward_vector()
-            exit_carla_vector = exit_wp.transform.rotation.get_forward_vector()
-
             # Adding edge with attributes
             graph.add_edge(
                 n1, n2,
-                length=len(path) + 1, path=path,
-                entry_waypoint=entry_wp, exit_waypoint=exit_wp,
-                entry_vector=np.array(
-                    [entry_carla_vector.x, entry_carla_vector.y, entry_carla_vector.z]),
-                exit_vector=np.array(
-                    [exit_carla_vector.x, exit_carla_vector.y, exit_carla_vector.z]),
-                net_vector=vector(entry_wp.transform.location, exit_wp.transform.location),
+                length=len(topology.path_indices(segment)) + 1, segment=segment,
+                entry_vector=topology.forward_vector(entry_index),
+                exit_vector=topology.forward_vector(exit_index),
+                net_vector=vector(topology.location(entry_index), topology.location(exit_index)),
                 intersection=intersection, type=RoadOption.LANEFOLLOW)
 
         return graph, id_map, road_id_to_edge
@@ -111,11 +217,11 @@ class GlobalRoutePlanner(object):
         adds them to the internal graph representation
         """
         count_loose_ends = 0
-        hop_resolution = self._dao.get_resolution()
-        for segment in self._topology:
-            end_wp = segment['exit']
-            exit_xyz = segment['exitxyz']
-            road_id, section_id, lane_id = end_wp.road_id, end_wp.section_id, end_wp.lane_id
+        loose_ends = []
+        for segment in range(len(self._topology)):
+            exit_index = self._topology.exit_index(segment)
+            exit_xyz = self._topology.exit_key(segment)
+            road_id, section_id, lane_id = self._topology.lane_key(exit_index)
             if road_id in self._road_id_to_edge and section_id in self._road_id_to_edge[road_id] and lane_id in self._road_id_to_edge[road_id][section_id]:
                 pass
             else:
@@ -127,89 +233,151 @@ class GlobalRoutePlanner(object):
                 n1 = self._id_map[exit_xyz]
                 n2 = -1*count_loose_ends
                 self._road_id_to_edge[road_id][section_id][lane_id] = (n1, n2)
-                next_wp = end_wp.next(hop_resolution)
-                path = []
-                while next_wp is not None and next_wp and next_wp[0].road_id == road_id and next_wp[0].section_id == section_id and next_wp[0].lane_id == lane_id:
-                    path.append(next_wp[0])
-                    next_wp = next_wp[0].next(hop_resolution)
+                end_wp = self._topology.waypoint(exit_index, self._dao)
+                path = self._dao.get_lane_path(end_wp)
                 if path:
                     n2_xyz = (path[-1].transform.location.x,
                               path[-1].transform.location.y,
                               path[-1].transform.location.z)
                     self._graph.add_node(n2, vertex=n2_xyz)
-                    self._graph.add_edge(
-                        n1, n2,
-                        length=len(path) + 1, path=path,
-                        entry_waypoint=end_wp, exit_waypoint=path[-1],
-                        entry_vector=None, exit_vector=None, net_vector=None,
-                        intersection=end_wp.is_junction, type=RoadOption.LANEFOLLOW)
+                    # The new segment holds end_wp, the path and path[-1] as exit point
+                    loose_ends.append((n1, n2, (exit_xyz, n2_xyz, end_wp.is_junction, [end_wp] + path + [path[-1]])))
 
-    def _localize(self, location):
+        first_segment = len(self._topology)
+        self._topology = self._topology.extend([segment for _, _, segment in loose_ends])
+        for i, (n1, n2, (_, _, intersection, waypoints)) in enumerate(loose_ends):
+            self._graph.add_edge(
+                n1, n2,
+                length=len(waypoints) - 1, segment=first_segment + i,
+                entry_vector=None, exit_vector=None, net_vector=None,
+                intersection=intersection, type=RoadOption.LANEFOLLOW)
+
+    def _snap(self, location, yaw=None):
+        """
+        This function projects a location onto the closest lane of the
+        densified topology using the local spatial index, without querying
+        the server.
+        location        :   carla.Location to be snapped
+        yaw             :   optional heading in degrees; lanes driving against
+                            it are only used as last resort
+        return          :   (index, t) -> the projection lies at fraction t
+                            between topology points index and index+1
+        """
+        index, t, _ = self._index.query((location.x, location.y, location.z), yaw)
+        return index, t
+
+    def _snap_key(self, index, t):
+        """
+        This function returns the (road_id, section_id, lane_id) of a
+        snapped location
+        """
+        return self._topology.lane_key(index if t < 0.5 else index + 1)
+
+    def _snap_location(self, index, t):
+        """
+        This function returns the (x,y,z) of a snapped location
+        """
+        if t <= 0.0:
+            return tuple(float(value) for value in self._topology.xyz([index])[0])
+        a, b = self._topology.xyz([index, index + 1])
+        return tuple(float(value) for value in a + t * (b - a))
+
+    def _localize(self, location, yaw=None):
         """
         This function finds the road segment closest to given location
         location        :   carla.Location to be localized in the graph
+        yaw             :   optional heading in degrees used to disambiguate
+                            overlapping lanes
         return          :   pair node ids representing an edge in the graph
         """
-        waypoint = self._dao.get_waypoint(location)
+        index, t = self._snap(location, yaw)
+        return self._edge_of(index, t)
+
+    def _edge_of(self, index, t):
+        """
+        This function returns the graph edge of a snapped location, or None
+        """
+        road_id, section_id, lane_id = self._snap_key(index, t)
         edge = None
         try:
-            edge = self._road_id_to_edge[waypoint.road_id][waypoint.section_id][waypoint.lane_id]
+            edge = self._road_id_to_edge[road_id][section_id][lane_id]
         except KeyError:
+            x, y, _ = self._snap_location(index, t)
             print(
                 "Failed to localize! : ",
-                "Road id : ", waypoint.road_id,
-                "Section id : ", waypoint.section_id,
-                "Lane id : ", waypoint.lane_id,
-                "Location : ", waypoint.transform.location.x,
-                waypoint.transform.location.y)
+                "Road id : ", road_id,
+                "Section id : ", section_id,
+                "Lane id : ", lane_id,
+                "Location : ", x, y)
         return edge
 
+    def localize_many(self, locations, yaws=None):
+        """
+        This function localizes a batch of locations in the graph without
+        querying the server.
+        locations       :   sequence of carla.Location
+        yaws            :   optional sequence of headings in degrees (or None)
+        return          :   list with, per location, the pair of node ids of
+                            the closest edge (or None if it could not be localized)
+        """
+        points = [(location.x, location.y, location.z) for location in locations]
+        return [self._edge_of(index, t) for index, t, _ in self._index.query_many(points, yaws)]
+
     def _lane_change_link(self):
         """
         This method places zero cost links in the topology graph
         representing availability of lane changes.
+        Lane change edges have no segment; they keep the buffer index of the
+        waypoint where the change starts (entry_index) and the
+        (road_id, section_id, lane_id) of the lane reached (change_key).
+        It runs in memory: the lane changes allowed at each point come from
+        the lane markings kept in the topology, and the lane next to a point
+        is the lane with the adjacent id in road_id_to_edge, on the same road
+        and section, which only holds driving lanes.
         """
-
-        for segment in self._topology:
-            left_found, right_found = False, False
-
-            for waypoint in segment['path']:
-                if not segment['entry'].is_junction:
-                    next_waypoint, next_road_option, next_segment = None, None, None
-
-                    if waypoint.right_lane_marking.lane_change & carla.LaneChange.Right and not right_found:
-                        next_waypoint = waypoint.get_right_lane()
-                        if next_waypoint is not None and next_waypoint.lane_type == carla.LaneType.Driving and waypoint.road_id == next_waypoint.road_id:
-                            next_road_option = RoadOption.CHANGELANERIGHT
-                            next_segment = self._localize(next_waypoint.transform.location)
-                            if next_segment is not None:
-                                self._graph.add_edge(
-                                    self._id_map[segment['entryxyz']], next_segment[0], entry_waypoint=waypoint,
-                                    exit_waypoint=next_waypoint, intersection=False, exit_vector=None,
-                                    path=[], length=0, type=next_road_option, change_waypoint=next_waypoint)
-                                right_found = True
-                    if waypoint.left_lane_marking.lane_change & carla.LaneChange.Left and not left_found:
-                        next_waypoint = waypoint.get_left_lane()
-                        if next_waypoint is not None and next_waypoint.lane_type == carla.LaneType.Driving and waypoint.road_id == next_waypoint.road_id:
-                            next_road_option = RoadOption.CHANGELANELEFT
-                            next_segment = self._localize(next_waypoint.transform.location)
-                            if next_segment is not None:
-                                self._graph.add_edge(
-                                    self._id_map[segment['entryxyz']], next_segment[0], entry_waypoint=waypoint,
-                                    exit_waypoint=next_waypoint, intersection=False, exit_vector=None,
-                                    path=[], length=0, type=next_road_option, change_waypoint=next_waypoint)
-                                left_found = True
-                if left_found and right_found:
+        topology = self._topology
+        right, left = int(carla.LaneChange.Right), int(carla.LaneChange.Left)
+
+        for segment in range(len(topology)):
+            if topology.is_junction[segment]:
+                continue
+            path = topology.path_indices(segment)
+            if not path:
+                continue
+            entry_node = self._id_map[topology.entry_key(segment)]
+            lane_change = topology.lane_change[path.start:path.stop]
+
+            for flag, road_option in ((right, RoadOption.CHANGELANERIGHT), (left, RoadOption.CHANGELANELEFT)):
+                for offset in np.flatnonzero(lane_change & flag):
+                    index = path.start + int(offset)
+                    change_key = self._adjacent_lane(topology.lane_key(index), flag == right)
+                    if change_key is None:
+                        continue
+                    road_id, section_id, lane_id = change_key
+                    self._graph.add_edge(
+                        entry_node, self._road_id_to_edge[road_id][section_id][lane_id][0], entry_index=index,
+                        change_key=change_key, intersection=False, exit_vector=None, segment=None,
+                        length=0, type=road_option)
                     break
 
-    def _distance_heuristic(self, n1, n2):
+    def _adjacent_lane(self, lane_key, right):
         """
-        Distance heuristic calculator for path searching
-        in self._graph
+        This method returns the (road_id, section_id, lane_id) of the lane on
+        the right or on the left of a lane, as carla.Waypoint.get_right_lane()
+        and get_left_lane() do, if it is in the graph, or None
         """
-        l1 = np.array(self._graph.nodes[n1]['vertex'])
-        l2 = np.array(self._graph.nodes[n2]['vertex'])
-        return np.linalg.norm(l1-l2)
+        road_id, section_id, lane_id = lane_key
+        # Lanes are numbered outwards from the reference line, negative on its right
+        outwards = -1 if lane_id < 0 else 1
+        if right:
+            adjacent = lane_id + outwards
+        else:
+            adjacent = lane_id - outwards
+            if adjacent == 0:
+                adjacent = -lane_id
+        if adjacent in self._road_id_to_edge.get(road_id, {}).get(section_id, {}):
+            return road_id, section_id, adjacent
+        return None
 
     def _path_search(self, origin, destination):
         """
@@ -218,32 +386,109 @@ class GlobalRoutePlanner(object):
         origin      :   carla.Location object of start position
         destination :   carla.Location object of of end position
         return      :   path as list of node ids (as int) of the graph self._graph
-        connecting origin and destination
+        connecting origin and destination; NoPathError if there is none
         """
 
         start, end = self._localize(origin), self._localize(destination)
+        return self._edge_path_search(start, end)
 
-        route = nx.astar_path(
-            self._graph, source=start[0], target=end[0],
-            heuristic=self._distance_heuristic, weight='length')
+    def _edge_path_search(self, start, end):
+        """
+        This function finds the shortest path connecting two graph edges,
+        given as pairs of node ids, using the contraction hierarchy if there
+        is one and A* search with distance heuristic otherwise.
+        """
+        if self._hierarchy is not None:
+            route = self._hierarchy.shortest_path(start[0], end[0])
+        else:
+            route = self._graph.astar_path(start[0], end[0])
         route.append(end[1])
         return route
 
+    def _plan(self, start, end):
+        """
+        This function returns the _CachedRoute connecting two graph edges,
+        running the path search and the turn decisions on a cache miss.
+        """
+        key = (start, end)
+        entry = self._route_cache.get(key)
+        if entry is None:
+            route = self._edge_path_search(start, end)
+            entry = _CachedRoute(route, self._route_decisions(route))
+            self._route_cache.put(key, entry)
+        return entry
+
+    def _route_decisions(self, route):
+        """
+        This function returns the turn decision (RoadOption) of every edge
+        of a route. Turns into an intersection are looked up in the turn
+        table; the only state carried along the route, the last decision
+        and the node where its intersection ends, is local to this call.
+        """
+        graph = self._graph
+        decisions = []
+        previous_decision = RoadOption.VOID
+        intersection_end_node = -1
+        for index in range(len(route) - 1):
+            current_node, next_node = route[index], route[index+1]
+            next_edge = graph.edge(current_node, next_node)
+            if index == 0:
+                decision = graph.road_option(next_edge)
+            else:
+                previous_node = route[index-1]
+                into_intersection = graph.road_option(next_edge) == RoadOption.LANEFOLLOW and graph.is_intersection(next_edge)
+                if previous_decision != RoadOption.VOID and intersection_end_node > 0 and intersection_end_node != previous_node and into_intersection:
+                    decision = previous_decision
+                else:
+                    intersection_end_node = -1
+                    current_edge = graph.edge(previous_node, current_node)
+                    if into_intersection and graph.road_option(current_edge) == RoadOption.LANEFOLLOW and not graph.is_intersection(current_edge):
+                        intersection_end_node, tail_edge = self._successive_last_intersection_edge(index, route)
+                        key = (current_edge, next_edge, tail_edge)
+                        turn = self._turn_table.get(key)
+                        if turn is None:
+                            turn = self._turn(*key)
+                        decision, decided = turn
+                        if not decided:
+                            # Edges without vectors: the decision is not carried on
+                            decisions.append(decision)
+                            continue
+                    else:
+                        decision = graph.road_option(next_edge)
+            previous_decision = decision
+            decisions.append(decision)
+        return decisions
+
+    def route_cache_info(self):
+        """
+        This method returns the RouteCacheInfo (hits, misses, evictions,
+        maxsize, currsize) of the route cache
+        """
+        return self._route_cache.info()
+
+    def clear_route_cache(self):
+        """
+        This method drops every cached route and resets the counters
+        """
+        self._route_cache.clear()
+
     def _successive_last_intersection_edge(self, index, route):
         """
         This method returns the last successive intersection edge
         from a starting index on the route.
         This helps moving past tiny intersection edges to calculate
         proper turn decisions.
+        Edges are returned as edge ids of self._graph.
         """
 
+        graph = self._graph
         last_intersection_edge = None
         last_node = None
         for node1, node2 in [(route[i], route[i+1]) for i in range(index, len(route)-1)]:
-            candidate_edge = self._graph.edges[node1, node2]
+            candidate_edge = graph.edge(node1, node2)
             if node1 == route[index]:
                 last_intersection_edge = candidate_edge
-            if candidate_edge['type'] == RoadOption.LANEFOLLOW and candidate_edge['intersection']:
+            if graph.road_option(candidate_edge) == RoadOption.LANEFOLLOW and graph.is_intersection(candidate_edge):
                 last_intersection_edge = candidate_edge
                 last_node = node2
             else:
@@ -251,63 +496,82 @@ class GlobalRoutePlanner(object):
 
         return last_node, last_intersection_edge
 
-    def _turn_decision(self, index, route, threshold=math.radians(35)):
+    def _turn(self, current_edge, next_edge, tail_edge, threshold=math.radians(35)):
         """
-        This method returns the turn decision (RoadOption) for pair of edges
-        around current index of route list
+        This method computes the turn decision (RoadOption) of a route that
+        reaches an intersection through current_edge and enters it through
+        next_edge, leaving it at the end of tail_edge, from the exit vectors
+        of current_edge and tail_edge and the other roads leaving the node.
+        return      :   (decision, decided), decided being False when an
+                        edge has no exit vector and the decision is just
+                        the RoadOption of tail_edge
         """
-
+        graph = self._graph
+        cv, nv = graph.edge_exit_vector(current_edge), graph.edge_exit_vector(tail_edge)
+        if cv is None or nv is None:
+            return graph.road_option(tail_edge), False
+        current_node, next_node = graph.edge_nodes(next_edge)
         decision = None
-        previous_node = route[index-1]
-        current_node = route[index]
-        next_node = route[index+1]
-        next_edge = self._graph.edges[current_node, next_node]
-        if index > 0:
-            if self._previous_decision != RoadOption.VOID and self._intersection_end_node > 0 and self._intersection_end_node != previous_node and next_edge['type'] == RoadOption.LANEFOLLOW and next_edge['intersection']:
-                decision = self._previous_decision
-            else:
-                self._intersection_end_node = -1
-                current_edge = self._graph.edges[previous_node, current_node]
-                calculate_turn = current_edge['type'] == RoadOption.LANEFOLLOW and not current_edge[
-                    'intersection'] and next_edge['type'] == RoadOption.LANEFOLLOW and next_edge['intersection']
-                if calculate_turn:
-                    last_node, tail_edge = self._successive_last_intersection_edge(index, route)
-                    self._intersection_end_node = last_node
-                    if tail_edge is not None:
-                        next_edge = tail_edge
-                    cv, nv = current_edge['exit_vector'], next_edge['exit_vector']
-                    if cv is None or nv is None:
-                        return next_edge['type']
-                    cross_list = []
-                    for neighbor in self._graph.successors(current_node):
-                        select_edge = self._graph.edges[current_node, neighbor]
-                        if select_edge['type'] == RoadOption.LANEFOLLOW:
-                            if neighbor != route[index+1]:
-                                sv = select_edge['net_vector']
-                                cross_list.append(np.cross(cv, sv)[2])
-                    next_cross = np.cross(cv, nv)[2]
-                    deviation = math.acos(np.clip(
-                        np.dot(cv, nv)/(np.linalg.norm(cv)*np.linalg.norm(nv)), -1.0, 1.0))
-                    if not cross_list:
-                        cross_list.append(0)
-                    if deviation < threshold:
-                        decision = RoadOption.STRAIGHT
-                    elif cross_list and next_cross < min(cross_list):
-                        decision = RoadOption.LEFT
-                    elif cross_list and next_cross > max(cross_list):
-                        decision = RoadOption.RIGHT
-                    elif next_cross < 0:
-                        decision = RoadOption.LEFT
-                    elif next_cross > 0:
-                        decision = RoadOption.RIGHT
-                else:
-                    decision = next_edge['type']
-
-        else:
-            decision = next_edge['type']
-
-        self._previous_decision = decision
-        return decision
+        cross_list = []
+        for neighbor, select_edge in graph.successors(current_node):
+            if graph.road_option(select_edge) == RoadOption.LANEFOLLOW:
+                if neighbor != next_node:
+                    sv = graph.edge_net_vector(select_edge)
+                    cross_list.append(np.cross(cv, sv)[2])
+        next_cross = np.cross(cv, nv)[2]
+        deviation = math.acos(np.clip(
+            np.dot(cv, nv)/(np.linalg.norm(cv)*np.linalg.norm(nv)), -1.0, 1.0))
+        if not cross_list:
+            cross_list.append(0)
+        if deviation < threshold:
+            decision = RoadOption.STRAIGHT
+        elif cross_list and next_cross < min(cross_list):
+            decision = RoadOption.LEFT
+        elif cross_list and next_cross > max(cross_list):
+            decision = RoadOption.RIGHT
+        elif next_cross < 0:
+            decision = RoadOption.LEFT
+        elif next_cross > 0:
+            decision = RoadOption.RIGHT
+        return decision, True
+
+    def _build_turn_table(self):
+        """
+        This method computes the turn decision of every way of entering an
+        intersection: each lane following edge outside intersections
+        (current_edge) followed by a lane following intersection edge
+        (next_edge) and by any chain of them ending with tail_edge.
+        return      :   dict {(current_edge, next_edge, tail_edge): (decision, decided), ... }
+        """
+        graph = self._graph
+
+        def entering(edge):
+            return graph.road_option(edge) == RoadOption.LANEFOLLOW and graph.is_intersection(edge)
+
+        # Intersection edges reachable from each one through intersection edges, itself included
+        tails = dict()
+
+        def chain_tails(edge):
+            if edge not in tails:
+                tails[edge] = [edge]
+                found, stack = {edge}, [edge]
+                while stack:
+                    for _, successor in graph.successors(graph.edge_nodes(stack.pop())[1]):
+                        if entering(successor) and successor not in found:
+                            found.add(successor)
+                            tails[edge].append(successor)
+                            stack.append(successor)
+            return tails[edge]
+
+        table = dict()
+        for current_edge in range(graph.num_edges):
+            if graph.road_option(current_edge) != RoadOption.LANEFOLLOW or graph.is_intersection(current_edge):
+                continue
+            for _, next_edge in graph.successors(graph.edge_nodes(current_edge)[1]):
+                if entering(next_edge):
+                    for tail_edge in chain_tails(next_edge):
+                        table[current_edge, next_edge, tail_edge] = self._turn(current_edge, next_edge, tail_edge)
+        return table
 
     def abstract_route_plan(self, origin, destination):
         """
@@ -320,26 +584,98 @@ class GlobalRoutePlanner(object):
         CHANGELANELEFT, CHANGELANERIGHT
         """
 
-        route = self._path_search(origin, destination)
-        plan = []
+        start, end = self._localize(origin), self._localize(destination)
+        return list(self._plan(start, end).plan)
 
-        for i in range(len(route) - 1):
-            road_option = self._turn_decision(i, route)
-            plan.append(road_option)
+    def _find_closest_in_list(self, location, points):
+        """
+        This method returns the index of the row of points (an (n,3) array)
+        closest to location (an (x,y,z) sequence)
+        """
+        if not len(points):
+            return -1
+        offsets = points - np.asarray(location, dtype=np.float64)
+        return int(np.argmin(np.einsum('ij,ij->i', offsets, offsets)))
 
-        return plan
+    def _destination_cutoff(self, path, closest_index, destination, destination_location,
+                            destination_key, resolution):
+        """
+        This method returns how many points of the last edge of a route
+        (path, a range of topology indices) are traced, starting from
+        closest_index: tracing stops at the first point closer than two
+        resolutions to the destination or, when the trace starts past the
+        destination, at the first point on the destination lane.
+        """
+        topology = self._topology
+        points = topology.xyz(path)
+        candidates = slice(path.start + closest_index, path.stop)
+        offsets = points[closest_index:] - np.array([destination.x, destination.y, destination.z])
+        stop = np.sqrt(np.einsum('ij,ij->i', offsets, offsets)) < 2*resolution
+        if closest_index > self._find_closest_in_list(destination_location, points):
+            road_id, section_id, lane_id = destination_key
+            stop |= ((topology.road_id[candidates] == road_id)
+                     & (topology.section_id[candidates] == section_id)
+                     & (topology.lane_id[candidates] == lane_id))
+        hits = np.flatnonzero(stop)
+        return closest_index + int(hits[0]) + 1 if len(hits) else len(path)
+
+    def _trace_indices(self, entry, origin_index, origin_t, destination, destination_index, destination_t):
+        """
+        This method trims a cached route to the exact origin and destination.
+        return      :   list of (topology index, RoadOption), where the index
+                        None stands for the origin itself
+        """
+        return list(self._iter_trace_indices(entry, origin_index, origin_t, destination, destination_index,
+                                             destination_t))
 
-    def _find_closest_in_list(self, current_waypoint, waypoint_list):
-        min_distance = float('inf')
-        closest_index = -1
-        for i, waypoint in enumerate(waypoint_list):
-            distance = waypoint.transform.location.distance(
-                current_waypoint.transform.location)
-            if distance < min_distance:
-                min_distance = distance
-                closest_index = i
+    def _iter_trace_indices(self, entry, origin_index, origin_t, destination, destination_index, destination_t):
+        """
+        Generator version of _trace_indices, which yields the
+        (topology index, RoadOption) of each edge of the route as soon as
+        the edge is reached
+        """
+        route, plan = entry.route, entry.plan
+        resolution = self._dao.get_resolution()
+        topology = self._topology
+        graph = self._graph
 
-        return closest_index
+        current_index = None
+        current_location = self._snap_location(origin_index, origin_t)
+        destination_location = self._snap_location(destination_index, destination_t)
+        destination_key = self._snap_key(destination_index, destination_t)
+
+        for i in range(len(route) - 1):
+            road_option = plan[i]
+            edge = graph.edge(route[i], route[i+1])
+            edge_type = graph.road_option(edge)
+
+            if edge_type != RoadOption.LANEFOLLOW and edge_type != RoadOption.VOID:
+                yield current_index, road_option
+                road_id, section_id, lane_id = graph.edge_change_key(edge)
+                n1, n2 = self._road_id_to_edge[road_id][section_id][lane_id]
+                next_segment = graph.edge_segment(graph.edge(n1, n2))
+                path = topology.path_indices(next_segment)
+                if path:
+                    closest_index = self._find_closest_in_list(current_location, topology.xyz(path))
+                    closest_index = min(len(path)-1, closest_index+5)
+                    current_index = path[closest_index]
+                else:
+                    current_index = topology.exit_index(next_segment)
+                current_location = topology.points_xyz[current_index]
+                yield current_index, road_option
+
+            else:
+                path = topology.point_indices(graph.edge_segment(edge))
+                closest_index = self._find_closest_in_list(current_location, topology.xyz(path))
+                if len(route)-i <= 2:
+                    stop = self._destination_cutoff(
+                        path, closest_index, destination, destination_location, destination_key, resolution)
+                else:
+                    stop = len(path)
+                for index in path[closest_index:stop]:
+                    yield index, road_option
+                current_index = path[stop-1]
+                current_location = topology.points_xyz[current_index]
 
     def trace_route(self, origin, destination):
         """
@@ -347,41 +683,253 @@ class GlobalRoutePlanner(object):
         from origin to destination
         """
 
-        route_trace = []
-        route = self._path_search(origin, destination)
-        current_waypoint = self._dao.get_waypoint(origin)
-        destination_waypoint = self._dao.get_waypoint(destination)
-        resolution = self._dao.get_resolution()
+        profiler = self.profiler
+        with profiler.stage('planner.trace_route'):
+            with profiler.stage('planner.localize'):
+                origin_index, origin_t = self._snap(origin)
+                destination_index, destination_t = self._snap(destination)
+            with profiler.stage('planner.plan'):
+                entry = self._plan(self._edge_of(origin_index, origin_t),
+                                   self._edge_of(destination_index, destination_t))
+            with profiler.stage('planner.trace_waypoints'):
+                trace = self._trace_indices(entry, origin_index, origin_t, destination, destination_index,
+                                            destination_t)
+                return self._trace_waypoints(trace, entry.waypoints, origin_index, origin_t)
+
+    def iter_route(self, origin, destination):
+        """
+        This method returns a generator of the (carla.Waypoint, RoadOption)
+        from origin to destination, the same as trace_route returns. The
+        path search is done before returning; the waypoints are only created
+        as they are consumed, edge by edge, so the first ones are available
+        at once whatever the length of the route.
+        """
+        profiler = self.profiler
+        with profiler.stage('planner.iter_route'):
+            with profiler.stage('planner.localize'):
+                origin_index, origin_t = self._snap(origin)
+                destination_index, destination_t = self._snap(destination)
+            with profiler.stage('planner.plan'):
+                entry = self._plan(self._edge_of(origin_index, origin_t),
+                                   self._edge_of(destination_index, destination_t))
+        trace = self._iter_trace_indices(entry, origin_index, origin_t, destination, destination_index,
+                                         destination_t)
+        return self._iter_trace_waypoints(trace, entry.waypoints, origin_index, origin_t)
+
+    def _trace_waypoints(self, trace, waypoints, origin_index, origin_t):
+        """
+        This method turns the output of _trace_indices into a list of
+        (carla.Waypoint, RoadOption), reusing and filling the waypoints
+        dictionary of already created topology waypoints
+        """
+        return list(self._iter_trace_waypoints(trace, waypoints, origin_index, origin_t))
 
-        for i in range(len(route) - 1):
-            road_option = self._turn_decision(i, route)
-            edge = self._graph.edges[route[i], route[i+1]]
-            path = []
-
-            if edge['type'] != RoadOption.LANEFOLLOW and edge['type'] != RoadOption.VOID:
-                route_trace.append((current_waypoint, road_option))
-                exit_wp = edge['exit_waypoint']
-                n1, n2 = self._road_id_to_edge[exit_wp.road_id][exit_wp.section_id][exit_wp.lane_id]
-                next_edge = self._graph.edges[n1, n2]
-                if next_edge['path']:
-                    closest_index = self._find_closest_in_list(current_waypoint, next_edge['path'])
-                    closest_index = min(len(next_edge['path'])-1, closest_index+5)
-                    current_waypoint = next_edge['path'][closest_index]
-                else:
-                    current_waypoint = next_edge['exit_waypoint']
-                route_trace.append((current_waypoint, road_option))
+    def _iter_trace_waypoints(self, trace, waypoints, origin_index, origin_t):
+        """
+        Generator version of _trace_waypoints, creating each waypoint when
+        it is reached
+        """
+        origin_waypoint = None
+        for index, road_option in trace:
+            if index is None:
+                if origin_waypoint is None:
+                    origin_waypoint = self._topology.waypoint(origin_index, self._dao, origin_t)
+                waypoint = origin_waypoint
+            else:
+                waypoint = waypoints.get(index)
+                if waypoint is None:
+                    waypoint = waypoints[index] = self._topology.waypoint(index, self._dao)
+            yield waypoint, road_option
+
+    def _waypoint_edge(self, waypoint):
+        """
+        This function returns the graph edge of the lane of a waypoint, or None
+        """
+        try:
+            return self._road_id_to_edge[waypoint.road_id][waypoint.section_id][waypoint.lane_id]
+        except KeyError:
+            return None
+
+    def replan_lane_change(self, route_trace, location, destination, max_detour=50):
+        """
+        This method replans a route after a lane change, reusing the part of
+        the current route beyond the point where the new lane rejoins it.
+        A Dijkstra search bounded by max_detour looks for the edge of the
+        route where the detour from the new lane plus the rest of the route,
+        both in graph edge length like the path search of trace_route, is the
+        shortest; the new lane is traced up to that edge, along it if the
+        route drove along it. Only if no edge of the route is reached is the
+        whole route traced again with trace_route.
+        route_trace :   iterable of (carla.Waypoint, RoadOption) of the current
+                        route still to be driven, as returned by trace_route
+                        or iter_route
+        location    :   carla.Location on the lane to change to
+        destination :   carla.Location object of the route's end position
+        max_detour  :   bound of the rejoin search, in graph edge length
+        return      :   list of (carla.Waypoint, RoadOption) from location
+                        to destination
+        """
+        with self.profiler.stage('planner.replan_lane_change'):
+            return list(self._replan_lane_change(route_trace, location, destination, max_detour))
+
+    def iter_replan_lane_change(self, route_trace, location, destination, max_detour=50):
+        """
+        This method returns a generator of the (carla.Waypoint, RoadOption)
+        that replan_lane_change returns. Only the first waypoints of
+        route_trace are read before returning, the rest of it is read as the
+        generator is consumed, and the waypoints of the new lane are only
+        created as they are consumed, as by iter_route.
+        """
+        with self.profiler.stage('planner.iter_replan_lane_change'):
+            return self._replan_lane_change(route_trace, location, destination, max_detour)
 
+    def _route_edges(self, route_trace):
+        """
+        This function yields, for every graph edge a route trace goes along,
+        (position of its first waypoint, edge, travelled), where travelled is
+        the length of the route up to the edge, in graph edge length
+        """
+        graph = self._graph
+        previous, travelled = None, 0
+        for position, (waypoint, _) in enumerate(route_trace):
+            edge = self._waypoint_edge(waypoint)
+            if edge is None or edge == previous:
+                continue
+            # A lane change leaves from the entry of a lane, so the route only
+            # drove along the previous lane if it did not change lanes from it
+            if previous is not None and (previous[1] == edge[0] or not graph.has_edge(previous[0], edge[0])):
+                travelled += graph.edge_length(graph.edge(*previous))
+            previous = edge
+            yield position, edge, travelled
+
+    def _replan_lane_change(self, route_trace, location, destination, max_detour):
+        origin_index, origin_t = self._snap(location)
+        start = self._edge_of(origin_index, origin_t)
+        # A waypoint is about one unit of graph edge length, so edges further
+        # than twice max_detour along the route are left out; the route is
+        # read no further than that, and one waypoint more to tell whether it
+        # ends there
+        source = iter(route_trace)
+        window = list(islice(source, 2*max_detour + 1))
+        if start is None or not window:
+            return self.iter_route(location, destination)
+        complete = len(window) <= 2*max_detour
+
+        # Every edge of the route ahead is a rejoin candidate, but for the one
+        # the route is currently on. The rest of the route from a candidate is
+        # the same for all of them but for travelled, which is then its cost
+        # in the search; the search starts, as trace_route does, at the entry
+        # of the new lane.
+        edges = list(self._route_edges(window))
+        targets, rejoins = dict(), dict()
+        for i, (position, edge, travelled) in enumerate(edges):
+            if position == 0 or edge[0] in targets:
+                continue
+            if i + 1 < len(edges):
+                # The route drove along the edge unless it changed lanes at its entry
+                end_position, following, following_travelled = edges[i + 1]
+                driven = following_travelled > travelled
+                end_position -= 1
+            elif complete:
+                end_position, driven = len(window) - 1, True
             else:
-                path = path + [edge['entry_waypoint']] + edge['path'] + [edge['exit_waypoint']]
-                closest_index = self._find_closest_in_list(current_waypoint, path)
-                for waypoint in path[closest_index:]:
-                    current_waypoint = waypoint
-                    route_trace.append((current_waypoint, road_option))
-                    if len(route)-i <= 2 and waypoint.transform.location.distance(destination) < 2*resolution:
-                        break
-                    elif len(route)-i <= 2 and current_waypoint.road_id == destination_waypoint.road_id and current_waypoint.section_id == destination_waypoint.section_id and current_waypoint.lane_id == destination_waypoint.lane_id:
-                        destination_index = self._find_closest_in_list(destination_waypoint, path)
-                        if closest_index > destination_index:
-                            break
-
-        return route_trace
+                continue
+            targets[edge[0]] = -travelled
+            rejoins[edge[0]] = (edge, position, end_position, driven)
+
+        found = self._graph.nearest(start[0], targets, cutoff=max_detour)
+        if found is None:
+            return self.iter_route(location, destination)
+        route = found[1]
+        edge, position, end_position, driven = rejoins[route[-1]]
+        if complete and end_position == len(window) - 1:
+            # The last edge of the route is traced to the destination itself,
+            # as trace_route does
+            route.append(edge[1])
+            end, rest = destination, ()
+        elif driven:
+            # The new lane is traced along the rejoin edge, up to its last
+            # waypoint in the route
+            route.append(edge[1])
+            end, rest = window[end_position][0].transform.location, window[end_position + 1:]
+        elif len(route) > 1:
+            end, rest = window[position][0].transform.location, window[position:]
+        else:
+            return chain(window[position:], source)
+        end_index, end_t = self._snap(end)
+        entry = _CachedRoute(route, self._route_decisions(route))
+        bridge = self._iter_trace_indices(entry, origin_index, origin_t, end, end_index, end_t)
+        return chain(self._iter_trace_waypoints(bridge, entry.waypoints, origin_index, origin_t), rest, source)
+
+    def _trace_compact(self, origin, destination):
+        """
+        This method traces the route between two (x,y,z) locations as a
+        CompactRoute, without creating any carla.Waypoint. It returns None
+        if the locations can not be localized or are not connected.
+        """
+        origin_index, origin_t, _ = self._index.query(origin)
+        destination_index, destination_t, _ = self._index.query(destination)
+        start = self._edge_of(origin_index, origin_t)
+        end = self._edge_of(destination_index, destination_t)
+        if start is None or end is None:
+            return None
+        try:
+            entry = self._plan(start, end)
+        except NoPathError:
+            return None
+        trace = self._trace_indices(entry, origin_index, origin_t, carla.Location(*destination),
+                                    destination_index, destination_t)
+
+        indices = np.array([-1 if index is None else index for index, _ in trace], dtype=np.int64)
+        road_options = np.array([road_option.value for _, road_option in trace], dtype=np.int8)
+        locations = self._topology.points_xyz[np.maximum(indices, 0)]
+        locations[indices < 0] = self._snap_location(origin_index, origin_t)
+        return CompactRoute(indices, road_options, locations)
+
+    def trace_routes(self, pairs, workers=None, chunksize=8):
+        """
+        This method traces many routes in parallel worker processes.
+        The workers are forked from this process, so they share the
+        read-only topology, graph and spatial index instead of copying or
+        rebuilding them, and never query the server. Where fork is not
+        available, or with a single worker, routes are traced here.
+        The speedup over tracing here depends on the number of CPU cores:
+        each worker needs a core of its own, and with fewer cores than
+        workers the processes only add overhead.
+        pairs       :   sequence of (origin, destination) carla.Location pairs
+        workers     :   number of worker processes, all CPUs by default
+        chunksize   :   number of pairs handed to a worker at once
+        return      :   generator of CompactRoute (None for pairs without a
+                        route) in the order of pairs, yielding each route
+                        as soon as it and the ones before it are done
+        """
+        points = [((origin.x, origin.y, origin.z), (destination.x, destination.y, destination.z))
+                  for origin, destination in pairs]
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+            for origin, destination in points:
+                yield self._trace_compact(origin, destination)
+            return
+
+        # Forked workers inherit the planner passed to the initializer, not a copy
+        pool = multiprocessing.get_context('fork').Pool(min(workers, len(points) or 1), _init_worker, (self,))
+        with pool:
+            for route in pool.imap(_trace_compact_worker, points, chunksize):
+                yield route
+
+
+class _CachedRoute(object):
+    """
+    Route between two graph edges kept in the route cache: the node ids
+    found by the path search, the turn decision of every edge and the
+    waypoints already created for its topology points. Concurrent traces
+    may both create a missing waypoint; the dictionary keeps either one.
+    """
+
+    __slots__ = ('route', 'plan', 'waypoints')
+
+    def __init__(self, route, plan):
+        self.route = route
+        self.plan = plan
+        self.waypoints = dict()
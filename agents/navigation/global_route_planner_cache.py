@@ -0,0 +1,91 @@
+"""
+This module provides a persistent on-disk cache for the graph built by
+GlobalRoutePlanner.setup()
+"""
+
+import hashlib
+import os
+import pickle
+
+# Bump whenever the layout of the cached data changes
+CACHE_VERSION = 6
+
+
+class GlobalRoutePlannerCache(object):
+    """
+    This class stores the graph (a CSRGraph), id_map, road_id_to_edge, the
+    densified topology (a CompactTopology) and the optional contraction
+    hierarchy of a GlobalRoutePlanner in a versioned pickle file.
+    The cache key is the map name, a hash of the OpenDRIVE content, the
+    sampling resolution and the densification of the topology; a stale or
+    unreadable file is ignored and rebuilt.
+    Loading a pickle can run arbitrary code, so the cache directory must
+    only be writable by the user running the planner.
+    """
+
+    def __init__(self, cache_dir):
+        """
+        Constructor method.
+
+            :param cache_dir: directory holding the cache files, created on first save
+        """
+        self._cache_dir = cache_dir
+
+    def key(self, dao):
+        """
+        Computes the cache key of the map behind a GlobalRoutePlannerDAO.
+        Only map data already held by the client is read.
+
+            :param dao: GlobalRoutePlannerDAO object
+            :return key: (cache version, map name, OpenDRIVE sha1, sampling resolution, densification)
+        """
+        opendrive_hash = hashlib.sha1(dao.get_opendrive().encode('utf-8')).hexdigest()
+        return (CACHE_VERSION, dao.get_map_name(), opendrive_hash, float(dao.get_resolution()),
+                dao.get_densification())
+
+    def path(self, dao):
+        """ Returns the file used to cache the graph of the dao's map. """
+        map_name = os.path.basename(dao.get_map_name()) or 'map'
+        return os.path.join(self._cache_dir, '%s_%g_%s.grp.pkl' % (map_name, dao.get_resolution(),
+                                                                  dao.get_densification()))
+
+    def load(self, dao):
+        """
+        Loads the cached planner data for the dao's map.
+
+            :param dao: GlobalRoutePlannerDAO object
+            :return data: dictionary with topology, graph, id_map, road_id_to_edge and
+                hierarchy (a ContractionHierarchy or None), or None if there is
+                no valid cache entry for the current key
+        """
+        try:
+            with open(self.path(dao), 'rb') as cache_file:
+                data = pickle.load(cache_file)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, ValueError):
+            return None
+        if not isinstance(data, dict) or data.get('key') != self.key(dao):
+            return None
+        return data
+
+    def save(self, dao, topology, graph, id_map, road_id_to_edge, hierarchy=None):
+        """
+        Writes the planner data of the dao's map to disk, with the optional
+        contraction hierarchy. The file is replaced atomically, so
+        concurrent readers never see a partial write.
+        """
+        data = {
+            'key': self.key(dao),
+            'topology': topology,
+            'graph': graph,
+            'id_map': id_map,
+            'road_id_to_edge': road_id_to_edge,
+            'hierarchy': hierarchy}
+
+        if not os.path.isdir(self._cache_dir):
+            os.makedirs(self._cache_dir)
+        target = self.path(dao)
+        temporary = '%s.%d.tmp' % (target, os.getpid())
+        with open(temporary, 'wb') as cache_file:
+            pickle.dump(data, cache_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, target)
+
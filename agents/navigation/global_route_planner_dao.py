@@ -7,8 +7,15 @@
 This module provides implementation for GlobalRoutePlannerDAO
 """
 
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 
+from agents.navigation.compact_topology import CompactTopology
+
+# Ways of sampling the road segments of the topology, see GlobalRoutePlannerDAO
+DENSIFICATIONS = ('walk', 'bulk')
+
 
 class GlobalRoutePlannerDAO(object):
     """
@@ -16,53 +23,143 @@ class GlobalRoutePlannerDAO(object):
     from the carla server instance for GlobalRoutePlanner
     """
 
-    def __init__(self, wmap, sampling_resolution):
+    def __init__(self, wmap, sampling_resolution, densification='walk', workers=4):
         """
         Constructor method.
 
             :param wmap: carla.world object
             :param sampling_resolution: sampling distance between waypoints
+            :param densification: how road segments are sampled, 'walk' to
+                follow each segment with waypoint.next() or 'bulk' to take the
+                samples of a single Map.generate_waypoints() call
+            :param workers: threads walking the segments the bulk samples do
+                not cover
         """
+        if densification not in DENSIFICATIONS:
+            raise ValueError('densification must be one of %s' % (DENSIFICATIONS,))
         self._sampling_resolution = sampling_resolution
         self._wmap = wmap
+        self._densification = densification
+        self._workers = workers
+        self._lanes = None
 
     def get_topology(self):
         """
         Accessor for topology.
         This function retrieves topology from the server as a list of
         road segments as pairs of waypoint objects, and processes the
-        topology into a list of dictionary objects.
-
-            :return topology: list of dictionary objects with the following attributes
-                entry   -   waypoint of entry point of road segment
-                entryxyz-   (x,y,z) of entry point of road segment
-                exit    -   waypoint of exit point of road segment
-                exitxyz -   (x,y,z) of exit point of road segment
-                path    -   list of waypoints separated by 1m from entry
-                            to exit
+        topology into a CompactTopology.
+
+            :return topology: CompactTopology where segment i holds
+                entry_xyz   -   (x,y,z) of entry point of road segment
+                exit_xyz    -   (x,y,z) of exit point of road segment
+                is_junction -   whether the entry point lies in a junction
+                and its points are the entry waypoint, the waypoints separated
+                by sampling_resolution from entry to exit, and the exit waypoint
         """
-        topology = []
-        # Retrieving waypoints to construct a detailed topology
-        for segment in self._wmap.get_topology():
-            wp1, wp2 = segment[0], segment[1]
+        topology = self._wmap.get_topology()
+        if self._densification == 'bulk':
+            paths = self._bulk_paths(topology)
+        else:
+            paths = [self._walk(wp1, wp2) for wp1, wp2 in topology]
+
+        segments = []
+        for (wp1, wp2), path in zip(topology, paths):
             l1, l2 = wp1.transform.location, wp2.transform.location
             # Rounding off to avoid floating point imprecision
             x1, y1, z1, x2, y2, z2 = np.round([l1.x, l1.y, l1.z, l2.x, l2.y, l2.z], 0)
-            wp1.transform.location, wp2.transform.location = l1, l2
-            seg_dict = dict()
-            seg_dict['entry'], seg_dict['exit'] = wp1, wp2
-            seg_dict['entryxyz'], seg_dict['exitxyz'] = (x1, y1, z1), (x2, y2, z2)
-            seg_dict['path'] = []
-            endloc = wp2.transform.location
-            if wp1.transform.location.distance(endloc) > self._sampling_resolution:
-                w = wp1.next(self._sampling_resolution)[0]
-                while w.transform.location.distance(endloc) > self._sampling_resolution:
-                    seg_dict['path'].append(w)
-                    w = w.next(self._sampling_resolution)[0]
-            else:
-                seg_dict['path'].append(wp1.next(self._sampling_resolution)[0])
-            topology.append(seg_dict)
-        return topology
+            segments.append(((x1, y1, z1), (x2, y2, z2), wp1.is_junction, [wp1] + path + [wp2]))
+        return CompactTopology.from_segments(segments)
+
+    def _walk(self, wp1, wp2):
+        """ Waypoints between wp1 and wp2, sampled with successive next() calls """
+        path = []
+        endloc = wp2.transform.location
+        if wp1.transform.location.distance(endloc) > self._sampling_resolution:
+            w = wp1.next(self._sampling_resolution)[0]
+            while w.transform.location.distance(endloc) > self._sampling_resolution:
+                path.append(w)
+                w = w.next(self._sampling_resolution)[0]
+        else:
+            path.append(wp1.next(self._sampling_resolution)[0])
+        return path
+
+    def _lane_samples(self):
+        """
+        Waypoints of a single generate_waypoints() call bucketed by lane, as
+        {(road_id, section_id, lane_id): (progress, waypoints), ... } with
+        the waypoints sorted by progress, their s in driving direction
+        """
+        if self._lanes is None:
+            waypoints = self._wmap.generate_waypoints(self._sampling_resolution)
+            keys = np.array([(w.road_id, w.section_id, w.lane_id) for w in waypoints],
+                            dtype=np.int64).reshape(-1, 3)
+            progress = np.array([w.s for w in waypoints], dtype=np.float64)
+            # Lanes with positive ids are driven against the road reference line
+            progress[keys[:, 2] > 0] *= -1
+            order = np.lexsort((progress, keys[:, 2], keys[:, 1], keys[:, 0]))
+            keys, progress = keys[order], progress[order]
+            bounds = np.flatnonzero(np.any(keys[1:] != keys[:-1], axis=1)) + 1
+            self._lanes = dict()
+            for begin, end in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [len(order)]))):
+                if begin < end:
+                    self._lanes[tuple(int(v) for v in keys[begin])] = (
+                        progress[begin:end], [waypoints[i] for i in order[begin:end]])
+        return self._lanes
+
+    def _progress(self, waypoint):
+        return -waypoint.s if waypoint.lane_id > 0 else waypoint.s
+
+    def _bulk_paths(self, topology):
+        """
+        Waypoints between the ends of every segment of topology taken from
+        the generated lane samples. Segments shorter than the resolution, or
+        on lanes without samples, are walked instead, on a thread pool.
+        """
+        lanes = self._lane_samples()
+        resolution = self._sampling_resolution
+        paths = [None] * len(topology)
+        walks = []
+        for i, (wp1, wp2) in enumerate(topology):
+            samples = lanes.get((wp1.road_id, wp1.section_id, wp1.lane_id))
+            if samples is None or wp1.transform.location.distance(wp2.transform.location) <= resolution:
+                walks.append(i)
+                continue
+            progress, waypoints = samples
+            # Same bounds as the walk: one resolution past the entry, more than
+            # one resolution before the exit
+            begin = np.searchsorted(progress, self._progress(wp1) + 0.5 * resolution)
+            end = np.searchsorted(progress, self._progress(wp2) - resolution)
+            paths[i] = waypoints[begin:end]
+
+        if walks:
+            with ThreadPoolExecutor(max_workers=max(1, self._workers)) as executor:
+                for i, path in zip(walks, executor.map(lambda i: self._walk(*topology[i]), walks)):
+                    paths[i] = path
+        return paths
+
+    def get_lane_path(self, waypoint):
+        """
+        Waypoints separated by sampling_resolution that follow waypoint on
+        its own lane (same road, section and lane), up to the end of it.
+
+            :param waypoint: carla.Waypoint
+            :return path: list of carla.Waypoint, without waypoint itself
+        """
+        road_id, section_id, lane_id = waypoint.road_id, waypoint.section_id, waypoint.lane_id
+        if self._densification == 'bulk':
+            samples = self._lane_samples().get((road_id, section_id, lane_id))
+            if samples is None:
+                return []
+            progress, waypoints = samples
+            return waypoints[np.searchsorted(progress, self._progress(waypoint) + 0.5 * self._sampling_resolution):]
+
+        path = []
+        next_wp = waypoint.next(self._sampling_resolution)
+        while next_wp is not None and next_wp and next_wp[0].road_id == road_id and next_wp[0].section_id == section_id and next_wp[0].lane_id == lane_id:
+            path.append(next_wp[0])
+            next_wp = next_wp[0].next(self._sampling_resolution)
+        return path
 
     def get_waypoint(self, location):
         """
@@ -74,6 +171,29 @@ class GlobalRoutePlannerDAO(object):
         waypoint = self._wmap.get_waypoint(location)
         return waypoint
 
+    def get_waypoint_xodr(self, road_id, lane_id, s):
+        """
+        The method returns waypoint at given OpenDRIVE coordinates
+
+            :param road_id: OpenDRIVE road id
+            :param lane_id: OpenDRIVE lane id
+            :param s: distance along the road reference line
+            :return waypoint: waypoint at those coordinates, or None if they are invalid
+        """
+        return self._wmap.get_waypoint_xodr(road_id, lane_id, s)
+
+    def get_map_name(self):
+        """ Accessor for the map name """
+        return self._wmap.name
+
+    def get_opendrive(self):
+        """ Accessor for the OpenDRIVE content of the map """
+        return self._wmap.to_opendrive()
+
     def get_resolution(self):
         """ Accessor for self._sampling_resolution """
         return self._sampling_resolution
+
+    def get_densification(self):
+        """ Accessor for self._densification """
+        return self._densification
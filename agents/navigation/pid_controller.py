@@ -15,6 +15,8 @@ import carla
 import queue
 import numpy as np
 
+from agents.tools.instrumentation import NULL_PROFILER
+
 def get_speed(vehicle):
     """
     Calcula a velocidade do veículo em Km/h
@@ -26,7 +28,8 @@ def get_speed(vehicle):
 
 class VehiclePIDController():
 
-    def __init__(self, vehicle, args_lateral, args_longitudinal, max_throttle=0.75, max_brake=0.3, max_steering=1.0):
+    def __init__(self, vehicle, args_lateral, args_longitudinal, max_throttle=0.75, max_brake=0.3, max_steering=1.0,
+                 profiler=None):
         self.max_brake = max_brake
         self.max_steering = max_steering
         self.max_throttle = max_throttle
@@ -35,11 +38,25 @@ class VehiclePIDController():
         self.world = vehicle.get_world()
         self.long_controller = PIDLongitudinalControl(self.vehicle, **args_longitudinal)
         self.lat_controller = PIDLateralControl(self.vehicle, **args_lateral)
+        # StageProfiler que mede o tempo de cada passo; sem ele nada é medido
+        self.profiler = profiler if profiler is not None else NULL_PROFILER
+
 
+    def run_step(self, target_speed, waypoint, state=None):
+        """
+        Sem state, a velocidade e a pose do veículo são lidas do servidor;
+        com state (VehicleState do tick atual) nenhuma leitura é feita
+        """
+        with self.profiler.stage('pid.run_step'):
+            return self._run_step(target_speed, waypoint, state)
 
-    def run_step(self, target_speed, waypoint):
-        acceleration = self.long_controller.run_step(target_speed)
-        current_steering = self.lat_controller.run_step(waypoint)
+    def _run_step(self, target_speed, waypoint, state):
+        if state is None:
+            current_speed, vehicle_transform = get_speed(self.vehicle), self.vehicle.get_transform()
+        else:
+            current_speed, vehicle_transform = state.speed, state.transform
+        acceleration = self.long_controller.run_step(target_speed, current_speed)
+        current_steering = self.lat_controller.run_step(waypoint, vehicle_transform)
         control = carla.VehicleControl()
 
         # Longitudinal
@@ -51,7 +68,7 @@ class VehiclePIDController():
             control.brake = min(abs(acceleration), self.max_brake)
 
         # Lateral
-        current_steering = self.lat_controller.run_step(waypoint)
+        current_steering = self.lat_controller.run_step(waypoint, vehicle_transform)
         if current_steering >= 0:
             steering = min(self.max_steering, current_steering)
         else:
@@ -85,8 +102,9 @@ class PIDLongitudinalControl():
 
         return np.clip(self.K_P*error + self.K_D*de + self.K_I*ie, -1.0, 1.0)
 
-    def run_step(self, target_speed):
-        current_speed = get_speed(self.vehicle)
+    def run_step(self, target_speed, current_speed=None):
+        if current_speed is None:
+            current_speed = get_speed(self.vehicle)
         return self.pid_controller(target_speed, current_speed)
 
 
@@ -128,5 +146,139 @@ class PIDLateralControl():
 
         return (self.K_P*dot + self.K_I*ie + self.K_D*de)
 
-    def run_step(self, waypoint):
-        return self.pid_controller(waypoint, self.vehicle.get_transform())
+    def run_step(self, waypoint, vehicle_transform=None):
+        if vehicle_transform is None:
+            vehicle_transform = self.vehicle.get_transform()
+        return self.pid_controller(waypoint, vehicle_transform)
+
+
+class FleetPIDController():
+    """
+    Controladores PID longitudinal e lateral de uma frota de N veículos,
+    calculados juntos em um único passo vetorizado. Ganhos, históricos de
+    erro e integrais ficam em arrays (um valor por veículo); as integrais
+    são somas correntes sobre a mesma janela de 10 erros dos controladores
+    individuais, e os comandos gerados são os mesmos do VehiclePIDController
+    (que atualiza o controlador lateral duas vezes por passo)
+    """
+
+    def __init__(self, vehicles, args_lateral, args_longitudinal, max_throttle=0.75, max_brake=0.3,
+                 max_steering=1.0, buffer_size=10):
+        # Ganhos e dt podem ser escalares (iguais para a frota) ou um valor por veículo
+        self.vehicles = list(vehicles)
+        self.max_throttle = max_throttle
+        self.max_brake = max_brake
+        self.max_steering = max_steering
+        self.world = self.vehicles[0].get_world() if self.vehicles else None
+        self.long_controller = _FleetPID(len(self.vehicles), buffer_size, **args_longitudinal)
+        self.lat_controller = _FleetPID(len(self.vehicles), buffer_size, **args_lateral)
+
+    def __len__(self):
+        return len(self.vehicles)
+
+    def compute(self, target_speed, target_xy, speed, xy, yaw):
+        """
+        Passo vetorizado dos controladores, sem nenhuma leitura do servidor
+
+            :param target_speed: (N,) velocidades alvo, em km/h
+            :param target_xy: (N, 2) posições dos waypoints alvo
+            :param speed: (N,) velocidades atuais, em km/h
+            :param xy: (N, 2) posições atuais dos veículos
+            :param yaw: (N,) orientações atuais dos veículos, em graus
+            :return: arrays (N,) de throttle, steer e brake
+        """
+        acceleration = np.clip(self.long_controller.step(np.asarray(target_speed, dtype=np.float64) - speed),
+                               -1.0, 1.0)
+
+        # Ângulo com sinal entre a orientação do veículo e a direção do waypoint alvo
+        heading = np.radians(yaw)
+        vx, vy = np.cos(heading), np.sin(heading)
+        wx, wy = target_xy[:, 0] - xy[:, 0], target_xy[:, 1] - xy[:, 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cosine = (wx*vx + wy*vy) / (np.hypot(wx, wy) * np.hypot(vx, vy))
+        # Veículo exatamente sobre o waypoint: erro nulo, para não levar NaN às integrais
+        cosine = np.where(np.isfinite(cosine), cosine, 1.0)
+        angle = np.arccos(np.clip(cosine, -1.0, 1.0))
+        angle = np.where(vx*wy - vy*wx < 0, -angle, angle)
+        self.lat_controller.step(angle)
+        steering = self.lat_controller.step(angle)
+
+        throttle = np.where(acceleration >= 0.0, np.minimum(np.abs(acceleration), self.max_throttle), 0.0)
+        brake = np.where(acceleration >= 0.0, 0.0, np.minimum(np.abs(acceleration), self.max_brake))
+        steer = np.clip(steering, -self.max_steering, self.max_steering)
+        return throttle, steer, brake
+
+    def run_step(self, target_speed, waypoints, states=None):
+        """
+        Calcula os comandos de todos os veículos para o tick atual
+
+            :param target_speed: velocidade alvo (km/h), uma para a frota ou uma por veículo
+            :param waypoints: waypoint alvo de cada veículo
+            :param states: VehicleState de cada veículo no tick atual; sem eles o estado
+                da frota é lido de um único snapshot do mundo
+            :return: lista de carla.command.ApplyVehicleControl, pronta para client.apply_batch
+        """
+        if states is None:
+            snapshot = self.world.get_snapshot()
+            actors = [snapshot.find(vehicle.id) for vehicle in self.vehicles]
+            transforms = [actor.get_transform() for actor in actors]
+            velocities = [actor.get_velocity() for actor in actors]
+            speed = 3.6 * np.sqrt([v.x**2 + v.y**2 + v.z**2 for v in velocities])
+        else:
+            transforms = [state.transform for state in states]
+            speed = np.array([state.speed for state in states], dtype=np.float64)
+        xy = np.array([(t.location.x, t.location.y) for t in transforms], dtype=np.float64).reshape(-1, 2)
+        yaw = np.array([t.rotation.yaw for t in transforms], dtype=np.float64)
+        target_xy = np.array([(w.transform.location.x, w.transform.location.y) for w in waypoints],
+                             dtype=np.float64).reshape(-1, 2)
+        target_speed = np.broadcast_to(np.asarray(target_speed, dtype=np.float64), speed.shape)
+
+        throttle, steer, brake = self.compute(target_speed, target_xy, speed, xy, yaw)
+        commands = []
+        for vehicle, t, s, b in zip(self.vehicles, throttle.tolist(), steer.tolist(), brake.tolist()):
+            control = carla.VehicleControl()
+            control.throttle = t
+            control.steer = s
+            control.brake = b
+            control.hand_brake = False
+            control.manual_gear_shift = False
+            commands.append(carla.command.ApplyVehicleControl(vehicle.id, control))
+        return commands
+
+
+class _FleetPID():
+    """
+    Termos PID de N controladores independentes. Os últimos buffer_size
+    erros de cada um ficam em um buffer circular e a integral é a soma
+    corrente desse buffer, atualizada em O(1) por passo
+    """
+
+    def __init__(self, size, buffer_size, K_P=1.0, K_I=0.0, K_D=0.0, dt=0.03):
+        self.K_P = np.broadcast_to(np.asarray(K_P, dtype=np.float64), (size,))
+        self.K_I = np.broadcast_to(np.asarray(K_I, dtype=np.float64), (size,))
+        self.K_D = np.broadcast_to(np.asarray(K_D, dtype=np.float64), (size,))
+        self.dt = np.broadcast_to(np.asarray(dt, dtype=np.float64), (size,))
+        self.errors = np.zeros((buffer_size, size))
+        self.error_sum = np.zeros(size)
+        self.count = 0
+
+    def step(self, error):
+        slot = self.count % len(self.errors)
+        previous = self.errors[(self.count - 1) % len(self.errors)].copy()
+        self.error_sum += error - self.errors[slot]
+        self.errors[slot] = error
+        if slot == len(self.errors) - 1:
+            # Uma soma completa por volta do buffer evita o acúmulo de erros de arredondamento
+            self.error_sum = self.errors.sum(axis=0)
+        self.count += 1
+        if self.count >= 2:
+            de = (error - previous) / self.dt
+            ie = self.error_sum * self.dt
+        else:
+            de = ie = 0.0
+        return self.K_P*error + self.K_I*ie + self.K_D*de
+
+    def reset(self):
+        self.errors[:] = 0.0
+        self.error_sum[:] = 0.0
+        self.count = 0
@@ -0,0 +1,72 @@
+"""
+This module provides RouteCache, the bounded LRU cache of planned routes
+used by GlobalRoutePlanner
+"""
+
+import threading
+from collections import OrderedDict, namedtuple
+
+RouteCacheInfo = namedtuple('RouteCacheInfo', ['hits', 'misses', 'evictions', 'maxsize', 'currsize'])
+
+
+class RouteCache(object):
+    """
+    Least recently used cache with hit, miss and eviction counters.
+    It can be used from several threads.
+    """
+
+    def __init__(self, maxsize=128):
+        """
+        Constructor method.
+
+            :param maxsize: maximum number of entries, 0 disables caching
+        """
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+    def get(self, key):
+        """
+        Returns the entry stored under key and marks it as most recently
+        used, or None (counted as a miss) if there is none
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry
+
+    def put(self, key, entry):
+        """
+        Stores entry under key, evicting the least recently used entries
+        beyond maxsize
+        """
+        if self._maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def info(self):
+        """ Returns a RouteCacheInfo with the counters and sizes of the cache """
+        with self._lock:
+            return RouteCacheInfo(self._hits, self._misses, self._evictions, self._maxsize, len(self._entries))
+
+    def clear(self):
+        """ Drops every entry and resets the counters """
+        with self._lock:
+            self._entries.clear()
+            self._hits = self._misses = self._evictions = 0
@@ -0,0 +1,206 @@
+"""
+This module provides RouteCursor, which tracks the progress of a vehicle
+along a route traced by GlobalRoutePlanner
+"""
+
+from collections import namedtuple
+from itertools import chain, islice
+
+import numpy as np
+
+# Part of a route copied out of a RouteCursor by RouteCursor.section, which
+# another thread can read while the cursor advances or loads more waypoints:
+#   route       -   RouteCursor it was taken from, only to tell routes apart
+#   index       -   route index of the target when it was taken
+#   first       -   route index of the first of locations
+#   locations   -   (n, 3) array, a copy of the locations of the waypoints from first on
+RouteSection = namedtuple('RouteSection', ['route', 'index', 'first', 'locations'])
+
+
+class RouteCursor(object):
+    """
+    Route stored as a polyline of waypoint locations with a monotone
+    progress cursor. The cursor points to the next waypoint to drive to
+    (the target); advance() moves it past every waypoint the vehicle has
+    passed or is close to, looking only at a bounded window ahead, so a
+    tick costs the same on any route length. It also keeps the distance
+    driven along the route, measured on the polyline from its first
+    waypoint.
+
+    With a lookahead, the route is read lazily from an iterator (such as
+    GlobalRoutePlanner.iter_route) and only the waypoints up to lookahead
+    ahead of the target are loaded; locations, waypoints and offsets then
+    cover the part of the route loaded so far.
+    """
+
+    def __init__(self, route_trace=(), window=20, reach=4.0, lookahead=None):
+        """
+        Constructor method.
+
+            :param route_trace: list of (carla.Waypoint, RoadOption), as returned by
+                trace_route, or with lookahead any iterable of them
+            :param window: number of route segments ahead of the cursor searched by advance()
+            :param reach: waypoints closer than this in x and in y count as reached, in metres
+            :param lookahead: number of waypoints kept loaded ahead of the target,
+                None to load the whole route at once
+        """
+        self.window = window
+        self.reach = reach
+        self.lookahead = lookahead
+        self.index = 0
+        self.distance = 0.0
+        self._segment = 0
+        self._waypoints = []
+        self._road_options = []
+        self._source = None
+        size = len(route_trace) if lookahead is None else lookahead + window
+        self._xyz = np.empty((max(size, 16), 3), dtype=np.float64)
+        self._offsets = np.empty(len(self._xyz), dtype=np.float64)
+        if lookahead is None:
+            self.extend(route_trace)
+        else:
+            self._source = iter(route_trace)
+            self._load()
+
+    def extend(self, route_trace):
+        """
+        Appends (carla.Waypoint, RoadOption) pairs at the end of the route.
+        """
+        route_trace = list(route_trace)
+        size, count = len(self._waypoints), len(route_trace)
+        if size + count > len(self._xyz):
+            grown = np.empty((max(2 * len(self._xyz), size + count), 3), dtype=np.float64)
+            grown[:size] = self._xyz[:size]
+            self._xyz = grown
+            offsets = np.empty(len(grown), dtype=np.float64)
+            offsets[:size] = self._offsets[:size]
+            self._offsets = offsets
+        for i, (waypoint, road_option) in enumerate(route_trace):
+            location = waypoint.transform.location
+            self._xyz[size + i] = (location.x, location.y, location.z)
+            self._waypoints.append(waypoint)
+            self._road_options.append(road_option)
+        if count:
+            steps = np.linalg.norm(np.diff(self._xyz[max(size - 1, 0):size + count], axis=0), axis=1)
+            start = self._offsets[size - 1] if size else 0.0
+            self._offsets[max(size, 1):size + count] = start + np.cumsum(steps)
+            if not size:
+                self._offsets[0] = 0.0
+
+    def _load(self):
+        """
+        Reads waypoints from the route iterator until lookahead of them
+        (and at least a window) are loaded ahead of the target. They are
+        read a quarter of the lookahead at a time, so loading is spread
+        over the ticks rather than done every tick.
+        """
+        if self._source is None:
+            return
+        wanted = self.index + max(self.lookahead, self.window) + 1
+        if wanted <= len(self._waypoints):
+            return
+        count = wanted - len(self._waypoints) + max(self.lookahead // 4, 1)
+        chunk = list(islice(self._source, count))
+        if len(chunk) < count:
+            self._source = None
+        self.extend(chunk)
+
+    @property
+    def complete(self):
+        """ Whether the whole route is loaded """
+        return self._source is None
+
+    def __len__(self):
+        """ Number of waypoints loaded from the target to the end of the route """
+        return len(self._waypoints) - self.index
+
+    @property
+    def locations(self):
+        """ (n, 3) array with the locations of all the waypoints of the route """
+        return self._xyz[:len(self._waypoints)]
+
+    @property
+    def waypoints(self):
+        """ List with all the waypoints of the route """
+        return self._waypoints
+
+    @property
+    def offsets(self):
+        """ (n,) array with the distance along the route of every waypoint, in metres """
+        return self._offsets[:len(self._waypoints)]
+
+    @property
+    def target(self):
+        """ Waypoint the vehicle is driving to """
+        return self._waypoints[min(self.index, len(self._waypoints) - 1)]
+
+    @property
+    def road_option(self):
+        """ RoadOption of the target """
+        return self._road_options[min(self.index, len(self._road_options) - 1)]
+
+    def arrived(self):
+        """ Whether the target is the last waypoint of the route """
+        return self._source is None and self.index >= len(self._waypoints) - 1
+
+    def section(self, count):
+        """
+        RouteSection with the waypoint before the target and the next count
+        waypoints, starting at the target
+        """
+        first = max(self.index - 1, 0)
+        end = min(self.index + count, len(self._waypoints))
+        return RouteSection(self, self.index, first, self._xyz[first:max(end, first)].copy())
+
+    def upcoming(self, count):
+        """ The next count waypoints, starting at the target """
+        return self._waypoints[self.index:self.index + count]
+
+    def remaining_trace(self):
+        """
+        Iterator of the (carla.Waypoint, RoadOption) from the target to the
+        end of the route: the loaded ones, then the ones still to be read
+        from the route iterator. The route iterator is handed over rather
+        than loaded, so no more waypoints are loaded into the cursor.
+        """
+        source, self._source = self._source, None
+        loaded = zip(self._waypoints[self.index:], self._road_options[self.index:])
+        return loaded if source is None else chain(loaded, source)
+
+    def advance(self, location):
+        """
+        Moves the cursor forward for a vehicle at location: the vehicle is
+        projected onto the route segments in the window around the cursor,
+        the target becomes the waypoint ahead of the projection, and
+        waypoints within reach of the vehicle are skipped. The distance
+        along the route becomes the one of the projection, if larger.
+
+            :param location: carla.Location of the vehicle
+            :return: index of the target
+        """
+        size = len(self._waypoints)
+        last = size - 1
+        if self.index >= last:
+            self._load()
+            return self.index
+        point = np.array([location.x, location.y, location.z])
+        # The window starts at the segment of the last projection, which can be
+        # behind the target when it was reached by the reach box
+        first = min(self._segment, max(self.index - 1, 0))
+        end = min(self.index + self.window, last)
+        a = self._xyz[first:end]
+        d = self._xyz[first + 1:end + 1] - a
+        t = np.einsum('ij,ij->i', point - a, d) / np.maximum(np.einsum('ij,ij->i', d, d), 1e-12)
+        offset = a + np.clip(t, 0.0, 1.0)[:, None] * d - point
+        closest = int(np.argmin(np.einsum('ij,ij->i', offset, offset)))
+        index = max(self.index, first + closest + (1 if t[closest] > 0.0 else 0))
+        along = self._offsets[first + closest] + min(max(t[closest], 0.0), 1.0) * \
+            (self._offsets[first + closest + 1] - self._offsets[first + closest])
+        self.distance = max(self.distance, float(along))
+        self._segment = first + closest
+
+        while index < last and np.all(np.abs(self._xyz[index, :2] - point[:2]) <= self.reach):
+            index += 1
+        self.index = index
+        self._load()
+        return index
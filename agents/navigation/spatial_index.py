@@ -0,0 +1,119 @@
+"""
+This module provides SpatialIndex, a uniform-grid index over the densified
+topology used to localize locations without querying the server
+"""
+
+import math
+import numpy as np
+
+
+class SpatialIndex(object):
+    """
+    Uniform grid over the polyline pieces of a CompactTopology. Each piece
+    joins two consecutive points of the same segment and is bucketed by its
+    midpoint; a query projects the location onto the pieces of the
+    surrounding cells, growing the searched ring until no piece outside it
+    can be closer.
+    """
+
+    def __init__(self, topology, cell_size=None):
+        """
+        Constructor method.
+
+            :param topology: CompactTopology to index
+            :param cell_size: grid cell size in metres, by default twice the longest piece
+        """
+        starts = np.arange(topology.num_points - 1, dtype=np.int64)
+        # Pieces never join the last point of a segment to the first of the next one
+        starts = starts[~np.isin(starts + 1, topology.offsets)]
+        xyz = topology.points_xyz
+        ends = starts + 1
+        self._start = starts
+        self._a = xyz[starts]
+        self._d = xyz[ends] - self._a
+        self._d2 = np.einsum('ij,ij->i', self._d, self._d)
+        yaw = np.radians(topology.yaw[starts].astype(np.float64))
+        self._heading = np.stack((np.cos(yaw), np.sin(yaw)), axis=1)
+
+        self._half_length = float(np.sqrt(self._d2.max()) / 2.0) if len(self._d2) else 0.0
+        self._cell = float(cell_size) if cell_size else max(10.0, 4.0 * self._half_length)
+        midpoints = self._a[:, :2] + self._d[:, :2] / 2.0
+        cells = np.floor(midpoints / self._cell).astype(np.int64)
+        order = np.lexsort((cells[:, 1], cells[:, 0]))
+        self._order = order
+        sorted_cells = cells[order]
+        changes = np.flatnonzero(np.any(np.diff(sorted_cells, axis=0) != 0, axis=1)) + 1
+        bounds = np.concatenate(([0], changes, [len(order)]))
+        self._buckets = {
+            (int(sorted_cells[begin, 0]), int(sorted_cells[begin, 1])): (int(begin), int(end))
+            for begin, end in zip(bounds[:-1], bounds[1:]) if end > begin}
+        if len(cells):
+            self._cell_min = cells.min(axis=0)
+            self._cell_max = cells.max(axis=0)
+
+    def _candidates(self, cx, cy, ring):
+        """ Pieces bucketed in the square ring of cells at Chebyshev distance ring """
+        chunks = []
+        for i in range(cx - ring, cx + ring + 1):
+            for j in range(cy - ring, cy + ring + 1):
+                if ring and max(abs(i - cx), abs(j - cy)) != ring:
+                    continue
+                bucket = self._buckets.get((i, j))
+                if bucket is not None:
+                    chunks.append(self._order[bucket[0]:bucket[1]])
+        return chunks
+
+    def _project(self, point, candidates, heading):
+        t = np.einsum('ij,ij->i', point - self._a[candidates], self._d[candidates])
+        t = np.clip(t / np.maximum(self._d2[candidates], 1e-12), 0.0, 1.0)
+        offset = self._a[candidates] + t[:, None] * self._d[candidates] - point
+        distance = np.sqrt(np.einsum('ij,ij->i', offset, offset))
+        if heading is not None:
+            # Lanes heading away from the requested direction are only used as last resort
+            opposite = self._heading[candidates].dot(heading) < 0.0
+            distance = distance + opposite * 1e6
+        best = int(np.argmin(distance))
+        return candidates[best], float(t[best]), float(distance[best])
+
+    def query(self, location, yaw=None):
+        """
+        Finds the closest point on the indexed lanes.
+
+            :param location: (x,y,z) sequence
+            :param yaw: optional heading in degrees; lanes driving against it are avoided
+            :return: (index, t, distance) where the projection lies at fraction t
+                between buffer points index and index+1, or None if the index is empty
+        """
+        if not len(self._start):
+            return None
+        point = np.asarray(location, dtype=np.float64)
+        heading = None
+        if yaw is not None:
+            heading = np.array([math.cos(math.radians(yaw)), math.sin(math.radians(yaw))])
+        cx, cy = int(math.floor(point[0] / self._cell)), int(math.floor(point[1] / self._cell))
+        # Rings beyond this one cannot contain any piece
+        last_ring = int(max(abs(cx - self._cell_min[0]), abs(cx - self._cell_max[0]),
+                            abs(cy - self._cell_min[1]), abs(cy - self._cell_max[1])))
+        best = None
+        chunks = []
+        for ring in range(0, last_ring + 1):
+            chunks.extend(self._candidates(cx, cy, ring))
+            if chunks:
+                best = self._project(point, np.concatenate(chunks), heading)
+                # Every piece closer than this has its midpoint inside the searched rings
+                if best[2] <= ring * self._cell - self._half_length:
+                    break
+        piece, t, distance = best
+        return int(self._start[piece]), t, distance
+
+    def query_many(self, locations, yaws=None):
+        """
+        Batch version of query.
+
+            :param locations: sequence of (x,y,z) sequences
+            :param yaws: optional sequence of headings in degrees (or None entries)
+            :return: list of (index, t, distance) tuples
+        """
+        if yaws is None:
+            yaws = [None] * len(locations)
+        return [self.query(location, yaw) for location, yaw in zip(locations, yaws)]
@@ -0,0 +1,181 @@
+"""
+This module provides SpeedProfile, the target speed at every waypoint of
+a route, computed when the route is set from its shape and the
+acceleration limits of the vehicle
+"""
+
+import math
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def curvature(locations):
+    """
+    Curvature (1/m) of a polyline at each of its points, from the circle
+    through the point and its two neighbours; 0 at both ends and wherever
+    the neighbours coincide.
+
+        :param locations: (n, 3) array of points, only x and y are used
+    """
+    kappa = np.zeros(len(locations))
+    if len(locations) < 3:
+        return kappa
+    a, b, c = locations[:-2, :2], locations[1:-1, :2], locations[2:, :2]
+    ab, bc, ca = b - a, c - b, a - c
+    cross = ab[:, 0] * bc[:, 1] - ab[:, 1] * bc[:, 0]
+    lengths = np.hypot(ab[:, 0], ab[:, 1]) * np.hypot(bc[:, 0], bc[:, 1]) * np.hypot(ca[:, 0], ca[:, 1])
+    kappa[1:-1] = np.where(lengths > 1e-9, 2.0 * np.abs(cross) / np.maximum(lengths, 1e-9), 0.0)
+    return kappa
+
+
+def speed_profile(offsets, locations, speed_limits, start_speed=0.0, stops=(), max_lateral_acceleration=2.5,
+                  max_acceleration=2.0, max_deceleration=3.0, max_jerk=2.0, min_speed=10.0):
+    """
+    Target speed at every point of a route, in km/h. Computed with NumPy
+    over the whole polyline:
+
+        - the speed limit of each point, lowered where the curvature would
+          exceed max_lateral_acceleration, and 0 at stops;
+        - a forward pass from start_speed bounding the acceleration and a
+          backward pass bounding the deceleration. With a constant bound a,
+          v(i)**2 <= min over j of v(j)**2 + 2*a*|s(i) - s(j)|, which is a
+          running minimum (np.minimum.accumulate) of v(j)**2 -+ 2*a*s(j);
+        - a moving minimum followed by a moving average of v**2 over the
+          distance needed to swing between full acceleration and full
+          braking at max_jerk, which rounds the corners of the profile. Both
+          keep the profile under the bounds above, so still 0 at stops, and
+          within the acceleration limits.
+
+    min_speed is also a floor everywhere but on the way into a stop, so the
+    vehicle can always move on to the next waypoint.
+
+        :param offsets: (n,) distance of each point along the route, in metres
+        :param locations: (n, 3) locations of the points
+        :param speed_limits: speed limit in km/h, one for all points or one per point
+        :param start_speed: speed of the vehicle at the first point, in km/h
+        :param stops: indices of the points to stop at
+        :param max_lateral_acceleration: in m/s**2
+        :param max_acceleration: in m/s**2
+        :param max_deceleration: in m/s**2
+        :param max_jerk: in m/s**3, None to skip the smoothing
+        :param min_speed: lowest target speed, in km/h
+        :return: (n,) array of target speeds, in km/h
+    """
+    offsets = np.asarray(offsets, dtype=np.float64)
+    if not len(offsets):
+        return np.empty(0)
+    floor = (min_speed / 3.6) ** 2
+    limits = np.broadcast_to(np.asarray(speed_limits, dtype=np.float64) / 3.6, offsets.shape) ** 2
+    kappa = curvature(np.asarray(locations, dtype=np.float64))
+    with np.errstate(divide='ignore'):
+        squared = np.maximum(np.minimum(limits, max_lateral_acceleration / kappa), floor)
+    squared[0] = min(squared[0], max((start_speed / 3.6) ** 2, floor))
+    squared[list(stops)] = 0.0
+
+    # Forward and backward passes, on the squared speeds
+    squared = np.minimum(squared, np.minimum.accumulate(squared - 2 * max_acceleration * offsets) +
+                         2 * max_acceleration * offsets)
+    squared = np.minimum(squared, np.minimum.accumulate((squared + 2 * max_deceleration * offsets)[::-1])[::-1] -
+                         2 * max_deceleration * offsets)
+
+    if max_jerk and len(offsets) > 2:
+        spacing = max(float(np.median(np.diff(offsets))), 1e-3)
+        length = (max_acceleration + max_deceleration) * math.sqrt(float(squared.max())) / max_jerk
+        half = min(int(math.ceil(length / 2 / spacing)), len(offsets) - 1)
+        if half > 0:
+            padded = np.pad(squared, half, mode='edge')
+            eroded = sliding_window_view(padded, 2 * half + 1).min(axis=1)
+            padded = np.pad(eroded, half, mode='edge')
+            squared = sliding_window_view(padded, 2 * half + 1).mean(axis=1)
+
+    return 3.6 * np.sqrt(np.maximum(squared, 0.0))
+
+
+class SpeedProfile(object):
+    """
+    Target speeds along a RouteCursor, looked up at the cursor in O(1)
+    while driving. The profile covers the waypoints loaded in the cursor,
+    from its target on; when more of a streamed route is loaded, or its
+    stops change, it is computed again from the target, starting from the
+    speed the previous profile had there, so the target speed stays
+    continuous. A new route starts from the current speed. The route end
+    gets a stop once the whole route is loaded; other stops, such as the
+    stop lines of red traffic lights, are given to update().
+    """
+
+    def __init__(self, max_lateral_acceleration=2.5, max_acceleration=2.0, max_deceleration=3.0, max_jerk=2.0,
+                 min_speed=10.0):
+        """
+        Constructor method, see speed_profile for the parameters.
+        """
+        self.limits = {'max_lateral_acceleration': max_lateral_acceleration,
+                       'max_acceleration': max_acceleration, 'max_deceleration': max_deceleration,
+                       'max_jerk': max_jerk, 'min_speed': min_speed}
+        self.speeds = np.empty(0)
+        self.offsets = np.empty(0)
+        self._route = None
+        self._first = 0     # Route index of speeds[0]
+        self._size = 0      # Number of route waypoints when the profile was computed
+        self._limit = None  # Speed limit the profile was computed with
+        self._stops = ()    # Stops the profile was computed with
+
+    def stopping_distance(self, speed, rounded=True):
+        """
+        Distance the profile takes to stop from speed (km/h), in metres:
+        braking at max_deceleration plus, if rounded, the rounding of the
+        jerk limit
+        """
+        speed = speed / 3.6
+        limits = self.limits
+        distance = speed ** 2 / (2 * limits['max_deceleration'])
+        if rounded and limits['max_jerk']:
+            distance += (limits['max_acceleration'] + limits['max_deceleration']) * speed / limits['max_jerk']
+        return distance
+
+    def update(self, route, current_speed, speed_limit=float('inf'), stops=()):
+        """
+        Computes the profile again if the route changed or grew, or if the
+        speed limit or the stops changed.
+
+            :param route: RouteCursor of the route
+            :param current_speed: speed of the vehicle, in km/h
+            :param speed_limit: speed limit of the route, in km/h
+            :param stops: distances along the route to stop at, in metres, as
+                RouteCursor.offsets; the target is 0 at the last waypoint
+                before each of them
+            :return: whether the profile was computed
+        """
+        size = len(route.waypoints)
+        stops = tuple(stops)
+        if route is self._route and size == self._size and speed_limit == self._limit and stops == self._stops:
+            return False
+        first = min(route.index, max(size - 1, 0))
+        start_speed = self.at(first) if route is self._route else current_speed
+        offsets = route.offsets[first:]
+        indices = [size - 1 - first] if route.complete and size else []
+        if len(offsets):
+            indices.extend(max(int(np.searchsorted(offsets, stop, side='right')) - 1, 0)
+                           for stop in stops if stop <= offsets[-1])
+        self.speeds = speed_profile(offsets, route.locations[first:], speed_limit, start_speed, indices,
+                                    **self.limits)
+        self.offsets = offsets.copy()
+        self._route, self._first, self._size, self._limit, self._stops = route, first, size, speed_limit, stops
+        return True
+
+    def at(self, index, distance=None):
+        """
+        Target speed at a waypoint of the route, in km/h. With the distance
+        along the route of a point before it, such as the vehicle, the
+        target speed at that point instead, interpolated from the waypoint
+        and the one before it.
+        """
+        if not len(self.speeds):
+            return float('inf')
+        i = min(max(index - self._first, 0), len(self.speeds) - 1)
+        if distance is None or i == 0:
+            return float(self.speeds[i])
+        begin, end = self.offsets[i-1], self.offsets[i]
+        t = min(max((distance - begin) / (end - begin), 0.0), 1.0) if end > begin else 1.0
+        before, after = self.speeds[i-1] ** 2, self.speeds[i] ** 2
+        return math.sqrt(before + t * (after - before))
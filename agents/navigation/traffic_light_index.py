@@ -0,0 +1,81 @@
+"""
+This module provides TrafficLightIndex, the traffic lights along a route
+found once when the route is set
+"""
+
+import bisect
+
+# OpenDRIVE type of the traffic light signals
+TRAFFIC_LIGHT_TYPE = '1000001'
+
+
+class TrafficLightIndex(object):
+    """
+    Traffic lights that control a route, ordered by their distance along
+    it (as measured by RouteCursor). The landmarks are looked up once, from
+    every waypoint of the route up to the next one, and their actors are
+    resolved at the same time, so while driving only the state of the next
+    light is read. For a route loaded lazily, update() indexes the part
+    loaded since the last call.
+    """
+
+    def __init__(self, world, route, landmark_type=TRAFFIC_LIGHT_TYPE):
+        """
+        Constructor method.
+
+            :param world: carla.World the route belongs to
+            :param route: RouteCursor of the route
+            :param landmark_type: OpenDRIVE type of the landmarks indexed
+        """
+        self.offsets = []
+        self.landmarks = []
+        self.traffic_lights = []
+        self._world = world
+        self._landmark_type = landmark_type
+        self._next = 0
+        self._indexed = 0   # Number of route segments indexed
+        self._found = dict()    # Map with structure {landmark_id: offset of its last sighting, ... }
+        self.update(route)
+
+    def update(self, route):
+        """
+        Indexes the segments of the route loaded since the last call.
+
+            :param route: RouteCursor the index was built for
+        """
+        waypoints = route.waypoints
+        if len(waypoints) - 1 <= self._indexed:
+            return
+        offsets, found = route.offsets, self._found
+        for i in range(self._indexed, len(waypoints) - 1):
+            step = float(offsets[i+1] - offsets[i])
+            for landmark in waypoints[i].get_landmarks_of_type(step, self._landmark_type, False):
+                offset = float(offsets[i]) + landmark.distance
+                # Consecutive waypoints see a landmark at their common end twice
+                if landmark.id in found and offset - found[landmark.id] <= step:
+                    continue
+                found[landmark.id] = offset
+                traffic_light = self._world.get_traffic_light(landmark)
+                if traffic_light is not None:
+                    self.offsets.append(offset)
+                    self.landmarks.append(landmark)
+                    self.traffic_lights.append(traffic_light)
+        self._indexed = len(waypoints) - 1
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def next_within(self, distance, reach):
+        """
+        First traffic light ahead of a point of the route, if it is close.
+        Points must be given in increasing order of distance.
+
+            :param distance: distance of the point along the route, in metres
+            :param reach: largest distance from the point to the light, in metres
+            :return: (carla.TrafficLight, distance from the point to it), or (None, None)
+        """
+        if self._next < len(self.offsets) and self.offsets[self._next] < distance:
+            self._next = bisect.bisect_left(self.offsets, distance, self._next)
+        if self._next < len(self.offsets) and self.offsets[self._next] - distance <= reach:
+            return self.traffic_lights[self._next], self.offsets[self._next] - distance
+        return None, None
@@ -3,6 +3,7 @@ import glob
 import os
 import sys
 import math
+import time
 
 try:
     sys.path.append(glob.glob('../carla/dist/carla-*%d.%d-%s.egg' % (
@@ -22,17 +23,34 @@ except IndexError:
 from agents.navigation import pid_controller as pid
 from agents.navigation.global_route_planner import GlobalRoutePlanner
 from agents.navigation.global_route_planner_dao import GlobalRoutePlannerDAO
+from agents.navigation.route_cursor import RouteCursor
+from agents.navigation.speed_profile import SpeedProfile
+from agents.navigation.traffic_light_index import TrafficLightIndex
+from agents.navigation.vehicle_state import VehicleState
+from agents.tools.instrumentation import NULL_PROFILER
+from agents.tools.route_visualizer import RouteVisualizer
+from agents.tools.sensor_buffer import SensorBuffer
 
 """
 Esse arquivo implementa um Agente, que é o responsável por dirigir o veículo 
 e por tomar as decisões de controle por meio da análise do ambiente ao seu redor 
 """
 
+# Diretório sugerido para o cache em disco do grafo do GlobalRoutePlanner. O cache
+# só é usado se passado em graph_cache_dir: os arquivos são pickles, que executam
+# código ao serem carregados, então deve ser um diretório que só o usuário escreve
+GRAPH_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'unb_agent')
+
 
 class Agent():
 
-    def __init__(self, vehicle, ignore_traffic_light=False):
+    def __init__(self, vehicle, ignore_traffic_light=False, graph_cache_dir=None, grp=None,
+                 visualize=True, profiler=None, obstacle_sensor_tick=0.1, route_lookahead=100,
+                 speed_profile=True):
         self.vehicle = vehicle
+        # StageProfiler que mede o tempo (e as chamadas ao servidor) de cada etapa
+        # do tick; sem ele (None) as etapas não são medidas
+        self.profiler = profiler if profiler is not None else NULL_PROFILER
         self.ignore_traffic_light = ignore_traffic_light
         self.world = vehicle.get_world()
         self.map = self.world.get_map()
@@ -40,18 +58,48 @@ class Agent():
                                                         args_lateral={
                                                             'K_P': 0.58, 'K_D': 0.4, 'K_I': 0.5},
                                                         args_longitudinal={
-                                                            'K_P': 0.15, 'K_D': 0.05, 'K_I': 0.07}
+                                                            'K_P': 0.15, 'K_D': 0.05, 'K_I': 0.07},
+                                                        profiler=profiler
                                                         )
         # Relacionados à rota
         self.spawn_location = None
         self.destination_location = None
-        self.dao = GlobalRoutePlannerDAO(self.map, 2.0)
-        self.grp = GlobalRoutePlanner(self.dao)
-        self.grp.setup()
-        self.route = []
+        if grp is None:
+            self.dao = GlobalRoutePlannerDAO(self.map, 2.0)
+            # Com graph_cache_dir=None (padrão) o grafo é sempre reconstruído a partir
+            # do servidor e nada é escrito em disco
+            self.grp = GlobalRoutePlanner(self.dao, cache_dir=graph_cache_dir, profiler=profiler)
+            self.grp.setup()
+        else:
+            # Planejador já configurado e compartilhado entre vários agentes (inclusive
+            # em threads diferentes), de modo que o grafo é construído e mantido em
+            # memória uma única vez
+            self.dao = None
+            self.grp = grp
+        # Rota como polilinha com um cursor de progresso (índice do waypoint alvo).
+        # Os waypoints são criados sob demanda, mantendo route_lookahead deles
+        # carregados à frente do alvo; com None a rota inteira é traçada de uma vez
+        self.route_lookahead = route_lookahead
+        self.route = RouteCursor()
+        # Perfil de velocidade ao longo da rota (curvatura e limites de aceleração
+        # e de jerk), calculado ao definir a rota e consultado no cursor a cada
+        # tick; com speed_profile=False a velocidade alvo é sempre a pedida
+        self.speed_profile = SpeedProfile() if speed_profile else None
+        # Semáforos ao longo da rota, encontrados uma única vez ao definir a rota
+        self.traffic_lights = TrafficLightIndex(self.world, self.route)
+        # Latência (em segundos) de cada replanejamento feito para desviar de obstáculos
+        self.replan_latencies = []
+        # Estado do veículo no tick atual, lido uma única vez por update_state
+        self.state = None
+        # Visualização da rota; com visualize=False (modo de desempenho, sem
+        # interface) nada é desenhado
+        self.route_visualizer = RouteVisualizer(self.world.debug, enabled=visualize)
 
         # Relacionados aos obstáculos e sensores
         self.obstacle_info = {'distance': None, 'actor': None}
+        # Última leitura de cada sensor, escrita pelas callbacks na thread do
+        # sensor e lida sem travas pelo run_step
+        self.sensors = SensorBuffer()
         self.emergency_brake_distance = 3
         self.dynamic_brake_distance = 0
         self.previous_obstacle = None
@@ -73,29 +121,108 @@ class Agent():
             'sensor.other.obstacle')
         self.obstacle_sensor_bp.set_attribute('distance', '30.0')
         self.obstacle_sensor_bp.set_attribute('only_dynamics', 'True')
-        self.obstacle_sensor_bp.set_attribute('sensor_tick', '0.1')
+        self.obstacle_sensor_bp.set_attribute('sensor_tick', str(obstacle_sensor_tick))
         self.obstacle_sensor_bp.set_attribute('hit_radius', '1.0')
         # Posicionado na frente do radiador do veículo
         self.obstacle_sensor_transform = carla.Transform(
             carla.Location(x=1.5, z=0.5), carla.Rotation())
         self.obstacle_sensor = self.world.spawn_actor(
             self.obstacle_sensor_bp, self.obstacle_sensor_transform, attach_to=vehicle)
-        self.obstacle_sensor.listen(
-            lambda data: self.obstacle_detection(data))
+        # O sensor só envia dados enquanto detecta algo: uma leitura não renovada
+        # em pouco mais de um período do sensor indica que o obstáculo sumiu
+        self.obstacle_slot = self.sensors.listen(
+            self.obstacle_sensor, 'obstacle', extract=lambda data: (data.distance, data.other_actor),
+            max_age=obstacle_sensor_tick + 2*(self.world.get_settings().fixed_delta_seconds or 0.05))
 
     def get_speed(self, vehicle):
         velocity = vehicle.get_velocity()
         return 3.6*math.sqrt(velocity.x**2 + velocity.y**2 + velocity.z**2)
 
-    def obstacle_detection(self, data):
-        self.obstacle_info = {
-            'distance': data.distance, 'actor': data.other_actor}
+    def update_state(self, snapshot=None):
+        # Lê o estado do veículo de um único snapshot do mundo; o restante do
+        # tick (agente e controladores) usa só esse estado
+        with self.profiler.stage('agent.update_state'):
+            if snapshot is None:
+                snapshot = self.world.get_snapshot()
+            self.state = VehicleState.capture(self.vehicle, snapshot)
+        return self.state
+
+    def update_obstacle(self, timestamp=None):
+        # Obstáculo da leitura mais recente do sensor, se não estiver velha
+        reading = self.obstacle_slot.read(timestamp)
+        if reading is None:
+            self.obstacle_info = {'distance': None, 'actor': None}
+        else:
+            self.obstacle_info = {'distance': reading.value[0], 'actor': reading.value[1]}
+        return self.obstacle_info
 
     def set_route(self, spawn_location, destination_location):
         self.spawn_location = spawn_location
         self.destination_location = destination_location
-        self.route = [wp[0] for wp in self.grp.trace_route(
-            self.spawn_location, self.destination_location)]
+        if self.route_lookahead is None:
+            self.route = RouteCursor(self.grp.trace_route(self.spawn_location, self.destination_location))
+        else:
+            self.route = RouteCursor(self.grp.iter_route(self.spawn_location, self.destination_location),
+                                     lookahead=self.route_lookahead)
+        with self.profiler.stage('agent.traffic_light_index'):
+            self.traffic_lights = TrafficLightIndex(self.world, self.route)
+        self.update_speed_profile()
+
+    def update_speed_profile(self, speed_limit=None):
+        # Recalcula o perfil de velocidade se a rota mudou, se mais dela foi
+        # carregada, se o limite de velocidade mudou ou se um semáforo à frente
+        # mudou de estado
+        if self.speed_profile is None:
+            return
+        if speed_limit is None:
+            speed_limit = self.state.speed_limit if self.state is not None else float('inf')
+        current_speed = self.state.speed if self.state is not None else 0.0
+        with self.profiler.stage('agent.speed_profile'):
+            self.speed_profile.update(self.route, current_speed, speed_limit,
+                                      self.stop_lines(speed_limit, current_speed))
+
+    def stop_lines(self, speed_limit, current_speed):
+        # Distância ao longo da rota da linha de parada do próximo semáforo, se
+        # estiver vermelho ou amarelo e perto o bastante para o perfil frear até
+        # ele vindo do limite de velocidade; no amarelo, só se ainda der para
+        # parar na velocidade atual sem passar da desaceleração máxima
+        if self.ignore_traffic_light:
+            return ()
+        reach = self.speed_profile.stopping_distance(speed_limit)
+        traffic_light, distance = self.traffic_lights.next_within(self.route.distance, reach)
+        if traffic_light is None:
+            return ()
+        state = traffic_light.state
+        if (state == carla.TrafficLightState.Red
+                or state == carla.TrafficLightState.Yellow
+                and distance >= self.speed_profile.stopping_distance(current_speed, rounded=False)):
+            return (self.route.distance + distance,)
+        return ()
+
+    def target_speed(self, speed):
+        # Velocidade alvo no ponto da rota em que o veículo está, limitada pela
+        # velocidade pedida
+        if self.speed_profile is None:
+            return speed
+        return min(speed, self.speed_profile.at(self.route.index, self.route.distance))
+
+    def change_lane(self, lane_location):
+        # Replaneja só o trecho da nova faixa até ela reencontrar a rota atual,
+        # reaproveitando o restante da rota, que continua sendo lido sob demanda
+        start = time.perf_counter()
+        with self.profiler.stage('agent.replan'):
+            self.spawn_location = lane_location
+            if self.route_lookahead is None:
+                self.route = RouteCursor(self.grp.replan_lane_change(
+                    self.route.remaining_trace(), lane_location, self.destination_location))
+            else:
+                self.route = RouteCursor(self.grp.iter_replan_lane_change(
+                    self.route.remaining_trace(), lane_location, self.destination_location),
+                    lookahead=self.route_lookahead)
+            with self.profiler.stage('agent.traffic_light_index'):
+                self.traffic_lights = TrafficLightIndex(self.world, self.route)
+            self.update_speed_profile()
+        self.replan_latencies.append(time.perf_counter() - start)
 
     def emergency_stop(self):
         control = carla.VehicleControl()
@@ -105,51 +232,70 @@ class Agent():
         control.hand_brake = False
         return control
 
-    def show_path(self, distance=15):
-        route_lenght = len(self.route)
-        for i in range(distance):
-            if i < route_lenght:
-                self.world.debug.draw_string(self.route[i].transform.location, 'o',
-                                             draw_shadow=False, color=carla.Color(r=0, g=255, b=0),
-                                             life_time=1, persistent_lines=True)
+    def show_path(self, distance=15, elapsed_seconds=None, section=None):
+        # Desenha como linhas só os trechos dos próximos waypoints que ainda não
+        # estão na tela, no máximo algumas vezes por segundo de simulação. Fora
+        # do tick (em outra thread) deve receber em section a cópia dos próximos
+        # waypoints tirada no tick com self.route.section(distance), pois a rota
+        # muda a cada run_step
+        if not self.route_visualizer.enabled:
+            return
+        with self.profiler.stage('agent.show_path'):
+            if section is None:
+                section = self.route.section(distance)
+            if elapsed_seconds is None:
+                elapsed_seconds = self.world.get_snapshot().timestamp.elapsed_seconds
+            self.route_visualizer.draw(section, elapsed_seconds)
 
-    def traffic_light_manager(self, waypoint):
+    def traffic_light_manager(self):
         """
-
+        Confere o próximo semáforo da rota, se estiver dentro da distância de
+        frenagem: só o estado dele é lido a cada tick
         """
-        actual_landmarks = waypoint.get_landmarks_of_type(
-            self.dynamic_brake_distance, "1000001", False)
-
-        if actual_landmarks:
-            next_traffic_light = self.world.get_traffic_light(
-                actual_landmarks[0])
-            if (str(next_traffic_light.get_state()) == "Red"
-            or str(next_traffic_light.get_state()) == "Yellow"
-            and actual_landmarks[0].distance < self.dynamic_brake_distance
+        next_traffic_light, distance = self.traffic_lights.next_within(
+            self.route.distance, self.dynamic_brake_distance)
+
+        if next_traffic_light is not None:
+            traffic_light_state = next_traffic_light.state
+            if (traffic_light_state == carla.TrafficLightState.Red
+            or traffic_light_state == carla.TrafficLightState.Yellow
+            and distance < self.dynamic_brake_distance
             and self.ignore_traffic_light == False):
                 return True
         return False
 
-    def equal_location(self, vehicle, waypoint):
-        if((abs(vehicle.get_location().x - waypoint.transform.location.x) <= 4
-                and abs(vehicle.get_location().y - waypoint.transform.location.y) <= 4)):
-            return True
-        return False
-
     def arrived(self):
-        return len(self.route) <= 1
+        return self.route.arrived()
+
+    def run_step(self, speed=30, state=None):
+        with self.profiler.stage('agent.run_step'):
+            return self._run_step(speed, state)
+
+    def _run_step(self, speed, state):
+        profiler = self.profiler
+
+        # Usa o estado já lido neste tick (update_state) ou, sem ele, lê agora
+        if state is None:
+            state = self.update_state()
+        self.state = state
 
-    def run_step(self, speed=30):
+        # Atualiza o índice da rota projetando o veículo sobre os próximos trechos
+        # dela, de modo que um waypoint perdido não trava o progresso
+        with profiler.stage('agent.route_advance'):
+            self.route.advance(state.location)
+            # Semáforos do trecho da rota carregado neste tick, se houver
+            self.traffic_lights.update(self.route)
+        self.update_speed_profile(speed)
 
-        # Confere se o veículo está percorrendo a rota e atualiza o índice da rota
-        if self.equal_location(self.vehicle, self.route[0]):
-            self.route.pop(0)
+        current_speed = state.speed
+        # Velocidade alvo do perfil no ponto atual da rota
+        speed = self.target_speed(speed)
+        self.update_obstacle(state.timestamp)
 
-        ego_vehicle_wp = self.map.get_waypoint(self.vehicle.get_location())
-        current_speed = self.get_speed(self.vehicle)
-        
         # Se o semáforo estiver vermelho ou amarelo, pare
-        if self.traffic_light_manager(ego_vehicle_wp):
+        with profiler.stage('agent.traffic_light'):
+            red_light = self.traffic_light_manager()
+        if red_light:
             if self.status != 'semáforo':
                 self.status = 'semáforo'
                 print(self.status)
@@ -161,7 +307,7 @@ class Agent():
                 self.status = 'normal'
                 print(self.status)
             self.dynamic_brake_distance = (current_speed/7)**2 / 2
-            return self.control_vehicle.run_step(speed, self.route[0])
+            return self.control_vehicle.run_step(speed, self.route.target, state)
         else:
             # Obstáculo na iminência de colisão
             if self.obstacle_info['distance'] <= self.emergency_brake_distance:
@@ -177,21 +323,20 @@ class Agent():
                     self.status = 'desvia'
                     print(self.status, end=' ')
 
-                vehicle_waypoint = self.map.get_waypoint(
-                    self.vehicle.get_location())
+                with profiler.stage('agent.get_waypoint'):
+                    vehicle_waypoint = self.map.get_waypoint(state.location)
                     # Confere se existe alguma faixa na rua em que se está para mudar na
                     # tentativa de não colidir com o osbtáculo. Se sim, gera uma rota até
-                    # o destino a partir da outra faixa escolhida (se houver)
+                    # o destino a partir da outra faixa escolhida (se houver), reaproveitando
+                    # a rota atual a partir de onde a nova faixa a reencontra
                 if vehicle_waypoint.get_left_lane() and (int(vehicle_waypoint.lane_id) * int(vehicle_waypoint.get_left_lane().lane_id) > 0):
                     print('pra esquerda')
-                    self.set_route(vehicle_waypoint.get_left_lane(
-                    ).transform.location, self.destination_location)
+                    self.change_lane(vehicle_waypoint.get_left_lane().transform.location)
                 elif vehicle_waypoint.get_right_lane() and (int(vehicle_waypoint.lane_id) * int(vehicle_waypoint.get_right_lane().lane_id) > 0):
                     print('pra direita')
-                    self.set_route(vehicle_waypoint.get_right_lane(
-                    ).transform.location, self.destination_location)
+                    self.change_lane(vehicle_waypoint.get_right_lane().transform.location)
 
-                return self.control_vehicle.run_step(speed, self.route[0])
+                return self.control_vehicle.run_step(speed, self.route.target, state)
 
             else:
-                return self.control_vehicle.run_step(speed, self.route[0])
+                return self.control_vehicle.run_step(speed, self.route.target, state)
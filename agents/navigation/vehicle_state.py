@@ -0,0 +1,43 @@
+"""
+This module provides VehicleState, the state of a vehicle read once per
+simulation tick and shared by the agent and its controllers
+"""
+
+import math
+from collections import namedtuple
+
+
+class VehicleState(namedtuple('VehicleState', ['frame', 'transform', 'velocity', 'speed', 'speed_limit',
+                                               'timestamp'], defaults=(None,))):
+    """
+    State of a vehicle at one simulation frame.
+
+        frame       -   frame of the world snapshot it was read from
+        transform   -   carla.Transform of the vehicle
+        velocity    -   carla.Vector3D, in m/s
+        speed       -   norm of velocity, in km/h
+        speed_limit -   speed limit the vehicle is subject to, in km/h
+        timestamp   -   simulation time of the snapshot, in seconds (None if unknown)
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def capture(cls, vehicle, snapshot):
+        """
+        Reads the state of a vehicle from a world snapshot; only the speed
+        limit, which snapshots do not carry, is asked to the vehicle.
+
+            :param vehicle: carla.Vehicle
+            :param snapshot: carla.WorldSnapshot, from world.get_snapshot()
+        """
+        actor = snapshot.find(vehicle.id)
+        velocity = actor.get_velocity()
+        speed = 3.6 * math.sqrt(velocity.x**2 + velocity.y**2 + velocity.z**2)
+        return cls(snapshot.frame, actor.get_transform(), velocity, speed, vehicle.get_speed_limit(),
+                   snapshot.timestamp.elapsed_seconds)
+
+    @property
+    def location(self):
+        """ carla.Location of the vehicle """
+        return self.transform.location
@@ -0,0 +1,44 @@
+"""
+Offline stand-in for the ``carla`` Python API.
+
+It implements the part of the API used by the agents in this repository
+over an in-memory lane network, so the planner, the controllers and the
+agent can run (and be benchmarked) without a simulator:
+
+    from agents.tools import fake_carla
+    fake_carla.install()            # must run before anything imports carla
+    import carla                    # now the stand-in
+    client = carla.Client('localhost', 2000, wmap=fake_carla.grid_map(4, 4))
+
+Maps come from the synthetic factories ``grid_map`` / ``ring_map`` or from
+a local OpenDRIVE file through ``load_opendrive``.
+"""
+
+import sys
+
+from agents.tools.fake_carla import command
+from agents.tools.fake_carla import stats
+from agents.tools.fake_carla.geometry import Color, Location, Rotation, Transform, Vector3D
+from agents.tools.fake_carla.maps import grid_map, ring_map
+from agents.tools.fake_carla.opendrive import load_opendrive, parse_opendrive
+from agents.tools.fake_carla.road import (Landmark, LaneChange, LaneMarking, LaneMarkingColor,
+                                          LaneMarkingType, LaneType, Map, MapBuilder, Waypoint)
+from agents.tools.fake_carla.world import (Actor, ActorBlueprint, ActorSnapshot, BlueprintLibrary, Client,
+                                           DebugHelper, ObstacleDetectionEvent, Sensor, SensorData,
+                                           Timestamp, TrafficLight, TrafficLightState, Vehicle,
+                                           VehicleControl, World, WorldSettings, WorldSnapshot)
+
+
+def install():
+    """
+    Registers this package as ``carla`` (and ``carla.command``) in
+    sys.modules, unless the real carla module was already imported.
+    Returns the module that ``import carla`` will yield.
+    """
+    module = sys.modules[__name__]
+    current = sys.modules.get('carla')
+    if current is not None and current is not module:
+        return current
+    sys.modules['carla'] = module
+    sys.modules['carla.command'] = command
+    return module
@@ -0,0 +1,44 @@
+"""
+Runs a script against the offline carla stand-in, for instance a benchmark:
+
+    python -m agents.tools.fake_carla --grid 6x6 benchmarks/trace_route_timing.py -n 50
+    python -m agents.tools.fake_carla --xodr Town01.xodr examples/motion_planning.py
+
+Every carla.Client the script creates gets the map chosen here.
+"""
+
+import argparse
+import runpy
+import sys
+
+from agents.tools import fake_carla
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument('--grid', default='4x4', help='rows x columns of a grid map (default: 4x4)')
+    argparser.add_argument('--block', default=80.0, type=float, help='distance between grid junctions, in metres')
+    argparser.add_argument('--lanes', default=2, type=int, help='lanes per direction')
+    argparser.add_argument('--sections', default=1, type=int, help='lane sections per grid road')
+    argparser.add_argument('--ring', default=None, type=float, help='radius of a ring map, instead of a grid')
+    argparser.add_argument('--xodr', default=None, help='OpenDRIVE file to load, instead of a grid')
+    argparser.add_argument('script', help='Python script to run')
+    argparser.add_argument('arguments', nargs=argparse.REMAINDER, help='arguments of the script')
+    args = argparser.parse_args()
+
+    carla = fake_carla.install()
+    if args.xodr:
+        wmap = fake_carla.load_opendrive(args.xodr)
+    elif args.ring:
+        wmap = fake_carla.ring_map(args.ring, lanes=args.lanes)
+    else:
+        rows, cols = (int(value) for value in args.grid.lower().split('x'))
+        wmap = fake_carla.grid_map(rows, cols, block=args.block, lanes=args.lanes, sections=args.sections)
+    carla.Client.default_map = wmap
+
+    sys.argv = [args.script] + args.arguments
+    runpy.run_path(args.script, run_name='__main__')
+
+
+if __name__ == '__main__':
+    main()
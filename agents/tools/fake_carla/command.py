@@ -0,0 +1,55 @@
+""" Mirrors carla.command for the offline stand-in. """
+
+
+def _actor_id(actor):
+    return actor if isinstance(actor, int) else actor.id
+
+
+class Response(object):
+    """ Mirrors carla.command.Response. """
+
+    def __init__(self, actor_id, error=''):
+        self.actor_id = actor_id
+        self.error = error
+
+    def has_error(self):
+        return bool(self.error)
+
+
+class DestroyActor(object):
+
+    def __init__(self, actor):
+        self.actor_id = _actor_id(actor)
+
+    def execute(self, world):
+        actor = world.get_actor(self.actor_id)
+        if actor is not None:
+            world._actors.pop(actor.id, None)
+            actor.is_alive = False
+        return self.actor_id
+
+
+class ApplyVehicleControl(object):
+
+    def __init__(self, actor, control):
+        self.actor_id = _actor_id(actor)
+        self.control = control
+
+    def execute(self, world):
+        actor = world.get_actor(self.actor_id)
+        if actor is not None:
+            actor._control = self.control
+        return self.actor_id
+
+
+class ApplyTransform(object):
+
+    def __init__(self, actor, transform):
+        self.actor_id = _actor_id(actor)
+        self.transform = transform
+
+    def execute(self, world):
+        actor = world.get_actor(self.actor_id)
+        if actor is not None:
+            actor._transform = self.transform
+        return self.actor_id
@@ -0,0 +1,97 @@
+""" Geometry primitives of the offline carla stand-in. """
+
+import math
+
+
+class Vector3D(object):
+    """ Mirrors carla.Vector3D. """
+
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        self.x = float(x)
+        self.y = float(y)
+        self.z = float(z)
+
+    def __add__(self, other):
+        return type(self)(self.x + other.x, self.y + other.y, self.z + other.z)
+
+    def __sub__(self, other):
+        return type(self)(self.x - other.x, self.y - other.y, self.z - other.z)
+
+    def __mul__(self, scalar):
+        return type(self)(self.x * scalar, self.y * scalar, self.z * scalar)
+
+    __rmul__ = __mul__
+
+    def __eq__(self, other):
+        return (isinstance(other, Vector3D) and self.x == other.x
+                and self.y == other.y and self.z == other.z)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def length(self):
+        return math.sqrt(self.x ** 2 + self.y ** 2 + self.z ** 2)
+
+    def __repr__(self):
+        return '%s(x=%.6f, y=%.6f, z=%.6f)' % (type(self).__name__, self.x, self.y, self.z)
+
+
+class Location(Vector3D):
+    """ Mirrors carla.Location. """
+
+    def distance(self, other):
+        return math.sqrt((self.x - other.x) ** 2 + (self.y - other.y) ** 2 + (self.z - other.z) ** 2)
+
+
+class Rotation(object):
+    """ Mirrors carla.Rotation, angles in degrees. """
+
+    def __init__(self, pitch=0.0, yaw=0.0, roll=0.0):
+        self.pitch = float(pitch)
+        self.yaw = float(yaw)
+        self.roll = float(roll)
+
+    def get_forward_vector(self):
+        cy, sy = math.cos(math.radians(self.yaw)), math.sin(math.radians(self.yaw))
+        cp, sp = math.cos(math.radians(self.pitch)), math.sin(math.radians(self.pitch))
+        return Vector3D(cp * cy, cp * sy, sp)
+
+    def get_right_vector(self):
+        cy, sy = math.cos(math.radians(self.yaw)), math.sin(math.radians(self.yaw))
+        return Vector3D(-sy, cy, 0.0)
+
+    def __repr__(self):
+        return 'Rotation(pitch=%.6f, yaw=%.6f, roll=%.6f)' % (self.pitch, self.yaw, self.roll)
+
+
+class Transform(object):
+    """ Mirrors carla.Transform. """
+
+    def __init__(self, location=None, rotation=None):
+        self.location = location if location is not None else Location()
+        self.rotation = rotation if rotation is not None else Rotation()
+
+    def get_forward_vector(self):
+        return self.rotation.get_forward_vector()
+
+    def get_right_vector(self):
+        return self.rotation.get_right_vector()
+
+    def transform(self, point):
+        """ Moves a point from the local frame of this transform to the world frame. """
+        cy, sy = math.cos(math.radians(self.rotation.yaw)), math.sin(math.radians(self.rotation.yaw))
+        return Location(self.location.x + point.x * cy - point.y * sy,
+                        self.location.y + point.x * sy + point.y * cy,
+                        self.location.z + point.z)
+
+    def __repr__(self):
+        return 'Transform(%r, %r)' % (self.location, self.rotation)
+
+
+class Color(object):
+    """ Mirrors carla.Color. """
+
+    def __init__(self, r=0, g=0, b=0, a=255):
+        self.r, self.g, self.b, self.a = r, g, b, a
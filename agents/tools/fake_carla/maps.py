@@ -0,0 +1,109 @@
+""" Synthetic map factories for the offline carla stand-in. """
+
+import math
+
+import numpy as np
+
+from agents.tools.fake_carla.road import MapBuilder
+
+
+def _turn(heading_in, heading_out):
+    """ Classifies a junction movement as 'straight', 'left' or 'right'. """
+    dot = heading_in[0] * heading_out[0] + heading_in[1] * heading_out[1]
+    cross = heading_in[0] * heading_out[1] - heading_in[1] * heading_out[0]
+    if dot > 0.7:
+        return 'straight'
+    # carla is left-handed, a positive cross product is a right turn
+    return 'right' if cross > 0 else 'left'
+
+
+def _heading(points, at_end):
+    step = points[-1] - points[-2] if at_end else points[1] - points[0]
+    return step[:2] / max(np.linalg.norm(step[:2]), 1e-12)
+
+
+def grid_map(rows=3, cols=3, block=80.0, lanes=2, sections=1, lane_width=3.5,
+             speed_limit=30.0, traffic_lights=True, name=None):
+    """
+    Builds a Manhattan grid of rows x cols junctions ``block`` metres apart,
+    joined by two-way roads with ``lanes`` lanes per direction. Every
+    junction with three or more arms gets one traffic light per approach.
+    """
+    name = name or 'Grid_%dx%d_%dlanes' % (rows, cols, lanes)
+    description = ('<OpenDRIVE><header name="%s"/><grid rows="%d" cols="%d" block="%r" lanes="%d" '
+                   'sections="%d" width="%r" speed="%r" lights="%d"/></OpenDRIVE>' % (
+                       name, rows, cols, block, lanes, sections, lane_width, speed_limit, traffic_lights))
+    builder = MapBuilder(name, description)
+    margin = lanes * lane_width + 4.0
+    arms = {(i, j): [] for i in range(cols) for j in range(rows)}
+    road_id = 0
+
+    def add(start, end, direction):
+        nonlocal road_id
+        x0, y0 = start[0] * block, start[1] * block
+        reference = [[x0 + direction[0] * margin, y0 + direction[1] * margin, 0.0],
+                     [x0 + direction[0] * (block - margin), y0 + direction[1] * (block - margin), 0.0]]
+        road = builder.add_road(road_id, reference, lanes, lanes, lane_width, sections, speed_limit)
+        road_id += 1
+        first, last = road[0], road[-1]
+        forward = [last[-k] for k in range(1, lanes + 1)]
+        backward = [first[k] for k in range(1, lanes + 1)]
+        # incoming lanes at a junction and the outgoing lanes of the same arm
+        arms[end].append((forward, [last[k] for k in range(1, lanes + 1)]))
+        arms[start].append((backward, [first[-k] for k in range(1, lanes + 1)]))
+
+    for j in range(rows):
+        for i in range(cols - 1):
+            add((i, j), (i + 1, j), (1, 0))
+    for i in range(cols):
+        for j in range(rows - 1):
+            add((i, j), (i, j + 1), (0, 1))
+
+    for junction_id, node in enumerate(sorted(arms)):
+        node_arms = arms[node]
+        for a, (incoming, _) in enumerate(node_arms):
+            heading_in = _heading(incoming[0].points, True)
+            for b, (_, outgoing) in enumerate(node_arms):
+                if a == b:
+                    continue
+                turn = _turn(heading_in, _heading(outgoing[0].points, False))
+                if len(node_arms) <= 2 or turn == 'straight':
+                    pairs = list(zip(incoming, outgoing))
+                elif turn == 'left':
+                    pairs = [(incoming[0], outgoing[0])]
+                else:
+                    pairs = [(incoming[-1], outgoing[-1])]
+                for lane_from, lane_to in pairs:
+                    builder.add_connector(road_id, lane_from, lane_to, junction_id, speed_limit)
+                    road_id += 1
+        if traffic_lights and len(node_arms) >= 3:
+            for incoming, _ in node_arms:
+                heading = _heading(incoming[0].points, True)
+                phase = 0 if abs(heading[0]) > abs(heading[1]) else 1
+                builder.add_landmark(incoming, junction_id=junction_id, phase=phase)
+    return builder.build()
+
+
+def ring_map(radius=100.0, segments=8, lanes=2, lane_width=3.5, speed_limit=50.0, name=None):
+    """
+    Builds a closed ring road split into ``segments`` roads without
+    junctions, ``lanes`` lanes per direction.
+    """
+    name = name or 'Ring_%d_%dlanes' % (int(radius), lanes)
+    description = ('<OpenDRIVE><header name="%s"/><ring radius="%r" segments="%d" lanes="%d" '
+                   'width="%r" speed="%r"/></OpenDRIVE>' % (
+                       name, radius, segments, lanes, lane_width, speed_limit))
+    builder = MapBuilder(name, description)
+    roads = []
+    span = 2.0 * math.pi / segments
+    for k in range(segments):
+        steps = max(2, int(radius * span))
+        angles = np.linspace(k * span, (k + 1) * span, steps + 1)
+        reference = np.stack([radius * np.cos(angles), radius * np.sin(angles), np.zeros_like(angles)], axis=1)
+        roads.append(builder.add_road(k, reference, lanes, lanes, lane_width, 1, speed_limit)[0])
+    for k in range(segments):
+        current, following = roads[k], roads[(k + 1) % segments]
+        for lane in range(1, lanes + 1):
+            builder.connect(current[-lane], following[-lane])
+            builder.connect(following[lane], current[lane])
+    return builder.build()
@@ -0,0 +1,291 @@
+"""
+OpenDRIVE loader for the offline carla stand-in.
+
+It reads the part of the format that the lane graph needs: the plan view
+(lines, arcs, spirals, poly3 and paramPoly3), elevation, lane offsets,
+lane sections with their widths and speeds, road and lane links and the
+signals. Lane centre lines are sampled every ``sampling`` metres and, as
+in CARLA, the y axis is flipped to the left-handed frame of the
+simulator. Only driving lanes are kept.
+"""
+
+import math
+import os
+import xml.etree.ElementTree as ElementTree
+
+import numpy as np
+
+from agents.tools.fake_carla.road import MapBuilder
+
+_SPEED_UNITS = {'km/h': 1.0, 'kmh': 1.0, 'm/s': 3.6, 'mph': 1.609344}
+
+
+def load_opendrive(path, name=None, sampling=1.0, speed_limit=30.0):
+    """
+    Builds a Map from a local .xodr file.
+
+        :param path: path of the OpenDRIVE file
+        :param name: map name, the file name without extension by default
+        :param sampling: distance between the points of the lane centre lines, in metres
+        :param speed_limit: speed limit of the lanes that do not give one, in km/h
+    """
+    with open(path) as xodr:
+        content = xodr.read()
+    return parse_opendrive(content, name or os.path.splitext(os.path.basename(path))[0], sampling, speed_limit)
+
+
+def parse_opendrive(content, name='OpenDRIVE', sampling=1.0, speed_limit=30.0):
+    """
+    Builds a Map from the text of an OpenDRIVE file, as carla.Map(name, content) does.
+    """
+    root = ElementTree.fromstring(content)
+    builder = MapBuilder(name, content)
+    roads = {}
+    for element in root.findall('road'):
+        road = _RoadGeometry(element, sampling, speed_limit)
+        if road.length <= 0.0:
+            continue
+        road.lanes = builder.add_sections(road.id, road.sections(), road.junction)
+        roads[road.id] = road
+
+    for road in roads.values():
+        _link_sections(builder, road)
+        for kind in ('predecessor', 'successor'):
+            link = road.links.get(kind)
+            if link is None or link[0] != 'road' or link[1] not in roads:
+                continue
+            _link_roads(builder, road, kind, roads[link[1]], link[2])
+
+    for road in roads.values():
+        for signal in road.element.findall('signals/signal'):
+            _add_signal(builder, road, signal)
+    return builder.build()
+
+
+def _number(element, attribute, default=0.0):
+    value = element.get(attribute) if element is not None else None
+    return float(value) if value not in (None, '') else default
+
+
+def _id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def _polynomial(records, s):
+    """ Value at s of the last (s0, a, b, c, d) record starting before s """
+    value = 0.0
+    for s0, a, b, c, d in records:
+        if s0 > s + 1e-9:
+            break
+        ds = s - s0
+        value = a + b*ds + c*ds**2 + d*ds**3
+    return value
+
+
+def _records(elements, start='s'):
+    return sorted((_number(e, start), _number(e, 'a'), _number(e, 'b'), _number(e, 'c'), _number(e, 'd'))
+                  for e in elements)
+
+
+class _RoadGeometry(object):
+    """ Reference line, lane sections and links of one OpenDRIVE road """
+
+    def __init__(self, element, sampling, speed_limit):
+        self.element = element
+        self.id = _id(element.get('id'))
+        self.length = _number(element, 'length')
+        self.junction = int(element.get('junction', '-1') or -1)
+        self.sampling = sampling
+        self.lanes = []
+
+        self.speed_limit = speed_limit
+        for road_type in element.findall('type'):
+            speed = road_type.find('speed')
+            if speed is not None and speed.get('max') not in (None, 'no limit', 'undefined'):
+                self.speed_limit = float(speed.get('max')) * _SPEED_UNITS.get(speed.get('unit', 'm/s'), 1.0)
+                break
+
+        self.links = dict()     # Map with structure {'successor': (element type, id, contact point), ... }
+        for kind in ('predecessor', 'successor'):
+            link = element.find('link/' + kind)
+            if link is not None:
+                self.links[kind] = (link.get('elementType', 'road'), _id(link.get('elementId')),
+                                    link.get('contactPoint', 'start'))
+
+        self.geometries = sorted(((_number(g, 's'), g) for g in element.findall('planView/geometry')),
+                                 key=lambda item: item[0])
+        self.elevation = _records(element.findall('elevationProfile/elevation'))
+        self.lane_offset = _records(element.findall('lanes/laneOffset'))
+
+    def reference(self, s):
+        """ (x, y, z, heading) of the reference line at road coordinate s, in OpenDRIVE axes """
+        s = min(max(s, 0.0), self.length)
+        start, geometry = self.geometries[0]
+        for candidate_start, candidate in self.geometries:
+            if candidate_start <= s + 1e-9:
+                start, geometry = candidate_start, candidate
+        x, y, heading = _geometry_pose(geometry, s - start)
+        return x, y, _polynomial(self.elevation, s), heading
+
+    def sections(self):
+        """ Sections in the format of MapBuilder.add_sections """
+        elements = sorted(((_number(e, 's'), e) for e in self.element.findall('lanes/laneSection')),
+                          key=lambda item: item[0])
+        self.section_lanes = []
+        result = []
+        for i, (s0, section) in enumerate(elements):
+            s1 = elements[i + 1][0] if i + 1 < len(elements) else self.length
+            if s1 - s0 <= 1e-6:
+                continue
+            count = max(1, int(math.ceil((s1 - s0) / self.sampling)))
+            samples = np.linspace(s0, s1, count + 1)
+            poses = [self.reference(s) for s in samples]
+            lanes = dict()
+            links = dict()
+            for side, sign in (('right', -1), ('left', 1)):
+                # Lanes sorted from the centre outwards
+                side_lanes = sorted(section.findall(side + '/lane'), key=lambda lane: abs(int(lane.get('id'))))
+                inner = np.array([_polynomial(self.lane_offset, s) for s in samples])
+                for lane in side_lanes:
+                    lane_id = int(lane.get('id'))
+                    widths = np.array([_polynomial(_records(lane.findall('width'), 'sOffset'), s - s0)
+                                       for s in samples])
+                    centre = inner + sign * widths / 2.0
+                    inner = inner + sign * widths
+                    if lane.get('type', 'driving') != 'driving':
+                        continue
+                    points = np.array([(x - t * math.sin(h), y + t * math.cos(h), z)
+                                       for (x, y, z, h), t in zip(poses, centre)])
+                    points[:, 1] *= -1.0
+                    if lane_id > 0:
+                        points = points[::-1]
+                    lanes[lane_id] = (points, float(np.mean(widths)), self._lane_speed(lane))
+                    links[lane_id] = {kind: int(lane.find('link/' + kind).get('id'))
+                                      for kind in ('predecessor', 'successor')
+                                      if lane.find('link/' + kind) is not None}
+            self.section_lanes.append((s0, s1, links))
+            result.append((s0, s1 - s0, lanes))
+        return result
+
+    def _lane_speed(self, lane):
+        speed = lane.find('speed')
+        if speed is None or speed.get('max') is None:
+            return self.speed_limit
+        return float(speed.get('max')) * _SPEED_UNITS.get(speed.get('unit', 'm/s'), 1.0)
+
+    def lane_at(self, section_index, lane_id):
+        if not self.lanes or not -len(self.lanes) <= section_index < len(self.lanes):
+            return None
+        return self.lanes[section_index].get(lane_id)
+
+
+def _geometry_pose(geometry, ds):
+    """ (x, y, heading) at distance ds along one planView geometry """
+    x0, y0, h0 = _number(geometry, 'x'), _number(geometry, 'y'), _number(geometry, 'hdg')
+    length = _number(geometry, 'length')
+    shape = geometry[0] if len(geometry) else None
+    kind = shape.tag if shape is not None else 'line'
+    if kind == 'arc':
+        k = _number(shape, 'curvature')
+        if abs(k) > 1e-12:
+            return (x0 + (math.sin(h0 + k*ds) - math.sin(h0)) / k,
+                    y0 + (math.cos(h0) - math.cos(h0 + k*ds)) / k, h0 + k*ds)
+    elif kind == 'spiral':
+        k0, k1 = _number(shape, 'curvStart'), _number(shape, 'curvEnd')
+        rate = (k1 - k0) / length if length > 0 else 0.0
+        # Midpoint integration of the heading, which is quadratic in the distance
+        steps = max(1, int(ds / 0.1))
+        u = (np.arange(steps) + 0.5) * ds / steps
+        heading = h0 + k0*u + rate*u**2 / 2.0
+        return (x0 + float(np.sum(np.cos(heading))) * ds / steps,
+                y0 + float(np.sum(np.sin(heading))) * ds / steps, h0 + k0*ds + rate*ds**2 / 2.0)
+    elif kind in ('poly3', 'paramPoly3'):
+        return _polynomial_pose(kind, shape, x0, y0, h0, length, ds)
+    return x0 + ds*math.cos(h0), y0 + ds*math.sin(h0), h0
+
+
+def _polynomial_pose(kind, shape, x0, y0, h0, length, ds):
+    """ Pose along a poly3 or paramPoly3 geometry, found by arc length """
+    if kind == 'poly3':
+        # The arc length of v(u) is at least u, so u up to length covers the whole curve
+        p = np.linspace(0.0, length, 1001)
+        u = p
+        v = _cubic([_number(shape, name) for name in ('a', 'b', 'c', 'd')], p)
+    else:
+        end = length if shape.get('pRange', 'normalized') == 'arcLength' else 1.0
+        p = np.linspace(0.0, end, 1001)
+        u = _cubic([_number(shape, name) for name in ('aU', 'bU', 'cU', 'dU')], p)
+        v = _cubic([_number(shape, name) for name in ('aV', 'bV', 'cV', 'dV')], p)
+    arc = np.concatenate(([0.0], np.cumsum(np.hypot(np.diff(u), np.diff(v)))))
+    i = min(int(np.searchsorted(arc, ds)), len(arc) - 2)
+    local_heading = math.atan2(v[i+1] - v[i], u[i+1] - u[i])
+    cos_h, sin_h = math.cos(h0), math.sin(h0)
+    return x0 + u[i]*cos_h - v[i]*sin_h, y0 + u[i]*sin_h + v[i]*cos_h, h0 + local_heading
+
+
+def _cubic(coefficients, p):
+    a, b, c, d = coefficients
+    return a + b*p + c*p**2 + d*p**3
+
+
+def _link_sections(builder, road):
+    """ Connects the lanes of consecutive sections of a road """
+    for i in range(len(road.section_lanes) - 1):
+        links = road.section_lanes[i][2]
+        for lane_id in road.lanes[i]:
+            next_id = links.get(lane_id, {}).get('successor', lane_id)
+            current, following = road.lanes[i][lane_id], road.lane_at(i + 1, next_id)
+            if following is None or (lane_id > 0) != (next_id > 0):
+                continue
+            if lane_id < 0:
+                builder.connect(current, following)
+            else:
+                builder.connect(following, current)
+
+
+def _link_roads(builder, road, kind, other, contact_point):
+    """ Connects the lanes of a road to the ones of the road linked at one of its ends """
+    at_end = kind == 'successor'
+    section = -1 if at_end else 0
+    other_section = 0 if contact_point == 'start' else -1
+    links = road.section_lanes[section][2]
+    for lane_id, lane in road.lanes[section].items():
+        other_id = links.get(lane_id, {}).get(kind)
+        if other_id is None:
+            continue
+        other_lane = other.lane_at(other_section, other_id)
+        if other_lane is None:
+            continue
+        # Whether each lane drives towards the point where the roads meet
+        incoming = (lane_id < 0) == at_end
+        other_incoming = (other_id < 0) != (contact_point == 'start')
+        if incoming and not other_incoming:
+            builder.connect(lane, other_lane)
+        elif other_incoming and not incoming:
+            builder.connect(other_lane, lane)
+
+
+def _add_signal(builder, road, signal):
+    """ Places a signal on the driving lanes it is valid for """
+    s = _number(signal, 's')
+    orientation = signal.get('orientation', 'none')
+    validity = signal.find('validity')
+    low, high = (-1000, 1000) if validity is None else sorted(
+        (int(validity.get('fromLane')), int(validity.get('toLane'))))
+    for index, (s0, s1, _) in enumerate(road.section_lanes):
+        if s0 - 1e-9 <= s <= s1 + 1e-9:
+            break
+    else:
+        return
+    lanes = [lane for lane_id, lane in sorted(road.lanes[index].items())
+             if low <= lane_id <= high and (orientation == 'none'
+                                            or (orientation == '+') == (lane_id < 0))]
+    if not lanes:
+        return
+    heading = road.reference(s)[3]
+    phase = 0 if abs(math.cos(heading)) > abs(math.sin(heading)) else 1
+    builder.add_landmark(lanes, landmark_type=signal.get('type', '-1'), name=signal.get('name', ''),
+                         junction_id=road.junction, phase=phase, road_s=s, landmark_id=signal.get('id'))
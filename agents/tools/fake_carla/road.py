@@ -0,0 +1,660 @@
+""" Road network of the offline carla stand-in: lanes, waypoints and the Map. """
+
+import enum
+import math
+
+import numpy as np
+
+from agents.tools.fake_carla import stats
+from agents.tools.fake_carla.geometry import Location, Rotation, Transform
+
+
+class LaneType(enum.IntFlag):
+    """ Mirrors carla.LaneType. """
+    NONE = 1
+    Driving = 2
+    Stop = 4
+    Shoulder = 8
+    Biking = 16
+    Sidewalk = 32
+    Border = 64
+    Restricted = 128
+    Parking = 256
+    Bidirectional = 512
+    Median = 1024
+    Special1 = 2048
+    Special2 = 4096
+    Special3 = 8192
+    RoadWorks = 16384
+    Tram = 32768
+    Rail = 65536
+    Entry = 131072
+    Exit = 262144
+    OffRamp = 524288
+    OnRamp = 1048576
+    Any = 4294967294
+
+
+class LaneChange(enum.IntFlag):
+    """ Mirrors carla.LaneChange. """
+    NONE = 0
+    Right = 1
+    Left = 2
+    Both = 3
+
+
+class LaneMarkingType(enum.Enum):
+    """ Mirrors carla.LaneMarkingType. """
+    NONE = 0
+    Other = 1
+    Broken = 2
+    Solid = 3
+    SolidSolid = 4
+    SolidBroken = 5
+    BrokenSolid = 6
+    BrokenBroken = 7
+    BottsDots = 8
+    Grass = 9
+    Curb = 10
+
+
+class LaneMarkingColor(enum.Enum):
+    """ Mirrors carla.LaneMarkingColor. """
+    Standard = 0
+    Blue = 1
+    Green = 2
+    Red = 3
+    White = 0
+    Yellow = 4
+    Other = 5
+
+
+class LaneMarking(object):
+    """ Mirrors carla.LaneMarking. """
+
+    def __init__(self, marking_type, lane_change, color=LaneMarkingColor.White, width=0.15):
+        self.type = marking_type
+        self.lane_change = lane_change
+        self.color = color
+        self.width = width
+
+
+_NO_MARKING = LaneMarking(LaneMarkingType.NONE, LaneChange.NONE)
+_SOLID = LaneMarking(LaneMarkingType.Solid, LaneChange.NONE)
+_CENTER = LaneMarking(LaneMarkingType.Solid, LaneChange.NONE, LaneMarkingColor.Yellow)
+_BROKEN = LaneMarking(LaneMarkingType.Broken, LaneChange.Both)
+
+
+class Landmark(object):
+    """ Mirrors carla.Landmark as returned by the waypoint landmark queries. """
+
+    def __init__(self, definition, distance, waypoint):
+        self.id = definition.id
+        self.road_id = definition.road_id
+        self.distance = distance
+        self.s = definition.s
+        self.t = 0.0
+        self.name = definition.name
+        self.type = definition.type
+        self.sub_type = '-1'
+        self.value = 0.0
+        self.unit = ''
+        self.height = 0.0
+        self.width = 0.0
+        self.text = ''
+        self.h_offset = 0.0
+        self.pitch = 0.0
+        self.roll = 0.0
+        self.is_dynamic = definition.type == '1000001'
+        self.country = 'OpenDRIVE'
+        self.waypoint = waypoint
+        self.transform = waypoint.transform
+
+
+class _LandmarkDef(object):
+    """ A signal placed at lane-local coordinate ``local_s`` of a lane. """
+
+    def __init__(self, landmark_id, lane, local_s, landmark_type, name):
+        self.id = landmark_id
+        self.lane = lane
+        self.local_s = local_s
+        self.road_id = lane.section.road.id
+        self.s = lane.road_s(local_s)
+        self.type = landmark_type
+        self.name = name
+
+
+class _Road(object):
+
+    def __init__(self, road_id, is_junction=False, junction_id=-1):
+        self.id = road_id
+        self.is_junction = is_junction
+        self.junction_id = junction_id
+        self.sections = []
+
+
+class _Section(object):
+
+    def __init__(self, road, section_id, s0, ref_length):
+        self.road = road
+        self.id = section_id
+        self.s0 = s0
+        self.ref_length = ref_length
+        self.lanes = {}
+
+
+class _Lane(object):
+    """
+    One lane of one lane section. The centre line is stored in driving
+    direction, so the lane-local coordinate grows as the vehicle drives.
+    """
+
+    def __init__(self, section, lane_id, points, width=3.5, speed_limit=30.0,
+                 lane_type=LaneType.Driving):
+        self.section = section
+        self.id = lane_id
+        self.width = width
+        self.speed_limit = speed_limit
+        self.lane_type = lane_type
+        self.points = np.asarray(points, dtype=float)
+        steps = np.diff(self.points[:, :2], axis=0)
+        self.cum = np.concatenate(([0.0], np.cumsum(np.hypot(steps[:, 0], steps[:, 1]))))
+        self.length = float(self.cum[-1])
+        self.yaws = np.degrees(np.arctan2(steps[:, 1], steps[:, 0]))
+        self.successors = []
+        self.predecessors = []
+        self.landmarks = []
+        self.left = None
+        self.right = None
+        self.left_marking = _NO_MARKING
+        self.right_marking = _NO_MARKING
+        self.index = -1
+
+    @property
+    def key(self):
+        return self.section.road.id, self.section.id, self.id
+
+    def road_s(self, local_s):
+        """ Converts a lane-local coordinate to the road reference s. """
+        fraction = local_s / self.length if self.length > 0 else 0.0
+        if self.id > 0:
+            fraction = 1.0 - fraction
+        return self.section.s0 + fraction * self.section.ref_length
+
+    def local_s(self, road_s):
+        """ Converts a road reference s to the lane-local coordinate. """
+        if self.section.ref_length <= 0:
+            return 0.0
+        fraction = (road_s - self.section.s0) / self.section.ref_length
+        fraction = min(1.0, max(0.0, fraction))
+        if self.id > 0:
+            fraction = 1.0 - fraction
+        return fraction * self.length
+
+    def pose(self, local_s):
+        """ Returns (x, y, z, yaw) at a lane-local coordinate. """
+        local_s = min(max(local_s, 0.0), self.length)
+        i = int(np.searchsorted(self.cum, local_s, side='right')) - 1
+        i = min(max(i, 0), len(self.cum) - 2)
+        span = self.cum[i + 1] - self.cum[i]
+        t = (local_s - self.cum[i]) / span if span > 0 else 0.0
+        p = self.points[i] + t * (self.points[i + 1] - self.points[i])
+        return float(p[0]), float(p[1]), float(p[2]), float(self.yaws[i])
+
+
+def _advance(lane, local_s, forward=True):
+    """ Walks ``local_s`` along the lane graph, branching at forks. """
+    if forward:
+        if local_s <= lane.length + 1e-9:
+            return [(lane, min(local_s, lane.length))]
+        result = []
+        for successor in lane.successors:
+            result.extend(_advance(successor, local_s - lane.length, True))
+        return result
+    if local_s >= -1e-9:
+        return [(lane, max(local_s, 0.0))]
+    result = []
+    for predecessor in lane.predecessors:
+        result.extend(_advance(predecessor, predecessor.length + local_s, False))
+    return result
+
+
+class Waypoint(object):
+    """ Mirrors carla.Waypoint. """
+
+    def __init__(self, lane, local_s):
+        self._lane = lane
+        self._local_s = local_s
+
+    @property
+    def id(self):
+        return hash((self._lane.key, round(self._local_s, 3)))
+
+    @property
+    def transform(self):
+        x, y, z, yaw = self._lane.pose(self._local_s)
+        return Transform(Location(x, y, z), Rotation(yaw=yaw))
+
+    @property
+    def road_id(self):
+        return self._lane.section.road.id
+
+    @property
+    def section_id(self):
+        return self._lane.section.id
+
+    @property
+    def lane_id(self):
+        return self._lane.id
+
+    @property
+    def s(self):
+        return self._lane.road_s(self._local_s)
+
+    @property
+    def is_junction(self):
+        return self._lane.section.road.is_junction
+
+    @property
+    def is_intersection(self):
+        return self.is_junction
+
+    @property
+    def junction_id(self):
+        return self._lane.section.road.junction_id
+
+    @property
+    def lane_width(self):
+        return self._lane.width
+
+    @property
+    def lane_type(self):
+        return self._lane.lane_type
+
+    @property
+    def left_lane_marking(self):
+        return self._lane.left_marking
+
+    @property
+    def right_lane_marking(self):
+        return self._lane.right_marking
+
+    @property
+    def lane_change(self):
+        change = LaneChange.NONE
+        if self._lane.right_marking.lane_change & LaneChange.Right and self._lane.right is not None:
+            change |= LaneChange.Right
+        if self._lane.left_marking.lane_change & LaneChange.Left and self._lane.left is not None:
+            change |= LaneChange.Left
+        return change
+
+    def next(self, distance):
+        stats.record('Waypoint.next')
+        return [Waypoint(lane, s) for lane, s in _advance(self._lane, self._local_s + distance)]
+
+    def previous(self, distance):
+        stats.record('Waypoint.previous')
+        return [Waypoint(lane, s) for lane, s in _advance(self._lane, self._local_s - distance, False)]
+
+    def next_until_lane_end(self, distance):
+        result = []
+        s = self._local_s + distance
+        while s < self._lane.length:
+            result.append(Waypoint(self._lane, s))
+            s += distance
+        result.append(Waypoint(self._lane, self._lane.length))
+        return result
+
+    def _neighbour(self, lane):
+        if lane is None:
+            return None
+        return Waypoint(lane, lane.local_s(self.s))
+
+    def get_left_lane(self):
+        stats.record('Waypoint.get_left_lane')
+        return self._neighbour(self._lane.left)
+
+    def get_right_lane(self):
+        stats.record('Waypoint.get_right_lane')
+        return self._neighbour(self._lane.right)
+
+    def get_landmarks(self, distance, stop_at_junction=False):
+        stats.record('Waypoint.get_landmarks')
+        return self._landmarks(distance, None, stop_at_junction)
+
+    def get_landmarks_of_type(self, distance, landmark_type, stop_at_junction=False):
+        stats.record('Waypoint.get_landmarks_of_type')
+        return self._landmarks(distance, str(landmark_type), stop_at_junction)
+
+    def _landmarks(self, distance, landmark_type, stop_at_junction):
+        found = {}
+        pending = [(self._lane, self._local_s, 0.0)]
+        visited = set()
+        while pending:
+            lane, start, travelled = pending.pop()
+            if (lane.key, start) in visited:
+                continue
+            visited.add((lane.key, start))
+            for definition in lane.landmarks:
+                if landmark_type is not None and definition.type != landmark_type:
+                    continue
+                offset = travelled + definition.local_s - start
+                if definition.local_s >= start and offset <= distance:
+                    if definition.id not in found or found[definition.id].distance > offset:
+                        found[definition.id] = Landmark(
+                            definition, offset, Waypoint(lane, definition.local_s))
+            travelled += lane.length - start
+            if travelled >= distance:
+                continue
+            for successor in lane.successors:
+                if stop_at_junction and successor.section.road.is_junction:
+                    continue
+                pending.append((successor, 0.0, travelled))
+        return sorted(found.values(), key=lambda landmark: landmark.distance)
+
+    def __repr__(self):
+        return 'Waypoint(road=%d, section=%d, lane=%d, s=%.2f)' % (
+            self.road_id, self.section_id, self.lane_id, self.s)
+
+
+class Map(object):
+    """
+    Mirrors carla.Map over an in-memory lane network. Use MapBuilder or the
+    factories in agents.tools.fake_carla.maps to create one.
+    """
+
+    _CELL = 10.0
+
+    def __init__(self, name, roads, lanes, opendrive, signals=None):
+        self.name = name
+        self.signals = signals or {}
+        self._roads = roads
+        self._lanes = lanes
+        self._opendrive = opendrive
+        self._lane_by_key = {lane.key: lane for lane in lanes}
+        for i, lane in enumerate(lanes):
+            lane.index = i
+        self._build_index()
+
+    def _build_index(self):
+        starts, ends, owners, offsets = [], [], [], []
+        for lane in self._lanes:
+            if lane.lane_type != LaneType.Driving or len(lane.points) < 2:
+                continue
+            starts.append(lane.points[:-1])
+            ends.append(lane.points[1:])
+            owners.append(np.full(len(lane.points) - 1, lane.index))
+            offsets.append(lane.cum[:-1])
+        self._seg_a = np.concatenate(starts)
+        self._seg_b = np.concatenate(ends)
+        self._seg_lane = np.concatenate(owners)
+        self._seg_s = np.concatenate(offsets)
+        cells = {}
+        low = np.floor(np.minimum(self._seg_a[:, :2], self._seg_b[:, :2]) / self._CELL).astype(int)
+        high = np.floor(np.maximum(self._seg_a[:, :2], self._seg_b[:, :2]) / self._CELL).astype(int)
+        for i in range(len(self._seg_a)):
+            for cx in range(low[i, 0], high[i, 0] + 1):
+                for cy in range(low[i, 1], high[i, 1] + 1):
+                    cells.setdefault((cx, cy), []).append(i)
+        self._cells = {cell: np.array(ids) for cell, ids in cells.items()}
+
+    def _project(self, point, candidates):
+        a = self._seg_a[candidates]
+        d = self._seg_b[candidates] - a
+        norm = np.einsum('ij,ij->i', d[:, :2], d[:, :2])
+        t = np.einsum('ij,ij->i', point[:2] - a[:, :2], d[:, :2]) / np.maximum(norm, 1e-12)
+        t = np.clip(t, 0.0, 1.0)
+        closest = a + t[:, None] * d
+        dist = np.hypot(closest[:, 0] - point[0], closest[:, 1] - point[1]) + 0.1 * np.abs(closest[:, 2] - point[2])
+        best = int(np.argmin(dist))
+        return candidates[best], t[best], dist[best]
+
+    def get_waypoint(self, location, project_to_road=True, lane_type=LaneType.Driving):
+        stats.record('Map.get_waypoint')
+        return self._waypoint(location, project_to_road)
+
+    def _waypoint(self, location, project_to_road=True):
+        """ get_waypoint without call accounting, for lookups the simulator does itself """
+        point = np.array([location.x, location.y, location.z])
+        cx, cy = int(math.floor(point[0] / self._CELL)), int(math.floor(point[1] / self._CELL))
+        near = [self._cells[c] for c in ((cx + i, cy + j) for i in (-1, 0, 1) for j in (-1, 0, 1))
+                if c in self._cells]
+        segment, t, dist = None, None, float('inf')
+        if near:
+            segment, t, dist = self._project(point, np.unique(np.concatenate(near)))
+        if dist > self._CELL:
+            segment, t, dist = self._project(point, np.arange(len(self._seg_a)))
+        if not project_to_road and dist > 2.0:
+            return None
+        lane = self._lanes[self._seg_lane[segment]]
+        i = np.searchsorted(lane.cum, self._seg_s[segment], side='left')
+        local_s = self._seg_s[segment] + t * (lane.cum[i + 1] - lane.cum[i])
+        return Waypoint(lane, float(local_s))
+
+    def get_waypoint_xodr(self, road_id, lane_id, s):
+        stats.record('Map.get_waypoint_xodr')
+        road = self._roads.get(road_id)
+        if road is None:
+            return None
+        # sections are half-open in s, the last one also holds the road end
+        for i, section in enumerate(road.sections):
+            end = section.s0 + section.ref_length
+            inside = section.s0 - 1e-9 <= s < end or (i == len(road.sections) - 1 and s <= end + 1e-9)
+            if inside and lane_id in section.lanes:
+                lane = section.lanes[lane_id]
+                return Waypoint(lane, lane.local_s(s))
+        return None
+
+    def get_topology(self):
+        stats.record('Map.get_topology')
+        return [(Waypoint(lane, 0.0), Waypoint(lane, lane.length))
+                for lane in self._lanes if lane.lane_type == LaneType.Driving]
+
+    def generate_waypoints(self, distance):
+        stats.record('Map.generate_waypoints')
+        waypoints = []
+        for lane in self._lanes:
+            if lane.lane_type != LaneType.Driving:
+                continue
+            for s in np.arange(0.0, lane.length, distance):
+                waypoints.append(Waypoint(lane, float(s)))
+        return waypoints
+
+    def get_spawn_points(self):
+        stats.record('Map.get_spawn_points')
+        points = []
+        for lane in self._lanes:
+            if lane.lane_type == LaneType.Driving and not lane.section.road.is_junction and lane.length > 10.0:
+                x, y, z, yaw = lane.pose(5.0)
+                points.append(Transform(Location(x, y, z + 0.3), Rotation(yaw=yaw)))
+        return points
+
+    def get_all_landmarks(self):
+        return [Landmark(d, 0.0, Waypoint(d.lane, d.local_s)) for lane in self._lanes for d in lane.landmarks]
+
+    def get_all_landmarks_of_type(self, landmark_type):
+        return [l for l in self.get_all_landmarks() if l.type == str(landmark_type)]
+
+    def to_opendrive(self):
+        return self._opendrive
+
+    def lane_count(self):
+        """ Number of lanes (one per lane section), not part of the carla API. """
+        return len(self._lanes)
+
+
+def _unit_normals(points):
+    tangents = np.zeros_like(points[:, :2])
+    tangents[:-1] += np.diff(points[:, :2], axis=0)
+    tangents[1:] += np.diff(points[:, :2], axis=0)
+    tangents /= np.maximum(np.linalg.norm(tangents, axis=1)[:, None], 1e-12)
+    # carla is left-handed: the right of heading (cos, sin) is (-sin, cos)
+    return np.stack([-tangents[:, 1], tangents[:, 0]], axis=1)
+
+
+def _slice(points, cum, a, b):
+    """ Cuts a polyline between reference arc lengths a and b. """
+    def at(s):
+        i = min(max(int(np.searchsorted(cum, s, side='right')) - 1, 0), len(cum) - 2)
+        span = cum[i + 1] - cum[i]
+        t = (s - cum[i]) / span if span > 0 else 0.0
+        return points[i] + t * (points[i + 1] - points[i])
+    inner = [p for p, s in zip(points, cum) if a + 1e-6 < s < b - 1e-6]
+    return np.array([at(a)] + inner + [at(b)])
+
+
+class MapBuilder(object):
+    """ Incrementally assembles a Map from roads, junction connectors and signals. """
+
+    def __init__(self, name, opendrive=None):
+        self.name = name
+        self.opendrive = opendrive
+        self._roads = {}
+        self._lanes = []
+        self._next_landmark = 0
+        self._signals = {}
+
+    def add_road(self, road_id, reference, right_lanes=1, left_lanes=1, lane_width=3.5,
+                 sections=1, speed_limit=30.0):
+        """
+        Adds a road along a reference polyline. Lanes with negative ids drive
+        along the reference on its right, positive ids drive against it.
+
+            :return: list with, per section, a dict lane_id -> lane
+        """
+        reference = np.asarray(reference, dtype=float)
+        steps = np.diff(reference[:, :2], axis=0)
+        cum = np.concatenate(([0.0], np.cumsum(np.hypot(steps[:, 0], steps[:, 1]))))
+        normals = _unit_normals(reference)
+        road = _Road(road_id)
+        self._roads[road_id] = road
+        bounds = np.linspace(0.0, cum[-1], sections + 1)
+        lane_ids = [-k for k in range(1, right_lanes + 1)] + [k for k in range(1, left_lanes + 1)]
+        result = []
+        for section_id in range(sections):
+            section = _Section(road, section_id, bounds[section_id], bounds[section_id + 1] - bounds[section_id])
+            road.sections.append(section)
+            for lane_id in lane_ids:
+                offset = (abs(lane_id) - 0.5) * lane_width * (1 if lane_id < 0 else -1)
+                shifted = reference.copy()
+                shifted[:, :2] += offset * normals
+                points = _slice(shifted, cum, bounds[section_id], bounds[section_id + 1])
+                if lane_id > 0:
+                    points = points[::-1]
+                lane = _Lane(section, lane_id, points, lane_width, speed_limit)
+                section.lanes[lane_id] = lane
+                self._lanes.append(lane)
+            result.append(section.lanes)
+        for previous, following in zip(result[:-1], result[1:]):
+            for lane_id in lane_ids:
+                if lane_id < 0:
+                    self.connect(previous[lane_id], following[lane_id])
+                else:
+                    self.connect(following[lane_id], previous[lane_id])
+        return result
+
+    def add_sections(self, road_id, sections, junction_id=-1):
+        """
+        Adds a road from explicit lane centre lines, for maps whose geometry
+        is computed elsewhere (see agents.tools.fake_carla.opendrive).
+
+            :param sections: list of (s0, ref_length, {lane_id: (points, width, speed_limit)}),
+                with the points of every lane in its driving direction
+            :param junction_id: junction the road belongs to, -1 for none
+            :return: list with, per section, a dict lane_id -> lane
+        """
+        road = _Road(road_id, junction_id >= 0, junction_id)
+        self._roads[road_id] = road
+        result = []
+        for section_id, (s0, ref_length, lanes) in enumerate(sections):
+            section = _Section(road, section_id, s0, ref_length)
+            road.sections.append(section)
+            for lane_id, (points, width, speed_limit) in sorted(lanes.items()):
+                lane = _Lane(section, lane_id, points, width, speed_limit)
+                section.lanes[lane_id] = lane
+                self._lanes.append(lane)
+            result.append(section.lanes)
+        return result
+
+    def connect(self, lane_from, lane_to):
+        """ Declares that lane_to directly follows lane_from. """
+        if lane_to in lane_from.successors:
+            return
+        lane_from.successors.append(lane_to)
+        lane_to.predecessors.append(lane_from)
+
+    def add_connector(self, road_id, lane_from, lane_to, junction_id=0, speed_limit=30.0):
+        """
+        Adds a single-lane junction road joining the end of lane_from to the
+        start of lane_to with a quadratic Bezier curve.
+        """
+        p0, p2 = lane_from.points[-1], lane_to.points[0]
+        d0 = lane_from.points[-1] - lane_from.points[-2]
+        d2 = lane_to.points[1] - lane_to.points[0]
+        matrix = np.array([[d0[0], -d2[0]], [d0[1], -d2[1]]])
+        control = (p0 + p2) / 2.0
+        if abs(np.linalg.det(matrix)) > 1e-6:
+            t = np.linalg.solve(matrix, (p2 - p0)[:2])[0]
+            if t > 0:
+                control = p0 + t * d0
+                control[2] = (p0[2] + p2[2]) / 2.0
+        chord = np.linalg.norm((p2 - p0)[:2])
+        n = max(4, int(chord))
+        ts = np.linspace(0.0, 1.0, n + 1)[:, None]
+        points = (1 - ts) ** 2 * p0 + 2 * (1 - ts) * ts * control + ts ** 2 * p2
+        points[0], points[-1] = p0, p2
+        road = _Road(road_id, True, junction_id)
+        self._roads[road_id] = road
+        steps = np.diff(points[:, :2], axis=0)
+        section = _Section(road, 0, 0.0, float(np.sum(np.hypot(steps[:, 0], steps[:, 1]))))
+        road.sections.append(section)
+        lane = _Lane(section, -1, points, lane_from.width, speed_limit)
+        section.lanes[-1] = lane
+        self._lanes.append(lane)
+        self.connect(lane_from, lane)
+        self.connect(lane, lane_to)
+        return lane
+
+    def add_landmark(self, lanes, local_s=None, landmark_type='1000001', name='Signal_3Light_Post01',
+                     junction_id=-1, phase=0, road_s=None, landmark_id=None):
+        """
+        Places one signal referenced by every lane in ``lanes``, by default
+        2 m before each lane end, or at the road reference coordinate
+        ``road_s`` if given. Traffic lights of one junction sharing a
+        ``phase`` turn green together. Returns the landmark id.
+        """
+        if landmark_id is None:
+            self._next_landmark += 1
+            landmark_id = str(self._next_landmark)
+        if landmark_type == '1000001':
+            self._signals[landmark_id] = (junction_id, phase)
+        for lane in lanes:
+            if road_s is not None:
+                s = lane.local_s(road_s)
+            else:
+                s = lane.length - 2.0 if local_s is None else local_s
+            lane.landmarks.append(_LandmarkDef(landmark_id, lane, max(0.0, s), landmark_type, name))
+        return landmark_id
+
+    def build(self):
+        """ Links neighbouring lanes, assigns lane markings and returns the Map. """
+        for road in self._roads.values():
+            for section in road.sections:
+                for lane in section.lanes.values():
+                    if road.is_junction:
+                        continue
+                    step = -1 if lane.id < 0 else 1
+                    lane.right = section.lanes.get(lane.id + step)
+                    inner = lane.id - step
+                    lane.left = section.lanes.get(inner if inner != 0 else -lane.id)
+                    lane.right_marking = _BROKEN if lane.right is not None else _SOLID
+                    if lane.left is None:
+                        lane.left_marking = _SOLID
+                    elif lane.left.id * lane.id < 0:
+                        lane.left_marking = _CENTER
+                    else:
+                        lane.left_marking = _BROKEN
+        opendrive = self.opendrive
+        if opendrive is None:
+            opendrive = '<OpenDRIVE name="%s" lanes="%d"/>' % (self.name, len(self._lanes))
+        return Map(self.name, self._roads, self._lanes, opendrive, self._signals)
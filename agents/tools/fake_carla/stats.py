@@ -0,0 +1,26 @@
+"""
+Call accounting for the offline carla stand-in.
+
+Every API entry point that costs a round trip on a real simulator (or a
+map query that callers treat as one) bumps a counter here, so benchmarks
+can report how many "server calls" a code path makes.
+"""
+
+import collections
+
+calls = collections.Counter()
+
+
+def record(name):
+    """ Counts one call of the API entry point ``name``. """
+    calls[name] += 1
+
+
+def reset():
+    """ Clears all counters. """
+    calls.clear()
+
+
+def total():
+    """ Returns the number of recorded calls. """
+    return sum(calls.values())
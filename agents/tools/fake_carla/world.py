@@ -0,0 +1,542 @@
+""" Client, world and actors of the offline carla stand-in. """
+
+import enum
+import fnmatch
+import math
+import os
+
+from agents.tools.fake_carla import stats
+from agents.tools.fake_carla.geometry import Location, Rotation, Transform, Vector3D
+
+
+class TrafficLightState(enum.Enum):
+    """ Mirrors carla.TrafficLightState. """
+    Red = 0
+    Yellow = 1
+    Green = 2
+    Off = 3
+    Unknown = 4
+
+    def __str__(self):
+        return self.name
+
+
+class VehicleControl(object):
+    """ Mirrors carla.VehicleControl. """
+
+    def __init__(self, throttle=0.0, steer=0.0, brake=0.0, hand_brake=False,
+                 reverse=False, manual_gear_shift=False, gear=0):
+        self.throttle = throttle
+        self.steer = steer
+        self.brake = brake
+        self.hand_brake = hand_brake
+        self.reverse = reverse
+        self.manual_gear_shift = manual_gear_shift
+        self.gear = gear
+
+
+class WorldSettings(object):
+    """ Mirrors carla.WorldSettings. """
+
+    def __init__(self, synchronous_mode=False, no_rendering_mode=False, fixed_delta_seconds=None):
+        self.synchronous_mode = synchronous_mode
+        self.no_rendering_mode = no_rendering_mode
+        self.fixed_delta_seconds = fixed_delta_seconds
+
+
+class ActorBlueprint(object):
+    """ Mirrors carla.ActorBlueprint. """
+
+    def __init__(self, blueprint_id, attributes=None):
+        self.id = blueprint_id
+        self.tags = blueprint_id.split('.')
+        self._attributes = dict(attributes or {})
+
+    def set_attribute(self, key, value):
+        self._attributes[key] = value
+
+    def has_attribute(self, key):
+        return key in self._attributes
+
+    def get_attribute(self, key):
+        return self._attributes[key]
+
+
+class BlueprintLibrary(object):
+    """ Mirrors carla.BlueprintLibrary. """
+
+    _IDS = ('vehicle.bmw.grandtourer', 'vehicle.bmw.isetta', 'vehicle.audi.a2', 'vehicle.tesla.model3',
+            'sensor.other.collision', 'sensor.other.obstacle', 'sensor.other.lane_invasion',
+            'static.prop.streetbarrier')
+
+    def __init__(self):
+        self._blueprints = [ActorBlueprint(blueprint_id) for blueprint_id in self._IDS]
+
+    def find(self, blueprint_id):
+        for blueprint in self._blueprints:
+            if blueprint.id == blueprint_id:
+                return ActorBlueprint(blueprint.id)
+        raise IndexError('blueprint %r not found' % blueprint_id)
+
+    def filter(self, pattern):
+        if '*' not in pattern:
+            pattern = '*%s*' % pattern
+        return [ActorBlueprint(b.id) for b in self._blueprints if fnmatch.fnmatch(b.id, pattern)]
+
+    def __iter__(self):
+        return iter(self._blueprints)
+
+    def __len__(self):
+        return len(self._blueprints)
+
+
+class Timestamp(object):
+    """ Mirrors carla.Timestamp. """
+
+    def __init__(self, frame, elapsed_seconds, delta_seconds):
+        self.frame = frame
+        self.elapsed_seconds = elapsed_seconds
+        self.delta_seconds = delta_seconds
+        self.platform_timestamp = elapsed_seconds
+
+
+class ActorSnapshot(object):
+    """ Mirrors carla.ActorSnapshot. """
+
+    def __init__(self, actor):
+        self.id = actor.id
+        self._transform = actor._world_transform()
+        self._velocity = Vector3D(actor._velocity.x, actor._velocity.y, actor._velocity.z)
+
+    def get_transform(self):
+        return Transform(Location(self._transform.location.x, self._transform.location.y,
+                                  self._transform.location.z),
+                         Rotation(self._transform.rotation.pitch, self._transform.rotation.yaw,
+                                  self._transform.rotation.roll))
+
+    def get_velocity(self):
+        return Vector3D(self._velocity.x, self._velocity.y, self._velocity.z)
+
+    def get_angular_velocity(self):
+        return Vector3D()
+
+    def get_acceleration(self):
+        return Vector3D()
+
+
+class WorldSnapshot(object):
+    """ Mirrors carla.WorldSnapshot. """
+
+    def __init__(self, world):
+        self.id = world._frame
+        self.frame = world._frame
+        self.timestamp = Timestamp(world._frame, world._elapsed, world._delta())
+        self._actors = {actor.id: ActorSnapshot(actor) for actor in world._actors.values()}
+
+    def find(self, actor_id):
+        return self._actors.get(actor_id)
+
+    def has_actor(self, actor_id):
+        return actor_id in self._actors
+
+    def __iter__(self):
+        return iter(self._actors.values())
+
+    def __len__(self):
+        return len(self._actors)
+
+
+class DebugHelper(object):
+    """ Mirrors carla.DebugHelper, only counting what would be drawn. """
+
+    def __init__(self):
+        self.drawn = 0
+
+    def _draw(self, name):
+        stats.record('DebugHelper.' + name)
+        self.drawn += 1
+
+    def draw_string(self, location, text, draw_shadow=False, color=None, life_time=-1.0,
+                    persistent_lines=True):
+        self._draw('draw_string')
+
+    def draw_point(self, location, size=0.1, color=None, life_time=-1.0, persistent_lines=True):
+        self._draw('draw_point')
+
+    def draw_line(self, begin, end, thickness=0.1, color=None, life_time=-1.0, persistent_lines=True):
+        self._draw('draw_line')
+
+    def draw_arrow(self, begin, end, thickness=0.1, arrow_size=0.1, color=None, life_time=-1.0,
+                   persistent_lines=True):
+        self._draw('draw_arrow')
+
+
+class Actor(object):
+    """ Mirrors carla.Actor. """
+
+    def __init__(self, world, actor_id, type_id, transform, parent=None, attributes=None):
+        self.id = actor_id
+        self.type_id = type_id
+        self.attributes = dict(attributes or {})
+        self.parent = parent
+        self.is_alive = True
+        self._world = world
+        self._transform = transform
+        self._velocity = Vector3D()
+
+    def _world_transform(self):
+        if self.parent is None:
+            return self._transform
+        parent = self.parent._world_transform()
+        return Transform(parent.transform(self._transform.location),
+                         Rotation(self._transform.rotation.pitch,
+                                  parent.rotation.yaw + self._transform.rotation.yaw,
+                                  self._transform.rotation.roll))
+
+    def get_world(self):
+        return self._world
+
+    def get_transform(self):
+        stats.record('Actor.get_transform')
+        transform = self._world_transform()
+        return Transform(Location(transform.location.x, transform.location.y, transform.location.z),
+                         Rotation(transform.rotation.pitch, transform.rotation.yaw, transform.rotation.roll))
+
+    def get_location(self):
+        stats.record('Actor.get_location')
+        location = self._world_transform().location
+        return Location(location.x, location.y, location.z)
+
+    def get_velocity(self):
+        stats.record('Actor.get_velocity')
+        return Vector3D(self._velocity.x, self._velocity.y, self._velocity.z)
+
+    def get_angular_velocity(self):
+        return Vector3D()
+
+    def get_acceleration(self):
+        return Vector3D()
+
+    def set_transform(self, transform):
+        stats.record('Actor.set_transform')
+        self._transform = transform
+
+    def destroy(self):
+        stats.record('Actor.destroy')
+        self._world._actors.pop(self.id, None)
+        self.is_alive = False
+        return True
+
+    def _step(self, dt):
+        pass
+
+
+class Vehicle(Actor):
+    """
+    Mirrors carla.Vehicle with a kinematic bicycle model: throttle and
+    brake map linearly to acceleration, steer to the front wheel angle.
+    """
+
+    WHEELBASE = 2.9
+    MAX_STEER_ANGLE = math.radians(70.0)
+    MAX_ACCELERATION = 4.0
+    MAX_DECELERATION = 8.0
+    DRAG = 0.05
+    HALF_WIDTH = 1.0
+    HALF_LENGTH = 2.4
+
+    def __init__(self, world, actor_id, type_id, transform):
+        super(Vehicle, self).__init__(world, actor_id, type_id, transform)
+        self._control = VehicleControl()
+        self._speed = 0.0
+
+    def apply_control(self, control):
+        stats.record('Vehicle.apply_control')
+        self._control = control
+
+    def get_control(self):
+        stats.record('Vehicle.get_control')
+        return self._control
+
+    def get_speed_limit(self):
+        stats.record('Vehicle.get_speed_limit')
+        lane = self._world._map._waypoint(self._transform.location)._lane
+        return lane.speed_limit
+
+    def get_traffic_light_state(self):
+        return TrafficLightState.Green
+
+    def is_at_traffic_light(self):
+        return False
+
+    def _step(self, dt):
+        control = self._control
+        acceleration = control.throttle * self.MAX_ACCELERATION - control.brake * self.MAX_DECELERATION
+        if control.hand_brake:
+            acceleration = -self.MAX_DECELERATION
+        acceleration -= self.DRAG * self._speed
+        self._speed = max(0.0, self._speed + acceleration * dt)
+        steer = max(-1.0, min(1.0, control.steer)) * self.MAX_STEER_ANGLE
+        yaw = math.radians(self._transform.rotation.yaw)
+        yaw += self._speed / self.WHEELBASE * math.tan(steer) * dt
+        location = self._transform.location
+        self._transform = Transform(
+            Location(location.x + self._speed * math.cos(yaw) * dt,
+                     location.y + self._speed * math.sin(yaw) * dt, location.z),
+            Rotation(self._transform.rotation.pitch, math.degrees(yaw), self._transform.rotation.roll))
+        self._velocity = Vector3D(self._speed * math.cos(yaw), self._speed * math.sin(yaw), 0.0)
+
+
+class TrafficLight(Actor):
+    """ Mirrors carla.TrafficLight with a fixed green/yellow/red cycle. """
+
+    def __init__(self, world, actor_id, landmark_id, phase, cycle=(10.0, 3.0, 13.0)):
+        super(TrafficLight, self).__init__(world, actor_id, 'traffic.traffic_light', Transform())
+        self.landmark_id = landmark_id
+        self._phase = phase
+        self._cycle = cycle
+
+    def get_state(self):
+        stats.record('TrafficLight.get_state')
+        green, yellow, red = self._cycle
+        period = green + yellow + red
+        t = (self._world._elapsed + self._phase * (green + yellow)) % period
+        if t < green:
+            return TrafficLightState.Green
+        if t < green + yellow:
+            return TrafficLightState.Yellow
+        return TrafficLightState.Red
+
+    @property
+    def state(self):
+        return self.get_state()
+
+
+class SensorData(object):
+    """ Mirrors carla.SensorData. """
+
+    def __init__(self, frame, timestamp, transform):
+        self.frame = frame
+        self.timestamp = timestamp
+        self.transform = transform
+
+
+class ObstacleDetectionEvent(SensorData):
+    """ Mirrors carla.ObstacleDetectionEvent. """
+
+    def __init__(self, frame, timestamp, transform, actor, other_actor, distance):
+        super(ObstacleDetectionEvent, self).__init__(frame, timestamp, transform)
+        self.actor = actor
+        self.other_actor = other_actor
+        self.distance = distance
+
+
+class Sensor(Actor):
+    """
+    Mirrors carla.Sensor. ``sensor.other.obstacle`` reports the closest
+    vehicle inside its detection corridor; other sensors never fire.
+    """
+
+    def __init__(self, world, actor_id, blueprint, transform, parent):
+        super(Sensor, self).__init__(world, actor_id, blueprint.id, transform, parent,
+                                     blueprint._attributes)
+        self._callback = None
+        self._since_last = 0.0
+
+    @property
+    def is_listening(self):
+        return self._callback is not None
+
+    def listen(self, callback):
+        self._callback = callback
+
+    def stop(self):
+        self._callback = None
+
+    def _step(self, dt):
+        if self._callback is None or self.type_id != 'sensor.other.obstacle':
+            return
+        self._since_last += dt
+        if self._since_last + 1e-9 < float(self.attributes.get('sensor_tick', 0.0)):
+            return
+        self._since_last = 0.0
+        event = self._detect()
+        if event is not None:
+            self._callback(event)
+
+    def _detect(self):
+        transform = self._world_transform()
+        heading = math.radians(transform.rotation.yaw)
+        reach = float(self.attributes.get('distance', 5.0))
+        radius = float(self.attributes.get('hit_radius', 0.5))
+        best, best_distance = None, None
+        for other in self._world._actors.values():
+            if not isinstance(other, Vehicle) or other is self.parent:
+                continue
+            dx = other._transform.location.x - transform.location.x
+            dy = other._transform.location.y - transform.location.y
+            ahead = dx * math.cos(heading) + dy * math.sin(heading)
+            lateral = -dx * math.sin(heading) + dy * math.cos(heading)
+            distance = ahead - Vehicle.HALF_LENGTH
+            if 0.0 <= distance <= reach and abs(lateral) <= radius + Vehicle.HALF_WIDTH:
+                if best is None or distance < best_distance:
+                    best, best_distance = other, distance
+        if best is None:
+            return None
+        world = self._world
+        return ObstacleDetectionEvent(world._frame, world._elapsed, transform, self, best, best_distance)
+
+
+class World(object):
+    """ Mirrors carla.World over a fake Map. """
+
+    def __init__(self, wmap):
+        self._map = wmap
+        self._settings = WorldSettings()
+        self._frame = 0
+        self._elapsed = 0.0
+        self._actors = {}
+        self._next_id = 1
+        self._spectator = self._add(Actor(self, self._new_id(), 'spectator', Transform()))
+        self._traffic_lights = {}
+        for landmark_id, (junction_id, phase) in sorted(wmap.signals.items()):
+            light = TrafficLight(self, self._new_id(), landmark_id, phase)
+            self._traffic_lights[landmark_id] = self._add(light)
+        self.debug = DebugHelper()
+        self.id = 1
+
+    def _new_id(self):
+        actor_id = self._next_id
+        self._next_id += 1
+        return actor_id
+
+    def _add(self, actor):
+        self._actors[actor.id] = actor
+        return actor
+
+    def _delta(self):
+        return self._settings.fixed_delta_seconds or 0.05
+
+    def get_map(self):
+        stats.record('World.get_map')
+        return self._map
+
+    def get_settings(self):
+        stats.record('World.get_settings')
+        return WorldSettings(self._settings.synchronous_mode, self._settings.no_rendering_mode,
+                             self._settings.fixed_delta_seconds)
+
+    def apply_settings(self, settings):
+        stats.record('World.apply_settings')
+        self._settings = WorldSettings(settings.synchronous_mode, settings.no_rendering_mode,
+                                       settings.fixed_delta_seconds)
+        return self._frame
+
+    def get_blueprint_library(self):
+        stats.record('World.get_blueprint_library')
+        return BlueprintLibrary()
+
+    def get_spectator(self):
+        stats.record('World.get_spectator')
+        return self._spectator
+
+    def spawn_actor(self, blueprint, transform, attach_to=None):
+        stats.record('World.spawn_actor')
+        if blueprint.id.startswith('vehicle.'):
+            actor = Vehicle(self, self._new_id(), blueprint.id, Transform(
+                Location(transform.location.x, transform.location.y, transform.location.z),
+                Rotation(transform.rotation.pitch, transform.rotation.yaw, transform.rotation.roll)))
+        elif blueprint.id.startswith('sensor.'):
+            actor = Sensor(self, self._new_id(), blueprint, transform, attach_to)
+        else:
+            actor = Actor(self, self._new_id(), blueprint.id, transform, attach_to)
+        return self._add(actor)
+
+    def try_spawn_actor(self, blueprint, transform, attach_to=None):
+        return self.spawn_actor(blueprint, transform, attach_to)
+
+    def get_actor(self, actor_id):
+        return self._actors.get(actor_id)
+
+    def get_actors(self, actor_ids=None):
+        if actor_ids is None:
+            return list(self._actors.values())
+        return [self._actors[i] for i in actor_ids if i in self._actors]
+
+    def get_traffic_light(self, landmark):
+        stats.record('World.get_traffic_light')
+        return self._traffic_lights.get(landmark.id)
+
+    def get_snapshot(self):
+        stats.record('World.get_snapshot')
+        return WorldSnapshot(self)
+
+    def tick(self, seconds=10.0):
+        """ Advances the simulation by one fixed step. """
+        stats.record('World.tick')
+        dt = self._delta()
+        self._frame += 1
+        self._elapsed += dt
+        for actor in list(self._actors.values()):
+            if isinstance(actor, Vehicle):
+                actor._step(dt)
+        for actor in list(self._actors.values()):
+            if not isinstance(actor, Vehicle):
+                actor._step(dt)
+        return self._frame
+
+    def wait_for_tick(self, seconds=10.0):
+        self.tick()
+        return self.get_snapshot()
+
+
+class Client(object):
+    """
+    Mirrors carla.Client. The host and port are ignored, the world is built
+    from the map handed to the constructor, or else from Client.default_map
+    (a 3x3 grid if that is not set either).
+    """
+
+    default_map = None
+
+    def __init__(self, host='localhost', port=2000, worker_threads=0, wmap=None):
+        if wmap is None:
+            wmap = Client.default_map
+        if wmap is None:
+            from agents.tools.fake_carla.maps import grid_map
+            wmap = grid_map()
+        self._world = World(wmap)
+        self._timeout = 10.0
+
+    def set_timeout(self, seconds):
+        self._timeout = seconds
+
+    def get_world(self):
+        return self._world
+
+    def load_world(self, wmap):
+        """ Takes a Map, or the path of an OpenDRIVE file, instead of a map name. """
+        if isinstance(wmap, str):
+            if not os.path.isfile(wmap):
+                raise RuntimeError('map not found: %s' % wmap)
+            from agents.tools.fake_carla.opendrive import load_opendrive
+            wmap = load_opendrive(wmap)
+        self._world = World(wmap)
+        return self._world
+
+    def apply_batch(self, commands, do_tick=False):
+        stats.record('Client.apply_batch')
+        for command in commands:
+            command.execute(self._world)
+        if do_tick:
+            self._world.tick()
+
+    def apply_batch_sync(self, commands, do_tick=False):
+        stats.record('Client.apply_batch_sync')
+        from agents.tools.fake_carla.command import Response
+        responses = []
+        for command in commands:
+            responses.append(Response(command.execute(self._world)))
+        if do_tick:
+            self._world.tick()
+        return responses
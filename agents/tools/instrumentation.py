@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+
+""" Module with tools to measure the calls made to the simulator and the time spent in each stage of a tick. """
+
+import collections
+import csv
+import json
+import math
+import threading
+import time
+
+import carla
+
+# Types whose instances are counted too when a counted call returns them
+COUNTED_TYPES = ('World', 'Map', 'Actor', 'DebugHelper')
+
+
+class CallCounter(object):
+    """
+    Counts the calls made to the carla objects wrapped by it, per method.
+    Objects of COUNTED_TYPES returned by a counted object are wrapped as
+    well, so wrapping the vehicle also counts the calls made to the world
+    it belongs to, to its map and to the actors it spawns. Arguments are
+    unwrapped before being passed on, so counted objects can be given to
+    any carla call.
+
+    Some getters (actor locations, velocities...) are answered from the
+    client's copy of the last world snapshot rather than by the server;
+    they are counted all the same, since they cost one call through the
+    API each.
+    """
+
+    def __init__(self):
+        self.calls = collections.Counter()
+        self.ticks = 0
+        self.count = 0      # Running total of the calls, read by StageProfiler
+        self._types = tuple(getattr(carla, name) for name in COUNTED_TYPES if hasattr(carla, name))
+
+    def wrap(self, target):
+        """ Returns target with its calls counted """
+        return _Counted(target, self)
+
+    def tick(self):
+        """ Marks the end of a simulation tick """
+        self.ticks += 1
+
+    def reset(self):
+        """ Clears the calls and ticks counted so far """
+        self.calls.clear()
+        self.ticks = 0
+        self.count = 0
+
+    @property
+    def total(self):
+        return sum(self.calls.values())
+
+    def per_tick(self):
+        """ List of (method, calls per tick), most called first """
+        ticks = max(self.ticks, 1)
+        return [(name, count / ticks) for name, count in self.calls.most_common()]
+
+    def summary(self):
+        """ Table of the calls per tick of every method, and of their total """
+        lines = ['%-40s %8.2f' % (name, count) for name, count in self.per_tick()]
+        lines.append('%-40s %8.2f' % ('total (%d ticks)' % self.ticks, self.total / max(self.ticks, 1)))
+        return '\n'.join(lines)
+
+    def _result(self, value):
+        return _Counted(value, self) if isinstance(value, self._types) else value
+
+    def _method(self, target, name, method):
+        key = type(target).__name__ + '.' + name
+
+        def counted(*args, **kwargs):
+            self.calls[key] += 1
+            self.count += 1
+            args = [_unwrap(arg) for arg in args]
+            kwargs = {keyword: _unwrap(value) for keyword, value in kwargs.items()}
+            return self._result(method(*args, **kwargs))
+        return counted
+
+
+class _Counted(object):
+    """ Proxy of a carla object that counts its method calls """
+
+    __slots__ = ('_target', '_counter')
+
+    def __init__(self, target, counter):
+        object.__setattr__(self, '_target', target)
+        object.__setattr__(self, '_counter', counter)
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if callable(value):
+            return self._counter._method(self._target, name, value)
+        return self._counter._result(value)
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, _unwrap(value))
+
+    def __eq__(self, other):
+        return self._target == _unwrap(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._target)
+
+    def __repr__(self):
+        return repr(self._target)
+
+
+def _unwrap(value):
+    return value._target if isinstance(value, _Counted) else value
+
+
+class LatencyHistogram(object):
+    """
+    Histogram of durations with logarithmic buckets: every power of two of
+    microseconds is split in SUBBUCKETS buckets of equal width, so adding a
+    sample is a frexp and an increment, whatever the number of samples.
+    Percentiles are estimated from the buckets, to within 1/SUBBUCKETS of
+    their value; the count, total, minimum and maximum are exact.
+    """
+
+    SUBBUCKETS = 4
+    OCTAVES = 32    # Up to 2**31 microseconds, about 36 minutes
+
+    def __init__(self):
+        self.buckets = [0] * (self.OCTAVES * self.SUBBUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def add(self, seconds):
+        """ Adds a duration, in seconds """
+        mantissa, exponent = math.frexp(seconds * 1e6)
+        if exponent < 1:
+            bucket = 0
+        else:
+            bucket = min(exponent * self.SUBBUCKETS + int((mantissa - 0.5) * 2 * self.SUBBUCKETS),
+                         len(self.buckets) - 1)
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q):
+        """ Upper bound of the bucket holding the q-th percentile (0 < q <= 100), in seconds """
+        if not self.count:
+            return 0.0
+        rank = q / 100.0 * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(self.bucket_bound(bucket), self.max) if bucket < len(self.buckets) - 1 else self.max
+        return self.max
+
+    def bucket_bound(self, bucket):
+        """ Upper bound of the durations of a bucket, in seconds """
+        exponent, sub = divmod(bucket, self.SUBBUCKETS)
+        if exponent < 1:
+            return 1e-6
+        return 2.0 ** (exponent - 1) * (1.0 + (sub + 1.0) / self.SUBBUCKETS) * 1e-6
+
+
+class StageProfiler(object):
+    """
+    Time spent in, and simulator calls made by, each named stage of the hot
+    paths of the agent, the planner and the PID controller, which all
+    accept a profiler and wrap their stages in profiler.stage(name):
+
+        with profiler.stage('agent.traffic_light'):
+            ...
+
+    Every stage run adds its duration to the LatencyHistogram of its name.
+    If a CallCounter is given, the calls it counted while the stage ran are
+    added to the stage too, which only covers the objects wrapped by that
+    counter. Stages may be nested; the time and calls of an inner stage are
+    also part of the outer one.
+
+    Components use NULL_PROFILER when none is given, whose stages do
+    nothing, so instrumentation costs a method call and an empty with block
+    per stage when disabled.
+    """
+
+    enabled = True
+
+    def __init__(self, counter=None, callback=None):
+        """
+        Constructor method.
+
+            :param counter: CallCounter whose calls are attributed to the stages, or None
+            :param callback: function called with (stage name, seconds, calls)
+                after every stage run, or None
+        """
+        self.counter = counter
+        self.callback = callback
+        self.histograms = collections.OrderedDict()     # {stage name: LatencyHistogram, ... }
+        self.calls = collections.Counter()              # {stage name: calls to the simulator, ... }
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        """ Context manager that times the code it wraps as the stage name """
+        return _Stage(self, name)
+
+    def record(self, name, seconds, calls=0):
+        """ Adds a run of a stage, timed by the caller """
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram()
+            histogram.add(seconds)
+            self.calls[name] += calls
+        if self.callback is not None:
+            self.callback(name, seconds, calls)
+
+    def reset(self):
+        """ Clears every stage recorded so far """
+        with self._lock:
+            self.histograms.clear()
+            self.calls.clear()
+
+    def report(self):
+        """ List with a dict of statistics per stage, times in milliseconds """
+        rows = []
+        with self._lock:
+            for name, histogram in self.histograms.items():
+                rows.append(collections.OrderedDict([
+                    ('stage', name),
+                    ('count', histogram.count),
+                    ('total_ms', histogram.total * 1e3),
+                    ('mean_ms', histogram.mean * 1e3),
+                    ('min_ms', histogram.min * 1e3),
+                    ('p50_ms', histogram.percentile(50) * 1e3),
+                    ('p90_ms', histogram.percentile(90) * 1e3),
+                    ('p99_ms', histogram.percentile(99) * 1e3),
+                    ('max_ms', histogram.max * 1e3),
+                    ('server_calls', self.calls[name]),
+                    ('server_calls_per_run', self.calls[name] / float(histogram.count)),
+                    ('buckets_us', {'%g' % (histogram.bucket_bound(i) * 1e6): count
+                                    for i, count in enumerate(histogram.buckets) if count}),
+                ]))
+        return rows
+
+    def summary(self):
+        """ Table of the statistics of every stage """
+        lines = ['%-32s %8s %10s %10s %10s %10s %8s' % ('stage', 'runs', 'mean ms', 'p50 ms', 'p99 ms',
+                                                        'max ms', 'calls')]
+        for row in self.report():
+            lines.append('%-32s %8d %10.3f %10.3f %10.3f %10.3f %8.2f' % (
+                row['stage'], row['count'], row['mean_ms'], row['p50_ms'], row['p99_ms'], row['max_ms'],
+                row['server_calls_per_run']))
+        return '\n'.join(lines)
+
+    def export(self, sink):
+        """
+        Exports the report to a sink: a path ending in .csv (one row per
+        stage, without the buckets), any other path (JSON), or a function,
+        called with the report.
+        """
+        rows = self.report()
+        if callable(sink):
+            sink(rows)
+        elif sink.endswith('.csv'):
+            with open(sink, 'w', newline='') as output:
+                writer = csv.DictWriter(output, fieldnames=[key for key in rows[0] if key != 'buckets_us']
+                                        if rows else ['stage'], extrasaction='ignore')
+                writer.writeheader()
+                writer.writerows(rows)
+        else:
+            with open(sink, 'w') as output:
+                json.dump(rows, output, indent=2)
+
+
+class _Stage(object):
+    """ Context manager of a stage run of a StageProfiler """
+
+    __slots__ = ('_profiler', '_name', '_begin', '_calls')
+
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+
+    def __enter__(self):
+        counter = self._profiler.counter
+        self._calls = counter.count if counter is not None else 0
+        self._begin = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self._begin
+        counter = self._profiler.counter
+        self._profiler.record(self._name, seconds, counter.count - self._calls if counter is not None else 0)
+        return False
+
+
+class _NullStage(object):
+    """ Stage of NULL_PROFILER, which does nothing """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class _NullProfiler(object):
+    """ Profiler of the components that are not instrumented """
+
+    enabled = False
+    _stage = _NullStage()
+
+    def stage(self, name):
+        return self._stage
+
+    def record(self, name, seconds, calls=0):
+        pass
+
+
+NULL_PROFILER = _NullProfiler()
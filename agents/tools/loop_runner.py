@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+""" Module with a game loop runner for synchronous mode simulations. """
+
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+LoopStats = namedtuple('LoopStats', ['frames', 'wall_time', 'fps', 'target_fps'])
+
+
+class SynchronousLoop(object):
+    """
+    Game loop of a client driving a simulation in synchronous mode. Each
+    frame is split in two parts:
+
+        - step(snapshot) computes the commands of the frame from the
+          snapshot of the world. They are applied and the world is ticked in
+          a single apply_batch_sync call, so the simulation stays as
+          deterministic as with world.tick().
+        - the side task returned by step, if any (visualization, spectator,
+          logging...), which nothing in the next frame depends on. It runs on
+          a background thread, overlapping the tick and the next step, so it
+          must only read data that the next step does not change: values
+          computed or copied in step for it (a transform, a RouteSection...),
+          never the live state of the agent.
+
+    At most one side task is pending: the one of a frame is waited for
+    before the one of the next frame starts, so side tasks run in order
+    and can never fall more than a frame behind.
+    """
+
+    def __init__(self, client, world):
+        """
+        Constructor method.
+
+            :param client: carla.Client connected to the simulation
+            :param world: carla.World, in synchronous mode with a fixed time step
+        """
+        settings = world.get_settings()
+        if not settings.synchronous_mode:
+            raise RuntimeError('SynchronousLoop needs the world in synchronous mode')
+        self.client = client
+        self.world = world
+        self.fixed_delta_seconds = settings.fixed_delta_seconds
+        self.errors = []
+
+    def run(self, step, done):
+        """
+        Runs frames until done() is true.
+
+            :param step: function of a carla.WorldSnapshot that returns
+                (list of carla.command, side task or None); the side task is
+                a function without arguments, run concurrently with the next
+                step
+            :param done: function without arguments, checked before every frame
+            :return: LoopStats of the frames run
+        """
+        frames = 0
+        pending = None
+        begin = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            try:
+                while not done():
+                    commands, side_task = step(self.world.get_snapshot())
+                    if pending is not None:
+                        pending.result()
+                    pending = executor.submit(side_task) if side_task is not None else None
+                    for response in self.client.apply_batch_sync(commands, True):
+                        if response.has_error():
+                            self.errors.append(response.error)
+                    frames += 1
+            finally:
+                if pending is not None:
+                    pending.result()
+        wall_time = time.perf_counter() - begin
+        target_fps = 1.0 / self.fixed_delta_seconds if self.fixed_delta_seconds else None
+        return LoopStats(frames, wall_time, frames / wall_time if wall_time > 0 else 0.0, target_fps)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+""" Module with a throttled debug drawing of the route ahead of a vehicle. """
+
+import math
+
+import numpy as np
+import carla
+
+
+class RouteVisualizer(object):
+    """
+    Draws the part of a route ahead of the vehicle as debug lines, without
+    redrawing what is already on screen:
+
+        - drawing happens at most once every period seconds of simulation,
+          whatever the tick rate;
+        - each segment drawn stays visible for life_time seconds and is only
+          drawn again when it would expire before the next refresh, so a
+          refresh draws the segments that just came into view;
+        - runs of nearly collinear segments are drawn as a single line.
+
+    With enabled=False nothing is drawn and no call reaches the simulator.
+    """
+
+    def __init__(self, debug, period=0.25, life_time=1.0, color=None, thickness=0.1,
+                 z_offset=0.5, max_angle=2.0, enabled=True):
+        """
+        Constructor method.
+
+            :param debug: carla.DebugHelper of the world
+            :param period: simulation seconds between refreshes
+            :param life_time: seconds a line stays visible, longer than period
+            :param color: carla.Color of the lines, green by default
+            :param thickness: thickness of the lines, in metres
+            :param z_offset: height of the lines above the waypoints, in metres
+            :param max_angle: largest turn, in degrees, within a single line
+            :param enabled: whether anything is drawn at all
+        """
+        if life_time <= period:
+            raise ValueError('life_time must be longer than period')
+        self.debug = debug
+        self.period = period
+        self.life_time = life_time
+        self.color = color if color is not None else carla.Color(r=0, g=255, b=0)
+        self.thickness = thickness
+        self.z_offset = z_offset
+        self.enabled = enabled
+        self.lines_drawn = 0
+        self._min_cos = math.cos(math.radians(max_angle))
+        self._route = None
+        self._expiry = dict()       # Map with structure {segment index: time it disappears, ... }
+        self._next_refresh = -math.inf
+
+    def draw(self, section, elapsed_seconds):
+        """
+        Draws the segments of a section of a route that are not on screen,
+        if a refresh is due. The section is a copy, so drawing can run on
+        another thread while the route advances.
+
+            :param section: RouteSection of the waypoints ahead of the vehicle to
+                show, from RouteCursor.section
+            :param elapsed_seconds: simulation time, from the world snapshot timestamp
+            :return: number of lines drawn
+        """
+        if not self.enabled:
+            return 0
+        if section.route is not self._route:
+            self._route = section.route
+            self._expiry = dict()
+            self._next_refresh = -math.inf
+        if elapsed_seconds < self._next_refresh:
+            return 0
+        self._next_refresh = elapsed_seconds + self.period
+
+        # Segment i of the route goes from points[i - first] to points[i - first + 1]
+        first = section.first
+        points = section.locations
+        deadline = elapsed_seconds + self.period
+        stale = [i for i in range(first, first + len(points) - 1) if self._expiry.get(i, -math.inf) <= deadline]
+        for i in [i for i in self._expiry if i < first]:
+            del self._expiry[i]
+
+        lines = 0
+        expiry = elapsed_seconds + self.life_time
+        while stale:
+            run = [stale.pop(0)]
+            direction = _unit(points[run[0] - first + 1] - points[run[0] - first])
+            while stale and stale[0] == run[-1] + 1 and \
+                    np.dot(direction, _unit(points[stale[0] - first + 1] - points[stale[0] - first])) >= self._min_cos:
+                run.append(stale.pop(0))
+            self.debug.draw_line(self._location(points[run[0] - first]),
+                                 self._location(points[run[-1] - first + 1]),
+                                 thickness=self.thickness, color=self.color,
+                                 life_time=self.life_time, persistent_lines=True)
+            for i in run:
+                self._expiry[i] = expiry
+            lines += 1
+        self.lines_drawn += lines
+        return lines
+
+    def _location(self, point):
+        return carla.Location(x=float(point[0]), y=float(point[1]), z=float(point[2]) + self.z_offset)
+
+
+def _unit(vector):
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+""" Module with a buffer of the latest readings of the sensors of an agent. """
+
+from collections import namedtuple
+
+SensorReading = namedtuple('SensorReading', ['frame', 'timestamp', 'value'])
+
+
+class SensorSlot(object):
+    """
+    Latest reading of one sensor. The sensor callback, on the sensor
+    thread, builds a SensorReading and stores it with a single assignment;
+    readers load it with a single attribute read. Both are atomic in
+    CPython, so no lock is needed and a reader always sees one whole
+    reading, never a mix of two.
+    """
+
+    __slots__ = ('name', 'extract', 'max_age', 'reading', 'received')
+
+    def __init__(self, name, extract=None, max_age=None):
+        """
+        Constructor method.
+
+            :param name: name of the sensor
+            :param extract: function of the sensor data returning the value
+                kept, so the data itself (and the actors it references) is
+                not held; by default the data is kept
+            :param max_age: seconds of simulation after which a reading is
+                stale, None to never expire readings
+        """
+        self.name = name
+        self.extract = extract
+        self.max_age = max_age
+        self.reading = None
+        self.received = 0
+
+    def write(self, data):
+        """ Callback of the sensor: keeps data as the latest reading """
+        value = self.extract(data) if self.extract is not None else data
+        self.reading = SensorReading(data.frame, data.timestamp, value)
+        self.received += 1
+
+    def read(self, timestamp=None):
+        """
+        Latest reading, if it is not stale at timestamp.
+
+            :param timestamp: simulation time of the frame being computed, in
+                seconds; None skips the staleness check
+            :return: SensorReading, or None
+        """
+        reading = self.reading
+        if reading is None or timestamp is None or self.max_age is None:
+            return reading
+        return reading if timestamp - reading.timestamp <= self.max_age else None
+
+    def clear(self):
+        self.reading = None
+
+
+class SensorBuffer(object):
+    """
+    Latest readings of a fixed set of sensors, one preallocated SensorSlot
+    per sensor. Sensor callbacks only overwrite their slot, so they cost
+    the same whatever the sensor_tick, and the agent reads every sensor it
+    needs for a frame with view(), without locks, checking how old each
+    reading is against the frame's timestamp.
+
+    Sensors such as sensor.other.obstacle only send data while they detect
+    something: with a max_age a little longer than their sensor_tick, a
+    reading that is not renewed expires, so a detection is dropped as soon
+    as it stops being reported.
+    """
+
+    def __init__(self):
+        self.slots = []
+        self._names = dict()     # Map with structure {sensor name: slot index, ... }
+
+    def add(self, name, extract=None, max_age=None):
+        """ Adds the slot of a sensor and returns it; see SensorSlot """
+        if name in self._names:
+            raise ValueError('sensor %s already has a slot' % name)
+        slot = SensorSlot(name, extract, max_age)
+        self._names[name] = len(self.slots)
+        self.slots.append(slot)
+        return slot
+
+    def listen(self, sensor, name, extract=None, max_age=None):
+        """ Adds the slot of a carla.Sensor and has the sensor write to it """
+        slot = self.add(name, extract, max_age)
+        sensor.listen(slot.write)
+        return slot
+
+    def __getitem__(self, name):
+        return self.slots[self._names[name]]
+
+    def view(self, timestamp=None):
+        """
+        Readings of every sensor that are not stale at timestamp, as
+        {sensor name: SensorReading or None, ... }, each slot read once
+        """
+        return {slot.name: slot.read(timestamp) for slot in self.slots}
+
+    def clear(self):
+        for slot in self.slots:
+            slot.clear()
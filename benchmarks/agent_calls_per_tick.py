@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+"""
+Calls made to the simulator per tick by the loop of
+examples/motion_planning.py.
+
+The ego vehicle drives between two spawn points of the current map in
+synchronous mode; every call made through it, its world, its map, its
+debug helper and the actors it spawns is counted, and the calls per
+tick of each method are printed at the end. Run it with --headless to
+leave out the route drawing, and with --stages to also print the time
+and calls of each stage of the planner setup and of the tick, optionally
+exported with --export to a JSON or CSV file.
+"""
+
+import argparse
+import glob
+import os
+import sys
+
+try:
+    sys.path.append(glob.glob('../carla/dist/carla-*%d.%d-%s.egg' % (
+        sys.version_info.major,
+        sys.version_info.minor,
+        'win-amd64' if os.name == 'nt' else 'linux-x86_64'))[0])
+except IndexError:
+    pass
+import carla
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.navigation.unb_agent import Agent
+from agents.tools.instrumentation import CallCounter, StageProfiler
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument('--host', default='127.0.0.1', help='IP of the host server')
+    argparser.add_argument('-p', '--port', default=2000, type=int, help='TCP port to listen to')
+    argparser.add_argument('-s', '--spawn', default=64, type=int, help='index of the spawn point of the route')
+    argparser.add_argument('-d', '--destination', default=31, type=int, help='index of the destination spawn point')
+    argparser.add_argument('-t', '--ticks', default=1000, type=int, help='maximum number of ticks')
+    argparser.add_argument('--headless', action='store_true', help='do not draw the route')
+    argparser.add_argument('--stages', action='store_true', help='time each stage of the setup and of the tick')
+    argparser.add_argument('--export', default=None, help='JSON or CSV file of the stage timings')
+    args = argparser.parse_args()
+
+    client = carla.Client(args.host, args.port)
+    client.set_timeout(10.0)
+    world = client.get_world()
+    settings = world.get_settings()
+    original_settings = world.get_settings()
+    settings.synchronous_mode = True
+    settings.fixed_delta_seconds = 0.022
+    world.apply_settings(settings)
+
+    counter = CallCounter()
+    profiler = StageProfiler(counter) if args.stages or args.export else None
+    actors = []
+    agent = None
+    try:
+        spawn_points = world.get_map().get_spawn_points()
+        blueprint = world.get_blueprint_library().filter('bmw')[0]
+        vehicle = counter.wrap(world.spawn_actor(blueprint, spawn_points[args.spawn]))
+        actors.append(vehicle)
+        world.tick()
+
+        agent = Agent(vehicle, visualize=not args.headless, profiler=profiler)
+        actors.extend([agent._camera, agent.obstacle_sensor])
+        agent.set_route(spawn_points[args.spawn].location, spawn_points[args.destination].location)
+        world = vehicle.get_world()
+        spectator = world.get_spectator()
+
+        counter.reset()
+        while not agent.arrived() and counter.ticks < args.ticks:
+            world.tick()
+            snapshot = world.get_snapshot()
+            state = agent.update_state(snapshot)
+            spectator.set_transform(snapshot.find(agent._camera.id).get_transform())
+            control = agent.run_step(speed=state.speed_limit, state=state) or agent.emergency_stop()
+            vehicle.apply_control(control)
+            agent.show_path(distance=int(state.speed/2), elapsed_seconds=snapshot.timestamp.elapsed_seconds)
+            counter.tick()
+        print(counter.summary())
+        if profiler is not None:
+            print(profiler.summary())
+            if args.export:
+                profiler.export(args.export)
+
+    finally:
+        if agent is not None:
+            agent.obstacle_sensor.stop()
+        client.apply_batch([carla.command.DestroyActor(actor.id) for actor in actors])
+        world.apply_settings(original_settings)
+
+
+if __name__ == '__main__':
+    main()
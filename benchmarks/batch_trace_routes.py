@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+"""
+Throughput of GlobalRoutePlanner.trace_routes against the number of
+worker processes.
+
+Random spawn point pairs of the current map are traced serially with
+trace_route, then in batch with trace_routes for every worker count
+given. The route cache is disabled so every route is planned.
+"""
+
+import argparse
+import glob
+import os
+import random
+import sys
+import time
+
+try:
+    sys.path.append(glob.glob('../carla/dist/carla-*%d.%d-%s.egg' % (
+        sys.version_info.major,
+        sys.version_info.minor,
+        'win-amd64' if os.name == 'nt' else 'linux-x86_64'))[0])
+except IndexError:
+    pass
+import carla
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.navigation.global_route_planner import GlobalRoutePlanner
+from agents.navigation.global_route_planner_dao import GlobalRoutePlannerDAO
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument('--host', default='127.0.0.1', help='IP of the host server')
+    argparser.add_argument('-p', '--port', default=2000, type=int, help='TCP port to listen to')
+    argparser.add_argument('-r', '--resolution', default=2.0, type=float, help='sampling resolution in metres')
+    argparser.add_argument('-n', '--routes', default=1000, type=int, help='number of routes')
+    argparser.add_argument('-w', '--workers', default='1,2,4,8', help='comma separated worker counts')
+    argparser.add_argument('--serial', default=100, type=int, help='routes timed with plain trace_route')
+    argparser.add_argument('--seed', default=0, type=int, help='random seed of the route sample')
+    args = argparser.parse_args()
+
+    client = carla.Client(args.host, args.port)
+    client.set_timeout(10.0)
+    wmap = client.get_world().get_map()
+    grp = GlobalRoutePlanner(GlobalRoutePlannerDAO(wmap, args.resolution), route_cache_size=0)
+    grp.setup()
+
+    spawn_points = wmap.get_spawn_points()
+    rng = random.Random(args.seed)
+    pairs = [(rng.choice(spawn_points).location, rng.choice(spawn_points).location) for _ in range(args.routes)]
+
+    begin = time.perf_counter()
+    for origin, destination in pairs[:args.serial]:
+        try:
+            grp.trace_route(origin, destination)
+        except Exception:  # unreachable destinations count as traced
+            pass
+    serial = (time.perf_counter() - begin) / max(min(args.serial, len(pairs)), 1)
+    print('trace_route           %10.1f routes/s' % (1.0 / serial))
+
+    baseline = None
+    for workers in [int(value) for value in args.workers.split(',')]:
+        begin = time.perf_counter()
+        routes = list(grp.trace_routes(pairs, workers=workers))
+        elapsed = time.perf_counter() - begin
+        throughput = len(routes) / elapsed
+        baseline = baseline or throughput
+        print('trace_routes %3d workers %8.1f routes/s (%.2fx), %d without route' % (
+            workers, throughput, throughput / baseline, sum(route is None for route in routes)))
+
+
+if __name__ == '__main__':
+    main()
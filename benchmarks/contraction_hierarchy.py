@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+"""
+Preprocessing cost against query speedup of the contraction hierarchy of
+GlobalRoutePlanner.
+
+The graph is built once, then the hierarchy is built on top of it and
+the same node pairs are searched with A* and with the hierarchy. Run it
+with --map set to the largest map available in your CARLA build, and
+with --no-search-spaces to time the bidirectional search the hierarchy
+runs when it does not store the search spaces of its nodes.
+"""
+
+import argparse
+import glob
+import os
+import random
+import sys
+import time
+
+try:
+    sys.path.append(glob.glob('../carla/dist/carla-*%d.%d-%s.egg' % (
+        sys.version_info.major,
+        sys.version_info.minor,
+        'win-amd64' if os.name == 'nt' else 'linux-x86_64'))[0])
+except IndexError:
+    pass
+import carla
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.navigation.contraction_hierarchy import ContractionHierarchy
+from agents.navigation.csr_graph import NoPathError
+from agents.navigation.global_route_planner import GlobalRoutePlanner
+from agents.navigation.global_route_planner_dao import GlobalRoutePlannerDAO
+
+
+def path_length(graph, path):
+    """ Sum of the edge lengths of a path of graph node ids """
+    return sum(float(graph.length[graph.edge(n1, n2)]) for n1, n2 in zip(path[:-1], path[1:]))
+
+
+def timed_searches(search, pairs):
+    """ Runs search on every pair, returns (seconds, paths) with None for unreachable pairs """
+    paths = []
+    begin = time.perf_counter()
+    for source, target in pairs:
+        try:
+            paths.append(search(source, target))
+        except NoPathError:
+            paths.append(None)
+    return time.perf_counter() - begin, paths
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument('--host', default='127.0.0.1', help='IP of the host server')
+    argparser.add_argument('-p', '--port', default=2000, type=int, help='TCP port to listen to')
+    argparser.add_argument('-m', '--map', default=None, help='map to load, the current one by default')
+    argparser.add_argument('-r', '--resolution', default=2.0, type=float, help='sampling resolution in metres')
+    argparser.add_argument('-n', '--queries', default=1000, type=int, help='number of random node pairs')
+    argparser.add_argument('--witness-limit', default=64, type=int, help='nodes settled per witness search')
+    argparser.add_argument('--no-search-spaces', action='store_true',
+                           help='build the hierarchy without the search spaces of its nodes')
+    argparser.add_argument('--seed', default=0, type=int, help='random seed of the node pairs')
+    args = argparser.parse_args()
+
+    client = carla.Client(args.host, args.port)
+    client.set_timeout(60.0)
+    world = client.load_world(args.map) if args.map else client.get_world()
+    wmap = world.get_map()
+
+    grp = GlobalRoutePlanner(GlobalRoutePlannerDAO(wmap, args.resolution))
+    begin = time.perf_counter()
+    grp.setup()
+    setup_time = time.perf_counter() - begin
+    graph = grp._graph
+
+    begin = time.perf_counter()
+    hierarchy = ContractionHierarchy.build(graph, witness_limit=args.witness_limit,
+                                           search_spaces=not args.no_search_spaces)
+    build_time = time.perf_counter() - begin
+
+    print('%s: %d nodes, %d edges' % (wmap.name, graph.num_nodes, graph.num_edges))
+    print('graph setup           %10.2f s' % setup_time)
+    print('hierarchy build       %10.2f s, %d shortcuts, %.1f MB' % (
+        build_time, hierarchy.num_shortcuts, hierarchy.nbytes / 1e6))
+
+    rng = random.Random(args.seed)
+    nodes = graph.node_ids.tolist()
+    pairs = [(rng.choice(nodes), rng.choice(nodes)) for _ in range(args.queries)]
+    astar_time, astar_paths = timed_searches(graph.astar_path, pairs)
+    hierarchy_time, hierarchy_paths = timed_searches(hierarchy.shortest_path, pairs)
+
+    routes = [(a, h) for a, h in zip(astar_paths, hierarchy_paths) if a is not None and h is not None]
+    different = sum(1 for a, h in routes if a != h)
+    shorter = sum(1 for a, h in routes if path_length(graph, h) < path_length(graph, a))
+    print('A* query              %10.3f ms' % (astar_time / args.queries * 1e3))
+    print('hierarchy query       %10.3f ms (%.1fx)' % (
+        hierarchy_time / args.queries * 1e3, astar_time / max(hierarchy_time, 1e-12)))
+    print('hierarchy paths differ from A* in %d of %d routes, shorter in %d' % (different, len(routes), shorter))
+    if hierarchy_time < astar_time:
+        print('preprocessing pays off after %d queries' % (build_time / ((astar_time - hierarchy_time) / args.queries)))
+
+
+if __name__ == '__main__':
+    main()
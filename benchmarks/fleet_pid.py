@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""
+Cost per vehicle of FleetPIDController against one VehiclePIDController
+per vehicle.
+
+Both compute the commands of N vehicles from the same random states and
+targets, so only the controllers are timed; a single vehicle is spawned
+to build them. The largest difference between their commands is printed
+as a check.
+"""
+
+import argparse
+import glob
+import os
+import random
+import sys
+import time
+
+try:
+    sys.path.append(glob.glob('../carla/dist/carla-*%d.%d-%s.egg' % (
+        sys.version_info.major,
+        sys.version_info.minor,
+        'win-amd64' if os.name == 'nt' else 'linux-x86_64'))[0])
+except IndexError:
+    pass
+import carla
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.navigation import pid_controller as pid
+from agents.navigation.vehicle_state import VehicleState
+
+ARGS_LATERAL = {'K_P': 0.58, 'K_D': 0.4, 'K_I': 0.5}
+ARGS_LONGITUDINAL = {'K_P': 0.15, 'K_D': 0.05, 'K_I': 0.07}
+
+
+def random_step(wmap, count, frame, rng):
+    """ Random (states, target waypoints) of count vehicles """
+    spawn_points = wmap.get_spawn_points()
+    states, targets = [], []
+    for _ in range(count):
+        transform = rng.choice(spawn_points)
+        transform = carla.Transform(transform.location, carla.Rotation(yaw=transform.rotation.yaw + rng.uniform(-30, 30)))
+        states.append(VehicleState(frame, transform, carla.Vector3D(), rng.uniform(0, 60), 30))
+        targets.append(wmap.get_waypoint(transform.location).next(rng.uniform(2, 10))[0])
+    return states, targets
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument('--host', default='127.0.0.1', help='IP of the host server')
+    argparser.add_argument('-p', '--port', default=2000, type=int, help='TCP port to listen to')
+    argparser.add_argument('-n', '--vehicles', default='1,10,100,1000', help='comma separated fleet sizes')
+    argparser.add_argument('-s', '--steps', default=50, type=int, help='control steps per fleet size')
+    argparser.add_argument('--seed', default=0, type=int, help='random seed of the states')
+    args = argparser.parse_args()
+
+    client = carla.Client(args.host, args.port)
+    client.set_timeout(10.0)
+    world = client.get_world()
+    wmap = world.get_map()
+    blueprint = world.get_blueprint_library().filter('bmw')[0]
+    vehicle = world.spawn_actor(blueprint, wmap.get_spawn_points()[0])
+    rng = random.Random(args.seed)
+
+    try:
+        for count in [int(value) for value in args.vehicles.split(',')]:
+            single = [pid.VehiclePIDController(vehicle, ARGS_LATERAL, ARGS_LONGITUDINAL, max_throttle=1)
+                      for _ in range(count)]
+            fleet = pid.FleetPIDController([vehicle] * count, ARGS_LATERAL, ARGS_LONGITUDINAL, max_throttle=1)
+            single_time = fleet_time = difference = 0.0
+            for step in range(args.steps):
+                states, targets = random_step(wmap, count, step, rng)
+                begin = time.perf_counter()
+                controls = [controller.run_step(30, target, state)
+                            for controller, target, state in zip(single, targets, states)]
+                middle = time.perf_counter()
+                commands = fleet.run_step(30, targets, states)
+                fleet_time += time.perf_counter() - middle
+                single_time += middle - begin
+                for control, command in zip(controls, commands):
+                    difference = max(difference, abs(control.throttle - command.control.throttle),
+                                     abs(control.steer - command.control.steer),
+                                     abs(control.brake - command.control.brake))
+            scale = 1e6 / (args.steps * count)
+            print('%5d vehicles: single %8.2f us/vehicle, fleet %8.2f us/vehicle (%.1fx), max difference %.1e' % (
+                count, single_time * scale, fleet_time * scale, single_time / max(fleet_time, 1e-12), difference))
+    finally:
+        vehicle.destroy()
+
+
+if __name__ == '__main__':
+    main()
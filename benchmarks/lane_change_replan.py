@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+"""
+Check of GlobalRoutePlanner.replan_lane_change against a fresh
+trace_route.
+
+It runs offline, against agents.tools.fake_carla. Random routes are
+traced on a grid map, and a lane change to a lane next to a random
+waypoint of each one is replanned, both by splicing it into the rest of
+the route and with trace_route from the new lane. The length ratio of the
+spliced route to the fresh one, both in waypoints, and the time of both
+are printed. The exit status is 1 if a spliced route is longer than
+--max-ratio times the fresh route, so the script can be run as a test.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.tools import fake_carla
+carla = fake_carla.install()
+
+from agents.navigation.global_route_planner import GlobalRoutePlanner
+from agents.navigation.global_route_planner_dao import GlobalRoutePlannerDAO
+
+
+def lane_changes(grp, wmap, count, rng):
+    """ count (route still to be driven, location on the next lane, destination) from random routes """
+    spawn_points = wmap.get_spawn_points()
+    changes = []
+    while len(changes) < count:
+        origin, destination = rng.sample(spawn_points, 2)
+        route = grp.trace_route(origin.location, destination.location)
+        if len(route) < 20:
+            continue
+        position = rng.randrange(1, len(route) - 10)
+        waypoint = route[position][0]
+        lanes = [lane for lane in (waypoint.get_left_lane(), waypoint.get_right_lane())
+                 if lane is not None and lane.lane_type == carla.LaneType.Driving
+                 and lane.lane_id * waypoint.lane_id > 0]
+        if lanes:
+            changes.append((route[position:], rng.choice(lanes).transform.location, destination.location))
+    return changes
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument('--size', default=5, type=int, help='junctions per side of the grid map')
+    argparser.add_argument('--lanes', default=3, type=int, help='lanes per direction of the grid roads')
+    argparser.add_argument('--block', default=80.0, type=float, help='distance between grid junctions in metres')
+    argparser.add_argument('-r', '--resolution', default=2.0, type=float, help='sampling resolution in metres')
+    argparser.add_argument('-n', '--changes', default=200, type=int, help='number of lane changes')
+    argparser.add_argument('--max-ratio', default=1.1, type=float,
+                           help='largest length in waypoints of a spliced route allowed, relative to the fresh route')
+    argparser.add_argument('--seed', default=0, type=int, help='random seed of the lane changes')
+    args = argparser.parse_args()
+
+    wmap = fake_carla.grid_map(args.size, args.size, block=args.block, lanes=args.lanes)
+    grp = GlobalRoutePlanner(GlobalRoutePlannerDAO(wmap, args.resolution), route_cache_size=0)
+    grp.setup()
+
+    ratios, worst = [], None
+    fresh_time = spliced_time = 0.0
+    for route_trace, location, destination in lane_changes(grp, wmap, args.changes, random.Random(args.seed)):
+        begin = time.perf_counter()
+        fresh = grp.trace_route(location, destination)
+        fresh_time += time.perf_counter() - begin
+        begin = time.perf_counter()
+        spliced = grp.replan_lane_change(route_trace, location, destination)
+        spliced_time += time.perf_counter() - begin
+        ratios.append(len(spliced) / float(len(fresh)))
+        if worst is None or ratios[-1] > worst[0]:
+            worst = (ratios[-1], len(spliced), len(fresh))
+
+    print('trace_route         %8.3f ms' % (1e3 * fresh_time / len(ratios)))
+    print('replan_lane_change  %8.3f ms' % (1e3 * spliced_time / len(ratios)))
+    print('length ratio median %.2f, max %.2f (%d waypoints against %d)' % (
+        statistics.median(ratios), worst[0], worst[1], worst[2]))
+    if worst[0] > args.max_ratio:
+        print('spliced route longer than %.2f times the fresh route' % args.max_ratio)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
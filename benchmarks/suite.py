@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+
+"""
+Benchmark suite of the planner and the agent on synthetic maps of growing
+size.
+
+It runs offline, against agents.tools.fake_carla. For every map size
+(number of lane segments of the topology) and sampling resolution it
+measures GlobalRoutePlanner.setup, trace_route, abstract_route_plan and
+Agent.run_step, and once per map VehiclePIDController.run_step, which does
+not depend on the resolution. Each is reported with its wall time, the
+peak Python memory of a second, traced run, and the calls it made to the
+simulator. Results are saved as JSON; run the suite on two commits and
+pass the first file to --compare to see the change.
+"""
+
+import argparse
+import gc
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.tools import fake_carla
+carla = fake_carla.install()
+
+from agents.navigation import pid_controller as pid
+from agents.navigation.csr_graph import NoPathError
+from agents.navigation.global_route_planner import GlobalRoutePlanner
+from agents.navigation.global_route_planner_dao import DENSIFICATIONS, GlobalRoutePlannerDAO
+from agents.navigation.unb_agent import Agent
+from agents.navigation.vehicle_state import VehicleState
+
+
+def grid_for(segments, lanes, block):
+    """ Smallest square grid map with about the given number of lane segments """
+    side = max(2, int(math.ceil(math.sqrt(segments / (11.0 * lanes)))))
+    return fake_carla.grid_map(side, side, block=block, lanes=lanes)
+
+
+def route_pairs(spawn_points, count, length, rng):
+    """ count spawn point pairs whose straight line distance is the closest to length """
+    candidates = [(rng.choice(spawn_points).location, rng.choice(spawn_points).location) for _ in range(count * 20)]
+    candidates.sort(key=lambda pair: abs(pair[0].distance(pair[1]) - length))
+    return candidates[:count]
+
+
+def measure(run, memory):
+    """
+    Runs run() and returns its result with a dict of wall time (s), simulator
+    calls and, if memory is set, the peak Python memory (bytes) of a second,
+    traced run. run must build everything it needs, so both runs match.
+    """
+    gc.collect()
+    fake_carla.stats.reset()
+    begin = time.perf_counter()
+    result = run()
+    record = {'wall_time': time.perf_counter() - begin,
+              'server_calls': fake_carla.stats.total(),
+              'server_calls_by_method': dict(fake_carla.stats.calls)}
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        run()
+        record['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, record
+
+
+def per_call(record, calls):
+    """ Adds per call figures to a record """
+    record['count'] = calls
+    record['wall_time_per_call'] = record['wall_time'] / max(calls, 1)
+    record['server_calls_per_call'] = record['server_calls'] / float(max(calls, 1))
+    return record
+
+
+def bench_setup(wmap, resolution, densification, memory):
+    def run():
+        grp = GlobalRoutePlanner(GlobalRoutePlannerDAO(wmap, resolution, densification), route_cache_size=0)
+        grp.setup()
+        return grp
+    grp, record = measure(run, memory)
+    record['graph_nodes'] = grp._graph.num_nodes
+    record['graph_edges'] = grp._graph.num_edges
+    return grp, per_call(record, 1)
+
+
+def bench_queries(query, pairs, memory):
+    def run():
+        done = 0
+        for origin, destination in pairs:
+            try:
+                query(origin, destination)
+                done += 1
+            except NoPathError:  # unreachable destinations are not counted
+                pass
+        return done
+    done, record = measure(run, memory)
+    record['unreachable'] = len(pairs) - done
+    return per_call(record, len(pairs))
+
+
+def bench_agent(wmap, grp, pairs, ticks, memory):
+    """ Drives an agent along each route for up to ticks ticks, timing run_step """
+    def run():
+        client = carla.Client(wmap=wmap)
+        world = client.get_world()
+        settings = world.get_settings()
+        settings.synchronous_mode = True
+        settings.fixed_delta_seconds = 0.05
+        world.apply_settings(settings)
+        blueprint = world.get_blueprint_library().filter('bmw')[0]
+        step_time, steps = 0.0, 0
+        for origin, destination in pairs:
+            vehicle = world.spawn_actor(blueprint, wmap.get_waypoint(origin).transform)
+            world.tick()
+            agent = Agent(vehicle, grp=grp, visualize=False)
+            agent.set_route(origin, destination)
+            for _ in range(ticks):
+                if agent.arrived():
+                    break
+                world.tick()
+                begin = time.perf_counter()
+                control = agent.run_step(speed=30)
+                step_time += time.perf_counter() - begin
+                steps += 1
+                vehicle.apply_control(control or agent.emergency_stop())
+            agent.obstacle_sensor.stop()
+            client.apply_batch([carla.command.DestroyActor(actor.id)
+                                for actor in (vehicle, agent._camera, agent.obstacle_sensor)])
+        return step_time, steps
+    (step_time, steps), record = measure(run, memory)
+    record = per_call(record, steps)
+    # The loop also ticks the world and sets up the agents: time run_step alone
+    record['wall_time_per_call'] = step_time / max(steps, 1)
+    return record
+
+
+def bench_pid(wmap, steps, memory):
+    """ VehiclePIDController.run_step with the vehicle state read once per tick """
+    def run():
+        world = carla.Client(wmap=wmap).get_world()
+        spawn_points = wmap.get_spawn_points()
+        vehicle = world.spawn_actor(world.get_blueprint_library().filter('bmw')[0], spawn_points[0])
+        controller = pid.VehiclePIDController(vehicle, {'K_P': 0.58, 'K_D': 0.4, 'K_I': 0.5},
+                                              {'K_P': 0.15, 'K_D': 0.05, 'K_I': 0.07}, max_throttle=1)
+        target = wmap.get_waypoint(spawn_points[0].location).next(10.0)[0]
+        for step in range(steps):
+            controller.run_step(30, target, VehicleState(step, spawn_points[step % len(spawn_points)], None,
+                                                         float(step % 50), 30))
+    _, record = measure(run, memory)
+    return per_call(record, steps)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def format_resolution(resolution):
+    """ Sampling resolution of a result as printed, - for benchmarks that do not depend on it """
+    return '%4.1f m' % resolution if resolution is not None else '     -'
+
+
+def compare(results, baseline):
+    """ Prints the ratio of every wall time and memory figure to the one of a baseline run """
+    old = {(r['map'], r['resolution'], r['benchmark']): r for r in baseline['results']}
+    print('\ncompared with %s (%s):' % (baseline.get('commit'), baseline.get('date')))
+    for result in results:
+        previous = old.get((result['map'], result['resolution'], result['benchmark']))
+        if previous is None:
+            continue
+        changes = []
+        for key in ('wall_time_per_call', 'peak_memory', 'server_calls_per_call'):
+            if key in result and previous.get(key):
+                changes.append('%s %.2fx' % (key, result[key] / previous[key]))
+        print('%-28s %s %-20s %s' % (result['map'], format_resolution(result['resolution']), result['benchmark'],
+                                     ', '.join(changes)))
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument('-s', '--sizes', default='100,1000,10000',
+                           help='comma separated numbers of lane segments of the maps')
+    argparser.add_argument('-r', '--resolutions', default='2.0', help='comma separated sampling resolutions in metres')
+    argparser.add_argument('--densification', default='walk', choices=DENSIFICATIONS,
+                           help='sampling of the topology segments by the planner setup')
+    argparser.add_argument('--lanes', default=2, type=int, help='lanes per direction of the grid roads')
+    argparser.add_argument('--block', default=80.0, type=float, help='distance between grid junctions in metres')
+    argparser.add_argument('-n', '--routes', default=50, type=int, help='routes per query benchmark')
+    argparser.add_argument('-l', '--route-length', default=300.0, type=float,
+                           help='straight line distance between route ends in metres')
+    argparser.add_argument('--agent-routes', default=3, type=int, help='routes driven by the agent')
+    argparser.add_argument('--ticks', default=300, type=int, help='ticks per agent route')
+    argparser.add_argument('--pid-steps', default=2000, type=int, help='controller steps')
+    argparser.add_argument('--no-memory', action='store_true', help='skip the traced runs measuring memory')
+    argparser.add_argument('--seed', default=0, type=int, help='random seed of the routes')
+    argparser.add_argument('-o', '--output', default='benchmark_results.json', help='JSON file of the results')
+    argparser.add_argument('--compare', default=None, help='JSON file of an earlier run to compare with')
+    args = argparser.parse_args()
+    memory = not args.no_memory
+
+    results = []
+    for size in [int(value) for value in args.sizes.split(',')]:
+        wmap = grid_for(size, args.lanes, args.block)
+        segments = len(wmap.get_topology())
+
+        def add(benchmark, record, resolution):
+            record.update({'map': wmap.name, 'lane_segments': segments, 'resolution': resolution,
+                           'benchmark': benchmark})
+            results.append(record)
+            print('%-24s %6d segments %s %-20s %10.3f ms/call %8.2f calls/call%s' % (
+                wmap.name, segments, format_resolution(resolution), benchmark,
+                record['wall_time_per_call'] * 1e3, record['server_calls_per_call'],
+                ' %8.1f MB' % (record['peak_memory'] / 1e6) if 'peak_memory' in record else ''))
+
+        for resolution in [float(value) for value in args.resolutions.split(',')]:
+            rng = random.Random(args.seed)
+            spawn_points = wmap.get_spawn_points()
+            pairs = route_pairs(spawn_points, args.routes, args.route_length, rng)
+            grp, record = bench_setup(wmap, resolution, args.densification, memory)
+            add('setup', record, resolution)
+            add('trace_route', bench_queries(grp.trace_route, pairs, memory), resolution)
+            add('abstract_route_plan', bench_queries(grp.abstract_route_plan, pairs, memory), resolution)
+            add('agent_run_step', bench_agent(wmap, grp, pairs[:args.agent_routes], args.ticks, memory), resolution)
+        add('pid_run_step', bench_pid(wmap, args.pid_steps, memory), None)
+
+    report = {'commit': git_commit(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'python': platform.python_version(), 'arguments': vars(args), 'results': results}
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2)
+    print('results saved to %s' % args.output)
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(results, json.load(baseline))
+
+
+if __name__ == '__main__':
+    main()
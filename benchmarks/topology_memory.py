@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+"""
+Memory benchmark of the densified topology used by GlobalRoutePlanner.
+
+Compares the CompactTopology arrays returned by
+GlobalRoutePlannerDAO.get_topology() against the previous layout, a list of
+dictionaries holding Python lists of live carla.Waypoint objects, on the map
+currently loaded in the simulator.
+"""
+
+import argparse
+import gc
+import glob
+import os
+import pickle
+import sys
+import time
+import tracemalloc
+
+try:
+    sys.path.append(glob.glob('../carla/dist/carla-*%d.%d-%s.egg' % (
+        sys.version_info.major,
+        sys.version_info.minor,
+        'win-amd64' if os.name == 'nt' else 'linux-x86_64'))[0])
+except IndexError:
+    pass
+import carla
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.navigation.global_route_planner_dao import GlobalRoutePlannerDAO
+
+
+def resident_memory():
+    """ Current resident set size in bytes, or None where /proc is unavailable """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def measure(build):
+    """ Runs build() and returns (result, seconds, python heap bytes, rss bytes) """
+    gc.collect()
+    rss_before = resident_memory()
+    tracemalloc.start()
+    start = time.time()
+    result = build()
+    elapsed = time.time() - start
+    heap, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    gc.collect()
+    rss_after = resident_memory()
+    rss = rss_after - rss_before if rss_before is not None else None
+    return result, elapsed, heap, rss
+
+
+def waypoint_layout(topology, dao):
+    """ Rebuilds the list-of-waypoints layout the planner used before CompactTopology """
+    segments = []
+    for segment in range(len(topology)):
+        points = topology.point_indices(segment)
+        waypoints = [topology.waypoint(index, dao) for index in points]
+        segments.append({
+            'entry': waypoints[0], 'exit': waypoints[-1],
+            'entryxyz': topology.entry_key(segment), 'exitxyz': topology.exit_key(segment),
+            'path': waypoints[1:-1]})
+    return segments
+
+
+def pickled_size(value):
+    try:
+        return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+    except (pickle.PicklingError, TypeError, RuntimeError):
+        return None
+
+
+def megabytes(value):
+    return 'n/a' if value is None else '%.2f MB' % (value / 1e6)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument('--host', default='127.0.0.1', help='IP of the host server')
+    argparser.add_argument('-p', '--port', default=2000, type=int, help='TCP port to listen to')
+    argparser.add_argument('-r', '--resolution', default=2.0, type=float, help='sampling resolution in metres')
+    args = argparser.parse_args()
+
+    client = carla.Client(args.host, args.port)
+    client.set_timeout(10.0)
+    dao = GlobalRoutePlannerDAO(client.get_world().get_map(), args.resolution)
+
+    topology, compact_time, compact_heap, compact_rss = measure(dao.get_topology)
+    legacy, legacy_time, legacy_heap, legacy_rss = measure(lambda: waypoint_layout(topology, dao))
+
+    points = topology.num_points
+    print('map %s, %d segments, %d points at %.1f m' % (dao.get_map_name(), len(topology), points, args.resolution))
+    print('%-22s %14s %14s %14s %10s' % ('layout', 'python heap', 'rss delta', 'pickled', 'build'))
+    print('%-22s %14s %14s %14s %9.2fs' % (
+        'CompactTopology', megabytes(compact_heap), megabytes(compact_rss),
+        megabytes(pickled_size(topology)), compact_time))
+    print('%-22s %14s %14s %14s %9.2fs' % (
+        'list of carla.Waypoint', megabytes(legacy_heap), megabytes(legacy_rss),
+        megabytes(pickled_size(legacy)), legacy_time))
+    print('array payload: %s (%.1f bytes per point)' % (megabytes(topology.nbytes), topology.nbytes / float(points)))
+
+
+if __name__ == '__main__':
+    main()
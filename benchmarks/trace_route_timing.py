@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+"""
+Timing benchmark of GlobalRoutePlanner.trace_route on long routes.
+
+Routes join the spawn point pairs of the current map that are farthest
+apart. Run it on two commits to compare their trace_route cost.
+"""
+
+import argparse
+import glob
+import os
+import random
+import sys
+import time
+
+try:
+    sys.path.append(glob.glob('../carla/dist/carla-*%d.%d-%s.egg' % (
+        sys.version_info.major,
+        sys.version_info.minor,
+        'win-amd64' if os.name == 'nt' else 'linux-x86_64'))[0])
+except IndexError:
+    pass
+import carla
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.navigation.global_route_planner import GlobalRoutePlanner
+from agents.navigation.global_route_planner_dao import GlobalRoutePlannerDAO
+
+
+def long_pairs(spawn_points, count, seed):
+    """ Picks the count farthest-apart spawn point pairs out of a random sample """
+    rng = random.Random(seed)
+    candidates = [(rng.randrange(len(spawn_points)), rng.randrange(len(spawn_points)))
+                  for _ in range(count * 20)]
+    candidates.sort(key=lambda pair: -spawn_points[pair[0]].location.distance(spawn_points[pair[1]].location))
+    return candidates[:count]
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument('--host', default='127.0.0.1', help='IP of the host server')
+    argparser.add_argument('-p', '--port', default=2000, type=int, help='TCP port to listen to')
+    argparser.add_argument('-r', '--resolution', default=2.0, type=float, help='sampling resolution in metres')
+    argparser.add_argument('-n', '--routes', default=20, type=int, help='number of routes')
+    argparser.add_argument('--repeat', default=3, type=int, help='timed runs per route, the best one is kept')
+    argparser.add_argument('--seed', default=0, type=int, help='random seed of the route sample')
+    args = argparser.parse_args()
+
+    client = carla.Client(args.host, args.port)
+    client.set_timeout(10.0)
+    wmap = client.get_world().get_map()
+    # Repeated runs of a route would only measure the route cache
+    grp = GlobalRoutePlanner(GlobalRoutePlannerDAO(wmap, args.resolution), route_cache_size=0)
+    grp.setup()
+    spawn_points = wmap.get_spawn_points()
+
+    total_time, total_waypoints, routes = 0.0, 0, 0
+    for origin, destination in long_pairs(spawn_points, args.routes, args.seed):
+        start, end = spawn_points[origin].location, spawn_points[destination].location
+        try:
+            best = float('inf')
+            for _ in range(args.repeat):
+                begin = time.perf_counter()
+                trace = grp.trace_route(start, end)
+                best = min(best, time.perf_counter() - begin)
+        except Exception as error:  # unreachable destinations are skipped
+            print('route %d -> %d skipped: %s' % (origin, destination, error))
+            continue
+        routes += 1
+        total_time += best
+        total_waypoints += len(trace)
+        print('route %4d -> %4d: %6d waypoints %9.2f ms' % (origin, destination, len(trace), best * 1e3))
+
+    if routes:
+        print('%d routes, %.1f waypoints on average, %.2f ms per route, %.2f us per waypoint' % (
+            routes, total_waypoints / float(routes), total_time / routes * 1e3,
+            total_time / max(total_waypoints, 1) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -18,7 +18,8 @@ except IndexError:
     pass
 
 
-from agents.navigation.unb_agent import Agent
+from agents.navigation.unb_agent import GRAPH_CACHE_DIR, Agent
+from agents.tools.loop_runner import SynchronousLoop
 
 """
 Esse script consiste na implementação de alguns módulos de veículos autônomos:
@@ -80,22 +81,37 @@ def main():
 
         world.tick()
 
-        # Cria agente e o vincula ao ego veículo 
-        agent = Agent(vehicle, ignore_traffic_light=False)
+        # Cria agente e o vincula ao ego veículo; o grafo do mapa fica em cache
+        # em disco, de modo que só a primeira execução o constrói
+        agent = Agent(vehicle, ignore_traffic_light=False, graph_cache_dir=GRAPH_CACHE_DIR)
         actor_list.append(agent._camera)
         actor_list.append(agent.obstacle_sensor)
         # Gera rota
         agent.set_route(spawn_point.location, destination_point.location)
 
-        # Gameloop
-        while not agent.arrived():
-            world.tick()
-            world.get_spectator().set_transform(agent._camera.get_transform())
+        spectator = world.get_spectator()
+
+        def step(snapshot):
+            # Estado do tick lido de um único snapshot, usado pelo agente e pelos controladores
+            state = agent.update_state(snapshot)
             # Gera o comando de controle ao veículo
-            control = agent.run_step(speed=(vehicle.get_speed_limit())) or agent.emergency_stop()
-            vehicle.apply_control(control)
-            # Visualização da rota
-            agent.show_path(distance=int(agent.get_speed(vehicle)/2))
+            control = agent.run_step(speed=state.speed_limit, state=state) or agent.emergency_stop()
+            camera_transform = snapshot.find(agent._camera.id).get_transform()
+            # Cópia dos próximos waypoints: a tarefa paralela não lê a rota, que
+            # o próximo run_step altera
+            path_section = agent.route.section(int(state.speed/2))
+            elapsed_seconds = snapshot.timestamp.elapsed_seconds
+
+            def visualization():
+                # Câmera e visualização da rota, feitas em paralelo com o próximo tick
+                spectator.set_transform(camera_transform)
+                agent.show_path(elapsed_seconds=elapsed_seconds, section=path_section)
+
+            return [carla.command.ApplyVehicleControl(vehicle.id, control)], visualization
+
+        # Gameloop: o comando de controle é aplicado junto com o tick do servidor
+        stats = SynchronousLoop(client, world).run(step, agent.arrived)
+        print('%.1f FPS (simulação a %.1f FPS)' % (stats.fps, stats.target_fps))
 
     finally:
         print("Destino alcançado!")